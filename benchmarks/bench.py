@@ -0,0 +1,489 @@
+"""
+Offline benchmarks of the pipeline hot paths.
+
+Every remote service is replaced by the stand-in server, so the suite runs
+without network access or credentials. Results are written as JSON and
+compared against a stored baseline:
+
+    python -m benchmarks.bench                    # run and compare with benchmarks/baseline.json
+    python -m benchmarks.bench --quick            # 1k instead of 10k products
+    python -m benchmarks.bench --cases download orbits
+    python -m benchmarks.bench --update-baseline  # store the results as the new baseline
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import subprocess
+import argparse
+import platform
+import tempfile
+import datetime
+import statistics
+import contextlib
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import requests
+import insarchitect
+from rich.progress import Progress
+
+from insarchitect.models import ProjectConfig, SystemConfig, DownloadConfig, DemConfig, JobfilesConfig
+from insarchitect.core.download.download import create_kml, resume_incomplete_downloads, build_search_options, search_cache_dir
+from insarchitect.core.download.search_cache import save_search, windowed_search, split_windows
+from insarchitect.core.download.transfer import download_products
+from insarchitect.core.dem.get_boundingbox_from_kml import process_kml
+from insarchitect.core.dem import tile_cache
+from insarchitect.core.dem.tiles import tile_name
+from insarchitect.core.dem.crop import crop_dem
+from insarchitect.core.jobfiles.download_orbits import download_orbits
+from insarchitect.core.jobfiles.orbit_store import OrbitIndex, Scene
+from insarchitect.core.jobfiles.state_vectors import parse_eof
+from insarchitect.core.pipeline import Scheduler, schedule_run, STEP_ORDER
+from insarchitect.core.import_profile import profile_import
+
+from .synthetic import make_products, write_run_files, SearchStandIn, START_DATE, REVISIT, SCENE_DURATION
+from .synthetic import orbit_name, orbit_content, orbit_state, scene_name, ORBIT_START, ORBIT_SPACING, write_dem
+from .standin_server import StandInServer, StandInConfig
+
+BENCH_DIR = Path(__file__).parent
+BASELINE_PATH = BENCH_DIR / "baseline.json"
+RESULTS_DIR = BENCH_DIR / "results"
+# a case regresses when it is this many times slower than its baseline
+DEFAULT_THRESHOLD = 1.5
+
+CASES = {}
+
+
+def case(name: str):
+    def register(func):
+        CASES[name] = func
+        return func
+    return register
+
+
+class Bench:
+    """
+    Shared state of a benchmark session.
+
+    Args:
+        root: Scratch directory of the session
+        repeats: Timed runs per case, the median is reported
+        products: Size of the large synthetic result sets
+    """
+
+    def __init__(self, root: Path, repeats: int, products: int):
+        self.root = root
+        self.repeats = repeats
+        self.products = products
+
+    def directory(self, name: str) -> Path:
+        path = self.root / name
+        shutil.rmtree(path, ignore_errors=True)
+        path.mkdir(parents=True)
+        return path
+
+    def measure(self, func, setup=None, repeats=None) -> dict:
+        """Time func after setup, with the step output silenced"""
+        runs = []
+        for _ in range(repeats or self.repeats):
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                if setup is not None:
+                    setup()
+                started = time.perf_counter()
+                func()
+                runs.append(time.perf_counter() - started)
+        return {"seconds": statistics.median(runs), "min": min(runs), "runs": runs}
+
+
+def http_tile_fetcher(base_url: str):
+    """TileCache fetch function reading tiles from the stand-in server"""
+    def fetch(tile, data_source, directory):
+        name = f"{tile_name(tile)}_{data_source}.dem"
+        path = directory / name
+        with requests.get(f"{base_url}/dem/{name}", stream=True, timeout=60) as response:
+            response.raise_for_status()
+            with open(path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    f.write(chunk)
+        return path
+    return fetch
+
+
+def write_isce_xml(fname):
+    """Stand-in for sardem.utils.gdal2isce_xml when GDAL/ISCE are not installed"""
+    Path(f"{fname}.xml").write_text("<imageFile/>\n")
+    Path(f"{fname}.vrt").write_text("<VRTDataset/>\n")
+
+
+def project_config(root: Path, base_url: str, name: str = "bench") -> ProjectConfig:
+    system = SystemConfig(
+        scratch_dir=root / "scratch",
+        work_dir=root / "work",
+        orbits_dir=root / "orbits",
+        slurm_partition="bench",
+        executor="local",
+        max_parallel_jobs=4,
+    )
+    download = DownloadConfig(
+        relative_orbit=128,
+        start_date=20160830,
+        end_date=20161031,
+        bounding_box="POLYGON((-99.20 19.25, -99.10 19.25, -99.10 19.35, -99.20 19.35, -99.20 19.25))",
+        offline=True,
+    )
+    for path in (system.work_dir, system.orbits_dir):
+        path.mkdir(parents=True, exist_ok=True)
+    return ProjectConfig(
+        download=download,
+        dem=DemConfig(),
+        jobfiles=JobfilesConfig(jobfiles_dir=Path("./jobs")),
+        system=system,
+        project_name=name,
+    )
+
+
+def cache_results(config: ProjectConfig, results):
+    """Store results as the cached search of the project, so offline runs replay them"""
+    save_search(search_cache_dir(config), build_search_options(config.download), results)
+
+
+@case("create_kml")
+def bench_create_kml(bench: Bench) -> dict:
+    products = make_products(bench.products)
+    directory = bench.directory("create_kml")
+    result = bench.measure(lambda: create_kml(directory, products))
+    result["products"] = len(products)
+    return result
+
+
+@case("process_kml")
+def bench_process_kml(bench: Bench) -> dict:
+    products = make_products(bench.products)
+    directory = bench.directory("process_kml")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        create_kml(directory, products)
+    kml_file = next(directory.glob("ssara_*.kml"))
+    result = bench.measure(lambda: process_kml(kml_file, 0.1, 0.1))
+    result.update(products=len(products), kml_bytes=kml_file.stat().st_size)
+    return result
+
+
+@case("resume_incomplete_downloads")
+def bench_resume_incomplete_downloads(bench: Bench) -> dict:
+    size = 1024**3
+    products = make_products(bench.products, size=size)
+    directory = bench.directory("resume")
+
+    def setup():
+        # sparse files: a quarter complete, short, oversized and missing each
+        for path in directory.iterdir():
+            path.unlink()
+        for index, product in enumerate(products):
+            path = directory / product.properties["fileName"]
+            kind = index % 4
+            if kind == 3:
+                continue
+            with open(path, "wb") as f:
+                f.truncate((size, size // 2, size + 1)[kind])
+
+    result = bench.measure(lambda: resume_incomplete_downloads(directory, products), setup=setup)
+    result["products"] = len(products)
+    return result
+
+
+@case("search")
+def bench_search(bench: Bench) -> dict:
+    """Windowed search against a stand-in answering in 0.2 s plus 0.5 ms per product"""
+    count = min(bench.products, 1200)
+    products = make_products(count)
+    standin = SearchStandIn(products, latency=0.2, per_product=0.0005)
+    opts = {
+        "platform": "SENTINEL-1",
+        "relativeOrbit": 128,
+        "maxResults": 250,
+        "start": START_DATE,
+        "end": START_DATE + REVISIT * (count // 3 + 1),
+        "processingLevel": "SLC",
+        "intersectsWith": "POLYGON((-99.20 19.25, -99.10 19.25, -99.10 19.35, -99.20 19.35, -99.20 19.25))",
+    }
+    first_window = []
+
+    def search():
+        started = time.perf_counter()
+        found = 0
+        for window in windowed_search(opts, bench.root / "search_cache", ttl=0, window_days=90, workers=4, search_fn=standin):
+            if not found:
+                first_window.append(time.perf_counter() - started)
+            found += len(window)
+        assert found == count, f"found {found} of {count} products"
+
+    result = bench.measure(search)
+    result.update(
+        products=count,
+        windows=len(split_windows(opts, 90)),
+        first_window_seconds=statistics.median(first_window),
+        calls=standin.calls,
+    )
+    return result
+
+
+@case("download")
+def bench_download(bench: Bench) -> dict:
+    count, size, workers = 16, 8 * 1024**2, 8
+    config = StandInConfig(latency=0.01, bandwidth=32 * 1024**2, drop_rate=0.1, seed=1)
+    with StandInServer(config) as server:
+        products = make_products(count, base_url=server.base_url, size=size, with_md5=True)
+        directory = bench.directory("download")
+
+        def setup():
+            for path in directory.iterdir():
+                path.unlink()
+
+        # retries back off for seconds, the stand-in drops are immediate
+        with mock.patch("insarchitect.core.download.transfer.backoff_delay", return_value=0):
+            # the engine at its full width, the adaptive limit only grows every few seconds of transfers
+            result = bench.measure(lambda: download_products(products, directory, workers=workers, adaptive=False), setup=setup)
+            adaptive = bench.measure(lambda: download_products(products, directory, workers=workers), setup=setup, repeats=1)
+        result.update(
+            products=count,
+            bytes=count * size,
+            bytes_per_second=count * size / result["seconds"],
+            adaptive_seconds=adaptive["seconds"],
+            server=dict(server.stats),
+        )
+    return result
+
+
+@case("orbits")
+def bench_orbits(bench: Bench) -> dict:
+    count = min(bench.products, 600)
+    with StandInServer(StandInConfig(latency=0.02)) as server:
+        root = bench.directory("orbits")
+        config = project_config(root, server.base_url)
+        products = make_products(count, base_url=server.base_url)
+        cache_results(config, products)
+
+        def setup():
+            shutil.rmtree(config.system.orbits_dir, ignore_errors=True)
+            config.system.orbits_dir.mkdir()
+
+        with mock.patch("s1_orbits.s1_orbits.API_URL", f"{server.base_url}/scene"):
+            result = bench.measure(lambda: asyncio.run(download_orbits(config)), setup=setup)
+        result.update(scenes=count, server=dict(server.stats))
+    return result
+
+
+@case("orbit_states")
+def bench_orbit_states(bench: Bench) -> dict:
+    count = 1000
+    orbits_dir = bench.directory("orbit_states")
+    eof_path = orbits_dir / orbit_name(scene_name(0))
+    eof_path.write_text(orbit_content())
+    # one scene a minute over the day of the orbit file
+    scenes = []
+    for i in range(count):
+        start = START_DATE + datetime.timedelta(minutes=i)
+        scenes.append(Scene(f"bench_{i}", "S1A", start, start + SCENE_DURATION))
+
+    parse_started = time.perf_counter()
+    parse_eof(eof_path)
+    parse_seconds = time.perf_counter() - parse_started
+    index = OrbitIndex(orbits_dir)
+    convert_started = time.perf_counter()
+    vectors_path = index.vectors.convert(eof_path)
+    convert_seconds = time.perf_counter() - convert_started
+
+    states = None
+
+    def query():
+        nonlocal states
+        # a fresh index, the vectors are memory mapped again
+        states = OrbitIndex(orbits_dir).vectors.stack_states(index, scenes)
+
+    result = bench.measure(query)
+    seconds = (states.times - np.datetime64(ORBIT_START, "ns")).astype(np.int64) / 1e9
+    expected = np.array([orbit_state(t)[0] for t in seconds])
+    # midway between two state vectors, where the interpolation is worst
+    midpoints = (np.arange(0, 9000, 90) + 0.5) * ORBIT_SPACING
+    positions, _ = index.vectors.load(eof_path).interpolate_seconds(midpoints)
+    midpoint_error = np.linalg.norm(positions - np.array([orbit_state(t)[0] for t in midpoints]), axis=1).max()
+    result.update(
+        scenes=count,
+        xml_parse_seconds=parse_seconds,
+        convert_seconds=convert_seconds,
+        eof_bytes=eof_path.stat().st_size,
+        vectors_bytes=vectors_path.stat().st_size,
+        max_error_m=float(np.linalg.norm(states.positions - expected, axis=1).max()),
+        max_midpoint_error_m=float(midpoint_error),
+    )
+    return result
+
+
+@case("dem_crop")
+def bench_dem_crop(bench: Bench) -> dict:
+    directory = bench.directory("dem_crop")
+    # 2x2 degrees at 1 arcsecond, 200 MB of float32
+    source = write_dem(directory / "elevation.dem", west=-100, north=20, degrees=2)
+    aoi = (-99.6, 18.6, -98.7, 19.5)
+    budget = 64 * 1024**2
+
+    crop = bench.measure(lambda: crop_dem(source, directory / "crop.dem", bounds=aoi, memory_budget=budget))
+    result = bench.measure(lambda: crop_dem(source, directory / "resampled.dem", bounds=aoi, step=1 / 1200, memory_budget=budget))
+    result.update(
+        source_bytes=source.stat().st_size,
+        memory_budget=budget,
+        crop_seconds=crop["seconds"],
+        crop_bytes=(directory / "crop.dem").stat().st_size,
+        resampled_bytes=(directory / "resampled.dem").stat().st_size,
+    )
+    return result
+
+
+def run_pipeline(config: ProjectConfig, steps=None):
+    steps = set(steps or STEP_ORDER)
+    scheduler = Scheduler({"download": config.download.parallel_downloads})
+    with Progress(disable=True) as progress:
+        schedule_run(scheduler, config, steps, progress)
+        scheduler.run()
+
+
+@contextlib.contextmanager
+def pipeline_standins(server: StandInServer):
+    """Point the orbit service and DEM tiles to the stand-in server"""
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(mock.patch("s1_orbits.s1_orbits.API_URL", f"{server.base_url}/scene"))
+        stack.enter_context(mock.patch.object(tile_cache, "fetch_tile", http_tile_fetcher(server.base_url)))
+        try:
+            import osgeo  # noqa: F401
+        except ImportError:
+            stack.enter_context(mock.patch("sardem.utils.gdal2isce_xml", write_isce_xml))
+        yield
+
+
+def prepare_project(bench: Bench, server: StandInServer, name: str) -> ProjectConfig:
+    root = bench.directory(name)
+    config = project_config(root, server.base_url)
+    # small footprints keep the DEM to a couple of tiles
+    products = make_products(8, base_url=server.base_url, size=4 * 1024**2, with_md5=True, width=0.4, height=0.3)
+    cache_results(config, products)
+    write_run_files(config.system.work_dir / config.project_name / "run_files", {"unpack_secondary_slc": 24, "unwrap": 8})
+    return config
+
+
+@case("run")
+def bench_run(bench: Bench) -> dict:
+    with StandInServer(StandInConfig(latency=0.01, bandwidth=64 * 1024**2)) as server, pipeline_standins(server):
+        configs = []
+
+        def setup():
+            configs.append(prepare_project(bench, server, "run"))
+
+        result = bench.measure(lambda: run_pipeline(configs[-1]), setup=setup)
+        result["server"] = dict(server.stats)
+    return result
+
+
+@case("run_up_to_date")
+def bench_run_up_to_date(bench: Bench) -> dict:
+    with StandInServer(StandInConfig()) as server, pipeline_standins(server):
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            config = prepare_project(bench, server, "run_up_to_date")
+            run_pipeline(config)
+        return bench.measure(lambda: run_pipeline(config))
+
+
+@case("cli_startup")
+def bench_cli_startup(bench: Bench) -> dict:
+    """insarchitect --help in a fresh interpreter, what every job array task pays before its work"""
+    source_dir = str(Path(insarchitect.__file__).parents[1])
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [source_dir, os.environ.get("PYTHONPATH")]))}
+    command = [sys.executable, "-m", "insarchitect.cli", "--help"]
+    result = bench.measure(
+        lambda: subprocess.run(command, env=env, stdout=subprocess.DEVNULL, check=True),
+        repeats=max(bench.repeats, 5),
+    )
+    startup = profile_import("startup", ["insarchitect.cli"])
+    result.update(import_seconds=startup.import_seconds, slowest_packages=dict(startup.packages))
+    return result
+
+
+def compare(results: dict, baseline: dict, default_threshold: float) -> list:
+    """Return (case, seconds, baseline seconds, ratio, threshold) of the regressed cases, printing a table"""
+    thresholds = baseline.get("thresholds", {})
+    regressions = []
+    print(f"\n{'case':32} {'seconds':>10} {'baseline':>10} {'ratio':>7}")
+    for name, result in results["cases"].items():
+        reference = baseline.get("cases", {}).get(name)
+        if reference is None:
+            print(f"{name:32} {result['seconds']:10.4f} {'-':>10} {'-':>7}")
+            continue
+        ratio = result["seconds"] / reference["seconds"]
+        threshold = thresholds.get(name, default_threshold)
+        flag = "  REGRESSION" if ratio > threshold else ""
+        print(f"{name:32} {result['seconds']:10.4f} {reference['seconds']:10.4f} {ratio:7.2f}{flag}")
+        if ratio > threshold:
+            regressions.append((name, result["seconds"], reference["seconds"], ratio, threshold))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the InSARchitect pipeline")
+    parser.add_argument("--cases", nargs="+", choices=sorted(CASES), help="Cases to run (default: all)")
+    parser.add_argument("--quick", action="store_true", help="Use 1k instead of 10k products")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per case")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH, help="Baseline to compare with")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Slowdown ratio counted as a regression")
+    parser.add_argument("--output", type=Path, help="Results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--update-baseline", action="store_true", help="Store the results as the new baseline")
+    args = parser.parse_args(argv)
+
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "products": 1000 if args.quick else 10000,
+        "cases": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="insarchitect-bench-") as root:
+        bench = Bench(Path(root), args.repeats, results["products"])
+        for name in args.cases or CASES:
+            print(f"Running {name}...", flush=True)
+            results["cases"][name] = CASES[name](bench)
+            print(f"  {results['cases'][name]['seconds']:.4f} s", flush=True)
+
+    output = args.output or RESULTS_DIR / f"{time.strftime('%Y%m%dT%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=1))
+    print(f"Results written to {output}")
+
+    if args.update_baseline:
+        thresholds = {}
+        if args.baseline.exists():
+            thresholds = json.loads(args.baseline.read_text()).get("thresholds", {})
+        baseline = {**results, "thresholds": thresholds}
+        args.baseline.write_text(json.dumps(baseline, indent=1))
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}, run with --update-baseline to create one")
+        return 0
+
+    baseline = json.loads(args.baseline.read_text())
+    if baseline.get("products") != results["products"]:
+        print(f"Baseline was recorded with {baseline.get('products')} products, comparing anyway")
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} cases regressed")
+        return 1
+    print("\nNo regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
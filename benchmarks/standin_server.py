@@ -0,0 +1,197 @@
+"""Local HTTP server standing in for ASF downloads, the orbit service and DEM tiles"""
+import time
+import random
+import threading
+from dataclasses import dataclass
+from typing import Optional
+from urllib.parse import unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from insarchitect.core.dem.tiles import TILE_PIXELS
+
+from .synthetic import payload_chunks, orbit_name, orbit_content
+
+SEND_CHUNK_SIZE = 64 * 1024
+
+
+@dataclass
+class StandInConfig:
+    """
+    Network conditions of the stand-in server.
+
+    Args:
+        latency: Seconds before the response headers of each request
+        bandwidth: Bytes per second of each connection, None for unlimited
+        drop_rate: Probability that a file transfer is cut halfway
+        error_rate: Probability that a request is answered with 503
+        throttle_rate: Probability that a request is answered with 429
+        seed: Seed of the failure draws, runs with the same seed fail the same way
+    """
+    latency: float = 0.0
+    bandwidth: Optional[float] = None
+    drop_rate: float = 0.0
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    seed: int = 0
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def standin(self) -> "StandInServer":
+        return self.server.standin
+
+    def do_GET(self):
+        standin = self.standin
+        standin.count("requests")
+        if standin.config.latency:
+            time.sleep(standin.config.latency)
+
+        if standin.draw(standin.config.throttle_rate):
+            standin.count("throttled")
+            return self.send_empty(429, {"Retry-After": "1"})
+        if standin.draw(standin.config.error_rate):
+            standin.count("errors")
+            return self.send_empty(503)
+
+        parts = unquote(self.path.split("?")[0]).strip("/").split("/")
+        if len(parts) == 3 and parts[0] == "slc":
+            return self.send_payload(parts[2], int(parts[1]))
+        if len(parts) == 2 and parts[0] == "scene":
+            return self.send_empty(302, {"Location": f"/orbits/{orbit_name(parts[1])}"})
+        if len(parts) == 2 and parts[0] == "orbits":
+            return self.send_body(200, standin.orbit_body(), "application/xml")
+        if len(parts) == 2 and parts[0] == "dem":
+            return self.send_tile(parts[1])
+        self.send_empty(404)
+
+    def send_empty(self, status: int, headers: Optional[dict] = None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_body(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.write_chunks([body])
+
+    def send_payload(self, name: str, size: int):
+        offset = 0
+        range_header = self.headers.get("Range")
+        if range_header:
+            offset = int(range_header.split("=")[1].split("-")[0])
+            if offset >= size:
+                return self.send_empty(416)
+
+        self.send_response(206 if range_header else 200)
+        if range_header:
+            self.send_header("Content-Range", f"bytes {offset}-{size - 1}/{size}")
+        self.send_header("Content-Length", str(size - offset))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+        drop_at = None
+        if self.standin.draw(self.standin.config.drop_rate):
+            drop_at = (size - offset) // 2
+        self.write_chunks(payload_chunks(name, size, offset, SEND_CHUNK_SIZE), drop_at)
+
+    def send_tile(self, name: str):
+        """Raw float32 1x1 degree tile, elevation derived from the tile name"""
+        elevation = float(sum(name.encode()) % 3000)
+        row = np.full(TILE_PIXELS, elevation, dtype=np.float32).tobytes()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(row) * TILE_PIXELS))
+        self.end_headers()
+        self.write_chunks(row for _ in range(TILE_PIXELS))
+
+    def write_chunks(self, chunks, drop_at: Optional[int] = None):
+        bandwidth = self.standin.config.bandwidth
+        started = time.perf_counter()
+        sent = 0
+        try:
+            for chunk in chunks:
+                if drop_at is not None and sent + len(chunk) > drop_at:
+                    self.wfile.write(chunk[:drop_at - sent])
+                    self.wfile.flush()
+                    self.standin.count("drops")
+                    self.close_connection = True
+                    self.connection.shutdown(2)
+                    return
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                if bandwidth:
+                    # sleep until the connection is back under its bandwidth
+                    ahead = sent / bandwidth - (time.perf_counter() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        finally:
+            self.standin.count("bytes_sent", sent)
+
+
+class StandInServer:
+    """
+    Threaded stand-in for the remote services, serving:
+
+    - /slc/<size>/<file name>: deterministic product payloads with Range support
+    - /scene/<scene name>: redirect to the orbit file of the scene, like s1_orbits' API
+    - /orbits/<EOF name>: EOF XML
+    - /dem/<tile name>: raw float32 DEM tiles
+
+    Use as a context manager, base_url is valid while it runs.
+    """
+
+    def __init__(self, config: Optional[StandInConfig] = None, orbit_vectors: int = 9361):
+        self.config = config or StandInConfig()
+        self.orbit_vectors = orbit_vectors
+        self.stats = {}
+        self._orbit_body = None
+        self._lock = threading.Lock()
+        self._random = random.Random(self.config.seed)
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+        self._server.daemon_threads = True
+        self._server.standin = self
+        self._thread = None
+
+    def orbit_body(self) -> bytes:
+        """EOF XML served for every orbit file, built once since it takes longer than the transfer"""
+        with self._lock:
+            if self._orbit_body is None:
+                self._orbit_body = orbit_content(self.orbit_vectors).encode()
+            return self._orbit_body
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def draw(self, probability: float) -> bool:
+        if probability <= 0:
+            return False
+        with self._lock:
+            return self._random.random() < probability
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self.stats[name] = self.stats.get(name, 0) + value
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+        return False
@@ -0,0 +1,234 @@
+"""Synthetic ASF search results, a search stand-in, product payloads, orbit files, DEMs and run files for the benchmarks"""
+import math
+import time
+import zlib
+import random
+import threading
+import hashlib
+import datetime
+import functools
+from pathlib import Path
+
+import numpy as np
+import asf_search as asf
+from asf_search.search.search_generator import as_ASFProduct
+
+# payloads repeat a seeded block, so the stand-in server never holds whole files
+PAYLOAD_BLOCK_SIZE = 64 * 1024
+START_DATE = datetime.datetime(2016, 8, 30, 0, 30, 0)
+SCENE_DURATION = datetime.timedelta(seconds=27)
+# one acquisition of each frame every 6 days
+REVISIT = datetime.timedelta(days=6)
+AOI = (-99.5, 19.0)
+
+
+def payload_block(name: str) -> bytes:
+    return random.Random(zlib.crc32(name.encode())).randbytes(PAYLOAD_BLOCK_SIZE)
+
+
+def payload_chunks(name: str, size: int, offset: int = 0, chunk_size: int = PAYLOAD_BLOCK_SIZE):
+    """Yield the bytes [offset, size) of the payload of a file"""
+    block = payload_block(name)
+    position = offset
+    while position < size:
+        start = position % PAYLOAD_BLOCK_SIZE
+        length = min(chunk_size, PAYLOAD_BLOCK_SIZE - start, size - position)
+        yield block[start:start + length]
+        position += length
+
+
+def payload_md5(name: str, size: int) -> str:
+    md5 = hashlib.md5()
+    for chunk in payload_chunks(name, size):
+        md5.update(chunk)
+    return md5.hexdigest()
+
+
+def scene_name(index: int, frames: int = 3) -> str:
+    acquisition, frame = divmod(index, frames)
+    mission = "S1A" if acquisition % 2 == 0 else "S1B"
+    start = START_DATE + acquisition * REVISIT + frame * SCENE_DURATION
+    end = start + SCENE_DURATION
+    return (
+        f"{mission}_IW_SLC__1SDV_{start:%Y%m%dT%H%M%S}_{end:%Y%m%dT%H%M%S}_"
+        f"{index % 1000000:06d}_{index % 0xFFFFFF:06X}_{index % 0xFFFF:04X}"
+    )
+
+
+def footprint(index: int, frames: int = 3, width: float = 1.2, height: float = 1.0) -> list:
+    """Frames of an acquisition follow each other along track, with some jitter between passes"""
+    acquisition, frame = divmod(index, frames)
+    jitter = random.Random(acquisition).uniform(-0.05, 0.05)
+    west = AOI[0] + jitter
+    south = AOI[1] + frame * height * 0.9 + jitter
+    return [
+        (west, south), (west + width, south), (west + width, south + height),
+        (west, south + height), (west, south),
+    ]
+
+
+def product_item(index: int, base_url: str, size: int, md5sum: str, frames: int = 3, width: float = 1.2, height: float = 1.0) -> dict:
+    """CMR umm/meta of a Sentinel-1 SLC as returned by an ASF search"""
+    name = scene_name(index, frames)
+    start, end = name.split("_")[5:7]
+    points = [{"Longitude": lon, "Latitude": lat} for lon, lat in footprint(index, frames, width, height)]
+    attributes = {
+        "BYTES": str(size),
+        "MD5SUM": md5sum,
+        "PATH_NUMBER": "128",
+        "PROCESSING_TYPE": "SLC",
+        "ASF_PLATFORM": f"Sentinel-1{name[2]}",
+        "CENTER_LAT": str(points[0]["Latitude"] + height / 2),
+        "CENTER_LON": str(points[0]["Longitude"] + width / 2),
+        "ASCENDING_DESCENDING": "ASCENDING",
+        "GROUP_ID": f"{name[:3]}_IWDV_{index:08d}_128",
+        "POLARIZATION": "VV+VH",
+        "BEAM_MODE_TYPE": "IW",
+    }
+    umm = {
+        "GranuleUR": f"{name}-SLC",
+        "CollectionReference": {"ShortName": f"SENTINEL-1{name[2]}_SLC"},
+        "DataGranule": {"Identifiers": [{"IdentifierType": "ProducerGranuleId", "Identifier": name}]},
+        "TemporalExtent": {"RangeDateTime": {
+            "BeginningDateTime": datetime.datetime.strptime(start, "%Y%m%dT%H%M%S").isoformat() + "Z",
+            "EndingDateTime": datetime.datetime.strptime(end, "%Y%m%dT%H%M%S").isoformat() + "Z",
+        }},
+        "RelatedUrls": [{"Type": "GET DATA", "URL": f"{base_url}/slc/{size}/{name}.zip"}],
+        "AdditionalAttributes": [{"Name": key, "Values": [value]} for key, value in attributes.items()],
+        "SpatialExtent": {"HorizontalSpatialDomain": {"Geometry": {"GPolygons": [{"Boundary": {"Points": points}}]}}},
+        "Platforms": [{"ShortName": f"SENTINEL-1{name[2]}"}],
+    }
+    return {"umm": umm, "meta": {"concept-id": f"G{index}-ASF", "native-id": f"{name}-SLC"}}
+
+
+def make_products(count: int, base_url: str = "http://127.0.0.1:1", size: int = 4 * 1024**3, with_md5: bool = False, **kwargs) -> asf.ASFSearchResults:
+    """
+    Build search results of count Sentinel-1 SLCs.
+
+    Args:
+        count: Number of products
+        base_url: Root of the stand-in server serving the payloads
+        size: Announced size of each product in bytes
+        with_md5: Compute the md5sum of the served payload (only for downloadable sets)
+    """
+    session = asf.ASFSession()
+    products = []
+    for index in range(count):
+        name = scene_name(index, kwargs.get("frames", 3))
+        md5sum = payload_md5(f"{name}.zip", size) if with_md5 else "0" * 32
+        products.append(as_ASFProduct(product_item(index, base_url, size, md5sum, **kwargs), session))
+    results = asf.ASFSearchResults(products)
+    results.searchComplete = True
+    return results
+
+
+class SearchStandIn:
+    """
+    Callable standing in for asf.geo_search over a synthetic result set.
+
+    Answers newest products first and at most maxResults of them, like ASF,
+    after latency plus per_product seconds for each returned product.
+    """
+
+    def __init__(self, products, latency: float = 0.0, per_product: float = 0.0):
+        self.products = sorted(products, key=lambda product: product.properties["startTime"], reverse=True)
+        self.latency = latency
+        self.per_product = per_product
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, start: datetime.datetime, end: datetime.datetime, maxResults=None, **opts):
+        with self._lock:
+            self.calls += 1
+        selected = [
+            product for product in self.products
+            if start <= datetime.datetime.fromisoformat(product.properties["startTime"].removesuffix("Z")) <= end
+        ][:maxResults]
+        time.sleep(self.latency + self.per_product * len(selected))
+        results = asf.ASFSearchResults(selected)
+        results.searchComplete = True
+        return results
+
+
+def orbit_name(scene: str) -> str:
+    """POEORB file name covering the day of a scene, as the orbit service would answer"""
+    mission = scene[:3]
+    start = datetime.datetime.strptime(scene.split("_")[5], "%Y%m%dT%H%M%S")
+    day = datetime.datetime(start.year, start.month, start.day)
+    validity_start = day - datetime.timedelta(hours=1, seconds=18)
+    validity_end = day + datetime.timedelta(days=1, hours=1, seconds=-18)
+    produced = day + datetime.timedelta(days=20)
+    return (
+        f"{mission}_OPER_AUX_POEORB_OPOD_{produced:%Y%m%dT%H%M%S}_"
+        f"V{validity_start:%Y%m%dT%H%M%S}_{validity_end:%Y%m%dT%H%M%S}.EOF"
+    )
+
+
+# circular sun-synchronous orbit close to Sentinel-1
+ORBIT_RADIUS = 7.07e6
+ORBIT_PERIOD = 98.6 * 60
+ORBIT_INCLINATION = math.radians(98.18)
+ORBIT_SPACING = 10.0
+# validity start of the orbit file of the first acquisition day
+ORBIT_START = datetime.datetime(START_DATE.year, START_DATE.month, START_DATE.day) - datetime.timedelta(hours=1, seconds=18)
+
+
+def orbit_state(seconds):
+    """Position and velocity (m, m/s) of the synthetic orbit, seconds after the start of the orbit file"""
+    angle = 2 * math.pi * seconds / ORBIT_PERIOD
+    speed = 2 * math.pi * ORBIT_RADIUS / ORBIT_PERIOD
+    cos_i, sin_i = math.cos(ORBIT_INCLINATION), math.sin(ORBIT_INCLINATION)
+    position = (ORBIT_RADIUS * math.cos(angle), ORBIT_RADIUS * math.sin(angle) * cos_i, ORBIT_RADIUS * math.sin(angle) * sin_i)
+    velocity = (-speed * math.sin(angle), speed * math.cos(angle) * cos_i, speed * math.cos(angle) * sin_i)
+    return position, velocity
+
+
+@functools.lru_cache(maxsize=8)
+def orbit_content(state_vectors: int = 9361, start: datetime.datetime = ORBIT_START) -> str:
+    """EOF XML with the usual 10 s state vector spacing over 26 hours (the same for every file)"""
+    vectors = []
+    for i in range(state_vectors):
+        utc = start + datetime.timedelta(seconds=i * ORBIT_SPACING)
+        (x, y, z), (vx, vy, vz) = orbit_state(i * ORBIT_SPACING)
+        vectors.append(
+            f"<OSV><UTC>UTC={utc:%Y-%m-%dT%H:%M:%S.%f}</UTC><Absolute_Orbit>+{13000 + i // 590}</Absolute_Orbit>"
+            f"<X unit=\"m\">{x:.6f}</X><Y unit=\"m\">{y:.6f}</Y><Z unit=\"m\">{z:.6f}</Z>"
+            f"<VX unit=\"m/s\">{vx:.6f}</VX><VY unit=\"m/s\">{vy:.6f}</VY><VZ unit=\"m/s\">{vz:.6f}</VZ>"
+            f"<Quality>NOMINAL</Quality></OSV>"
+        )
+    vectors = "\n".join(vectors)
+    return f"<?xml version=\"1.0\"?>\n<Earth_Explorer_File><Data_Block><List_of_OSVs count=\"{state_vectors}\">\n{vectors}\n</List_of_OSVs></Data_Block></Earth_Explorer_File>\n"
+
+
+def write_dem(path: Path, west: int, north: int, degrees: int, pixels_per_degree: int = 3600) -> Path:
+    """Raw float32 DEM of degrees x degrees with its ISCE XML, a smooth relief written row block by row block"""
+    side = degrees * pixels_per_degree
+    step = 1 / pixels_per_degree
+    cols = np.arange(side, dtype=np.float32)
+    with open(path, "wb") as f:
+        for start in range(0, side, 512):
+            rows = np.arange(start, min(start + 512, side), dtype=np.float32)[:, None]
+            (1000 + 500 * np.sin(rows / 700) * np.cos(cols / 900)).astype("<f4").tofile(f)
+    coordinates = ""
+    for number, size, first, delta in ((1, side, west, step), (2, side, north, -step)):
+        coordinates += (
+            f'<component name="coordinate{number}"><property name="size"><value>{size}</value></property>'
+            f'<property name="startingvalue"><value>{first!r}</value></property>'
+            f'<property name="delta"><value>{delta!r}</value></property>'
+            f'<property name="endingvalue"><value>{first + size * delta!r}</value></property></component>'
+        )
+    Path(f"{path}.xml").write_text(
+        f'<imageFile><property name="length"><value>{side}</value></property>'
+        f'<property name="width"><value>{side}</value></property>'
+        f'<property name="data_type"><value>FLOAT</value></property>'
+        f'<property name="file_name"><value>{path.name}</value></property>{coordinates}</imageFile>\n'
+    )
+    return path
+
+
+def write_run_files(run_files_dir: Path, stages: dict):
+    """Write run_NN_<stage> files with the given number of trivial tasks each"""
+    run_files_dir.mkdir(parents=True, exist_ok=True)
+    for number, (stage, tasks) in enumerate(stages.items(), start=1):
+        lines = [f"true {stage} {i}" for i in range(tasks)]
+        (run_files_dir / f"run_{number:02d}_{stage}").write_text("\n".join(lines) + "\n")
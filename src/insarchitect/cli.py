@@ -1,12 +1,56 @@
+import importlib
+
 import typer
-from .commands import download, jobfiles, dem, run
+from typer.core import TyperGroup
+from typing_extensions import Annotated
+
+# command name -> module with its typer app, imported only when the command
+# is run or listed so that startup does not pay for every step's dependencies
+COMMANDS = {
+    "download": ".commands.download",
+    "dem": ".commands.dem",
+    "jobfiles": ".commands.jobfiles",
+    "isce": ".commands.isce",
+    "run": ".commands.run",
+    "gc": ".commands.gc",
+    "verify": ".commands.verify",
+    "extract": ".commands.extract",
+}
+
+
+class LazyGroup(TyperGroup):
+    def list_commands(self, ctx):
+        return [*COMMANDS, *super().list_commands(ctx)]
+
+    def get_command(self, ctx, name):
+        if name not in COMMANDS:
+            return super().get_command(ctx, name)
+        module = importlib.import_module(COMMANDS[name], __package__)
+        return typer.main.get_command(module.app)
+
+
+app = typer.Typer(cls=LazyGroup)
+
+
+def show_import_profile(value: bool):
+    if not value:
+        return
+    from .core.import_profile import profile_cli, print_import_profile
+    print_import_profile(profile_cli())
+    raise typer.Exit()
+
 
-app = typer.Typer()
+@app.callback()
+def main(
+    import_profile: Annotated[bool, typer.Option(
+        "--import-profile",
+        callback=show_import_profile,
+        is_eager=True,
+        help="Measure the import time of the CLI and of every command, then exit",
+    )] = False,
+):
+    """Sentinel-1 InSAR processing: download, DEM, job files and ISCE runs"""
 
-app.add_typer(download.app)
-app.add_typer(dem.app)
-app.add_typer(jobfiles.app)
-app.add_typer(run.app)
 
 if __name__ == "__main__":
     app()
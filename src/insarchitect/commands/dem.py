@@ -2,24 +2,29 @@ import typer
 from pathlib import Path
 from typing_extensions import Annotated
 
-from ..config import load_config
-from ..core.dem.dem import dem_main
-
 app = typer.Typer(help="Creates a DEM based on ssara_*.kml file using COPERNICUS or NASA")
 
 ConfigFile = Annotated[Path, typer.Argument(help="Path to configuration TOML file")]
 
 @app.command()
-def dem(config_file: ConfigFile):
+def dem(
+    config_file: ConfigFile,
+    force: Annotated[bool, typer.Option("--force", help="Rebuild the DEM even if it is up to date")] = False,
+):
     """
     Download DEM based on template file and KML bounding box.
     
     Example:
         pixi run insarchitect dem <template>
     """
+    from ..config import load_config
+    from ..core.dem.dem import dem_main
+    from ..core.journal import RunJournal
+    from ..core.pipeline import journaled
 
     project_config = load_config(config_file)
-    dem_main(project_config)
+    journal = RunJournal.for_project(project_config)
+    journaled(journal, "dem", project_config, dem_main, force)()
 
 if __name__ == "__main__":
     app()
\ No newline at end of file
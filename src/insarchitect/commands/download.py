@@ -2,23 +2,31 @@ import typer
 from pathlib import Path
 from typing_extensions import Annotated
 
-from ..config import load_config
-from ..core.download.download import download_main
-
 app = typer.Typer()
 
 ConfigFile = Annotated[Path, typer.Argument(help="Path to configuration TOML file")]
 
 @app.command()
-def download(config_file: ConfigFile):
+def download(
+    config_file: ConfigFile,
+    offline: Annotated[bool, typer.Option("--offline", help="Replay the cached ASF search only, never query ASF")] = False,
+    refresh_search: Annotated[bool, typer.Option("--refresh-search", help="Invalidate the cached ASF search before running")] = False,
+    force: Annotated[bool, typer.Option("--force", help="Download even if the SLCs are up to date")] = False,
+):
     """Download SLC images and a KML file based on config"""
+    from ..config import load_config
+    from ..core.download.download import download_main, apply_search_flags
+    from ..core.journal import RunJournal
+    from ..core.pipeline import journaled
 
     download_config = load_config(config_file)
     if not download_config:
         print("No download config was specified on template file")
         typer.Exit(1)
 
-    download_main(download_config)
+    apply_search_flags(download_config, offline=offline, refresh_search=refresh_search)
+    journal = RunJournal.for_project(download_config)
+    journaled(journal, "download", download_config, download_main, force)()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,19 @@
+import typer
+from pathlib import Path
+from typing_extensions import Annotated
+
+app = typer.Typer()
+
+ConfigFile = Annotated[Path, typer.Argument(help="Path to configuration TOML file")]
+
+@app.command()
+def extract(config_file: ConfigFile):
+    """Extract the subswaths and polarizations covering the AOI from the downloaded SLC zips"""
+    from ..config import load_config
+    from ..core.download.extract import extract_main
+
+    extract_main(load_config(config_file))
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,29 @@
+import typer
+from typing_extensions import Annotated
+
+app = typer.Typer()
+
+@app.command()
+def gc(
+    dry_run: Annotated[bool, typer.Option("--dry-run", help="List the products that would be removed")] = False,
+    min_age: Annotated[float, typer.Option("--min-age", help="Hours an unreferenced product is kept after its last use")] = 24,
+):
+    """Remove the products of the shared SLC store that no project links to anymore"""
+    from rich import print
+    from ..config import load_system_config
+    from ..core.download.slc_store import SlcStore
+
+    system = load_system_config()
+    store = SlcStore(system.slc_store_dir)
+    removed = store.gc(dry_run=dry_run, min_age=min_age * 3600)
+
+    action = "Would remove" if dry_run else "Removed"
+    for entry in removed:
+        print(f"  - [bold cyan]{entry['key']}[/bold cyan] ({entry['size'] / 1024**3:.2f} GB)")
+    freed = sum(entry["size"] for entry in removed)
+    print(f"[bold green]{action} {len(removed)} products, {freed / 1024**3:.2f} GB[/bold green]")
+    print(f"[bold]Store size[/bold]: {store.size() / 1024**3:.2f} GB in {store.root}")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,19 @@
+import typer
+from pathlib import Path
+from typing_extensions import Annotated
+
+app = typer.Typer()
+
+ConfigFile = Annotated[Path, typer.Argument(help="Path to configuration TOML file")]
+
+@app.command()
+def isce(config_file: ConfigFile):
+    """Run the job arrays written by the jobfiles step on Slurm or locally and wait for them"""
+    from ..config import load_config
+    from ..core.isce.isce import isce_main
+
+    project_config = load_config(config_file)
+    isce_main(project_config)
+
+if __name__ == "__main__":
+    app()
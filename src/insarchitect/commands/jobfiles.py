@@ -1,20 +1,17 @@
 import typer
 import sys
-from asyncio import run
 from pathlib import Path
 from typing_extensions import Annotated
 
-from ..config import load_config
-from ..core.jobfiles.download_orbits import download_orbits
-from ..models import Platforms
-
 app = typer.Typer()
 
 ConfigFile = Annotated[Path, typer.Argument(help="Path to configuration TOML file")]
 
 @app.command()
 def jobfiles(config_file: ConfigFile):
-    """Download SLC images and a KML file based on config"""
+    """Download the orbit files and write the Slurm job arrays of the ISCE run files"""
+    from ..config import load_config
+    from ..core.jobfiles.jobfiles import jobfiles_main
 
     config = load_config(config_file)
     if not config:
@@ -25,8 +22,7 @@ def jobfiles(config_file: ConfigFile):
         print("No download config was specified on template file")
         sys.exit(1)
 
-    if config.download.platform == Platforms.SENTINEL:
-        run(download_orbits(config))
+    jobfiles_main(config)
 
 
 if __name__ == "__main__":
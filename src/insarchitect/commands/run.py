@@ -1,58 +1,73 @@
 from pathlib import Path
-from insarchitect.models import ProjectConfig
 import typer
 from typing_extensions import Annotated
-from typing import Callable, Optional
-
-from ..config import load_config
-from ..core.download.download import download_main
-from ..core.dem.dem import dem_main
-from ..core.jobfiles.download_orbits import download_orbits
+from typing import List, Optional
 
 app = typer.Typer()
 
-ConfigFile = Annotated[Path, typer.Argument(help="Path to configuration TOML file")]
-
-STEPS = {
-    "download": (download_main, "Download step"),
-    "dem": (dem_main, "DEM processing step"),
-    "jobfiles": (download_orbits, "Job files generation (orbits)"),
-    "isce": (None, "ISCE processing step (to be implemented)"),
-}
-
-# execution order
-STEP_ORDER = ["download", "dem", "jobfiles", "isce"]
-
-def _get_step_function(step_name: str) -> Optional[Callable]:
-    """Get the function for a step, handling not-yet-implemented steps"""
-    func, _ = STEPS[step_name]
-    if func is None:
-        typer.echo(f"Warning: {step_name} step is not yet implemented")
-        return None
-    return func
-
 @app.command()
 def run(
-    config_file: Annotated[Path, typer.Argument(help="Configuration file to process")],
+    config_files: Annotated[List[Path], typer.Argument(help="Configuration files to process, or directories of them")],
     download: Annotated[bool, typer.Option("--download", help="Run download step")] = False,
     dem: Annotated[bool, typer.Option("--dem", help="Run DEM processing step")] = False,
     jobfiles: Annotated[bool, typer.Option("--jobfiles", help="Run job files generation step")] = False,
-    isce: Annotated[bool, typer.Option("--isce", help="Run ISCE processing step (to be implemented)")] = False,
+    isce: Annotated[bool, typer.Option("--isce", help="Run ISCE processing step")] = False,
     start: Annotated[Optional[str], typer.Option("--start", help="Start from a specific step (e.g., --start jobfiles)")] = None,
+    offline: Annotated[bool, typer.Option("--offline", help="Replay the cached ASF search only, never query ASF")] = False,
+    refresh_search: Annotated[bool, typer.Option("--refresh-search", help="Invalidate the cached ASF search before running")] = False,
+    force: Annotated[bool, typer.Option("--force", help="Re-run the selected steps even if they are up to date")] = False,
+    trace: Annotated[bool, typer.Option("--trace", help="Record timings and write metrics.jsonl and a Chrome/Perfetto trace.json")] = False,
+    profile: Annotated[bool, typer.Option("--profile", help="Capture cProfile statistics per step")] = False,
 ):
     """
-    Run processing steps with the given config file
+    Run processing steps with the given config files
     
+    Several templates (or directories of templates) are processed in one
+    run: overlapping searches are merged, each product is downloaded once
+    and the projects share the download and job budgets.
     If no flags are specified, all steps will be executed.
     Use flags to run only specific steps (e.g., --download --dem).
     Use --start to run from a specific step onwards (e.g., --start jobfiles).
+    Steps whose inputs and outputs did not change since they last completed
+    are skipped, use --force to run them anyway.
+    With --trace or --profile the measurements are written to
+    <work_dir>/<project>/.insarchitect/runs/<timestamp>/, or to
+    <work_dir>/.insarchitect/runs/<timestamp>/ for several projects.
     """
-    project_config = load_config(config_file)
-    typer.echo(f"Processing config file: {config_file}")
+    from rich.progress import Progress
+
+    from ..config import load_config, expand_templates
+    from ..core.download.progress import progress_columns
+    from ..core.download.engine import DEFAULT_HOST_LIMIT, TransferEngine
+    from ..core.journal import RunJournal
+    from ..core import telemetry
+    from ..core.pipeline import STEP_ORDER, STEP_DESCRIPTIONS, Scheduler, TaskFailed, schedule_run, task_step
+
+    config_files = expand_templates(config_files)
+    if not config_files:
+        typer.echo("Error: No configuration files given")
+        raise typer.Exit(1)
+
+    project_configs = [load_config(config_file) for config_file in config_files]
+    project_names = [config.project_name for config in project_configs]
+    duplicates = sorted({name for name in project_names if project_names.count(name) > 1})
+    if duplicates:
+        typer.echo(f"Error: Several templates define the projects {', '.join(duplicates)}")
+        raise typer.Exit(1)
+
+    for config_file, project_config in zip(config_files, project_configs):
+        if offline or refresh_search:
+            # asf_search is slow to import, only load it when the flags need it
+            from ..core.download.download import apply_search_flags
+            apply_search_flags(project_config, offline=offline, refresh_search=refresh_search)
+        if refresh_search:
+            # new search results may bring new products
+            RunJournal.for_project(project_config).invalidate("download")
+        typer.echo(f"Processing config file: {config_file}")
 
     if start is not None:
-        if start not in STEPS:
-            typer.echo(f"Error: Unknown step '{start}'. Available steps: {', '.join(STEPS.keys())}")
+        if start not in STEP_DESCRIPTIONS:
+            typer.echo(f"Error: Unknown step '{start}'. Available steps: {', '.join(STEP_DESCRIPTIONS.keys())}")
             raise typer.Exit(1)
         
         # find the index of the start step
@@ -80,19 +95,84 @@ def run(
         
         # if no flags specified, run all available steps (e.g. insarchitect run <config_file>)
         if not selected_steps:
-            selected_steps = set(STEPS.keys())
+            selected_steps = set(STEP_DESCRIPTIONS.keys())
             typer.echo("Running all processing steps...")
         else:
             typer.echo("Running selected processing steps...")
     
-    # execute steps in defined order
     for step_name in STEP_ORDER:
         if step_name in selected_steps:
-            _, description = STEPS[step_name]
-            typer.echo(f"Running {description}...")
-            func = _get_step_function(step_name)
-            if func:
-                func(project_config)
+            typer.echo(f"Running {STEP_DESCRIPTIONS[step_name]}...")
+
+    # steps run as a task graph, e.g. the DEM and the orbits are fetched
+    # while the SLCs are still downloading
+    pool_limits = {}
+    parallel_downloads = [config.download.parallel_downloads for config in project_configs if config.download is not None]
+    if parallel_downloads:
+        # one download budget for every project
+        pool_limits["download"] = max(parallel_downloads)
+    extract_workers = [config.extract.workers for config in project_configs if config.extract is not None]
+    if extract_workers:
+        pool_limits["extract"] = max(extract_workers)
+    scheduler = Scheduler(pool_limits)
+
+    batch = None
+    if len(project_configs) > 1:
+        from ..core.batch import Batch
+        batch = Batch(project_configs, workers=scheduler.pool_limits["download"])
+
+    if trace:
+        telemetry.recorder.enable()
+    if profile:
+        telemetry.profiler.enabled = True
+    if batch is None:
+        runs_dir = telemetry.run_dir(project_configs[0])
+    else:
+        runs_dir = telemetry.batch_run_dir(project_configs[0].system)
+
+    with Progress(*progress_columns()) as progress:
+        # one transfer budget and progress display for the SLCs, orbits and DEM tiles of every project
+        engine = TransferEngine.for_system(
+            project_configs[0].system, pool_limits.get("download", DEFAULT_HOST_LIMIT), cancel=scheduler.cancel, progress=progress,
+        )
+        for project_config in project_configs:
+            schedule_run(scheduler, project_config, selected_steps, progress, force=force, batch=batch, engine=engine)
+        try:
+            with telemetry.span("run", steps=sorted(selected_steps)):
+                scheduler.run()
+        except TaskFailed as e:
+            if isinstance(e.error, SystemExit):
+                # the step already reported the error
+                raise typer.Exit(e.error.code or 1)
+            typer.echo(f"Error: task '{e.task}' failed")
+            if task_step(e.task) == "download":
+                from ..core.download.download import report_download_error
+                report_download_error(e.error)
+            else:
+                typer.echo(repr(e.error))
+            raise typer.Exit(1)
+        except KeyboardInterrupt as e:
+            from ..core.download.download import report_download_error
+            report_download_error(e)
+            raise typer.Exit(1)
+        finally:
+            engine.close()
+            if batch is not None:
+                batch.close()
+            export_measurements(runs_dir, trace, profile)
+
+
+def export_measurements(runs_dir: Path, trace: bool, profile: bool):
+    """Write the recorded metrics, trace and profiles of a run, failed runs included"""
+    from ..core import telemetry
+
+    if trace:
+        metrics_path, trace_path = telemetry.recorder.export(runs_dir)
+        typer.echo(f"Metrics written to {metrics_path}")
+        typer.echo(f"Trace written to {trace_path} (open in ui.perfetto.dev or chrome://tracing)")
+    if profile:
+        paths = telemetry.profiler.export(runs_dir / "profile")
+        typer.echo(f"Profiles of {len(paths)} steps written to {runs_dir / 'profile'}")
 
 if __name__ == "__main__":
     app()
@@ -0,0 +1,25 @@
+import typer
+from pathlib import Path
+from typing import Optional
+from typing_extensions import Annotated
+
+app = typer.Typer()
+
+ConfigFile = Annotated[Path, typer.Argument(help="Path to configuration TOML file")]
+
+@app.command()
+def verify(
+    config_file: ConfigFile,
+    workers: Annotated[Optional[int], typer.Option("--workers", help="Files hashed at a time (defaults to the number of CPUs)")] = None,
+    check_zips: Annotated[bool, typer.Option("--zip", help="Also validate the zip central directory of every product")] = False,
+    remove: Annotated[bool, typer.Option("--remove", help="Delete damaged products so the next download fetches them again")] = False,
+):
+    """Check the downloaded SLCs of a project against the ASF md5sums"""
+    from ..config import load_config
+    from ..core.download.verify import verify_main
+
+    verify_main(load_config(config_file), workers=workers, check_zips=check_zips, remove=remove)
+
+
+if __name__ == "__main__":
+    app()
@@ -1,6 +1,7 @@
 import tomllib
 import sys
 from pathlib import Path
+from typing import List
 import platformdirs
 
 from pydantic import ValidationError
@@ -71,3 +72,13 @@ def load_config(config_path: Path) -> ProjectConfig:
                 print(f"Error in {section}: {field} -> {error['msg']}")
         sys.exit(1)
 
+
+def expand_templates(paths: List[Path]) -> List[Path]:
+    """Replace directories by the *.toml templates they hold, in name order"""
+    templates = []
+    for path in paths:
+        if path.is_dir():
+            templates.extend(sorted(path.glob("*.toml")))
+        else:
+            templates.append(path)
+    return list(dict.fromkeys(templates))
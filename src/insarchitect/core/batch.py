@@ -0,0 +1,281 @@
+import os
+import shutil
+import datetime
+import threading
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from rich import print
+from shapely import wkt
+from shapely.geometry import Polygon, shape
+from shapely.ops import unary_union
+
+from ..models import ProjectConfig, Executors
+from . import telemetry
+from .download.transfer import part_path
+
+
+@dataclass
+class SearchGroup:
+    """Projects whose ASF searches overlap and are answered by a single search"""
+    name: str
+    projects: List[ProjectConfig]
+
+
+def _search_key(config: ProjectConfig) -> tuple:
+    download = config.download
+    return download.platform, download.relative_orbit, download.burst_download
+
+
+def searches_overlap(a: ProjectConfig, b: ProjectConfig) -> bool:
+    """Same track and product type, overlapping dates and intersecting AOIs"""
+    if _search_key(a) != _search_key(b):
+        return False
+    if a.download.start_date > b.download.end_date or b.download.start_date > a.download.end_date:
+        return False
+    return wkt.loads(a.download.bounding_box).intersects(wkt.loads(b.download.bounding_box))
+
+
+def group_searches(configs: List[ProjectConfig]) -> List[SearchGroup]:
+    """
+    Merge the searches of the projects into groups of overlapping searches.
+
+    Overlap is transitive, so a project bridging two others puts all three in
+    one group. Offline projects replay their own cached search and always
+    form a group of their own.
+    """
+    online = [config for config in configs if config.download is not None and not config.download.offline]
+    parent = list(range(len(online)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i in range(len(online)):
+        for j in range(i + 1, len(online)):
+            if searches_overlap(online[i], online[j]):
+                parent[find(j)] = find(i)
+
+    members: Dict[int, List[ProjectConfig]] = {}
+    for i, config in enumerate(online):
+        members.setdefault(find(i), []).append(config)
+    groups = [SearchGroup(projects[0].project_name, projects) for projects in members.values()]
+
+    for config in configs:
+        if config.download is not None and config.download.offline:
+            groups.append(SearchGroup(config.project_name, [config]))
+    return groups
+
+
+def merged_search_options(projects: List[ProjectConfig]) -> dict:
+    """Search options covering every project of a group: union of the AOIs and of the date ranges"""
+    from .download.download import build_search_options
+
+    options = [build_search_options(config.download) for config in projects]
+    aoi = unary_union([wkt.loads(opts["intersectsWith"]) for opts in options])
+    if not isinstance(aoi, Polygon):
+        # ASF only takes a single polygon
+        aoi = aoi.convex_hull
+    return {
+        **options[0],
+        "start": min(opts["start"] for opts in options),
+        "end": max(opts["end"] for opts in options),
+        "maxResults": max(opts["maxResults"] for opts in options),
+        "intersectsWith": aoi.wkt,
+    }
+
+
+def _start_time(product) -> datetime.datetime:
+    start = product.properties["startTime"].removesuffix("Z")
+    return datetime.datetime.fromisoformat(start).replace(tzinfo=None)
+
+
+def project_results(results, config: ProjectConfig):
+    """Select the products of a merged search that the search of a single project returns"""
+    import asf_search as asf
+    from .download.download import build_search_options
+
+    opts = build_search_options(config.download)
+    aoi = wkt.loads(opts["intersectsWith"])
+    selected = [
+        product for product in results
+        if opts["start"] <= _start_time(product) <= opts["end"] and aoi.intersects(shape(product.geometry))
+    ]
+    selected = asf.ASFSearchResults(selected)
+    selected.searchComplete = getattr(results, "searchComplete", True)
+    return selected
+
+
+def link_product(source: Path, target: Path, progress=None) -> Path:
+    """Hard link a product downloaded by another project, copying across file systems"""
+    size = source.stat().st_size
+    if not (target.exists() and target.stat().st_size == size):
+        tmp_path = part_path(target)
+        tmp_path.unlink(missing_ok=True)
+        try:
+            os.link(source, tmp_path)
+        except OSError:
+            shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, target)
+        telemetry.count("batch.linked_products")
+    if progress is not None:
+        progress.skip_file(target.name, size)
+    return target
+
+
+class Batch:
+    """
+    Shared state of several projects scheduled in one run.
+
+    Overlapping searches are answered by one merged search whose results are
+    split per project (and cached under each project's own search), each
+    product is downloaded once, by the first project asking for it, and
+    hard linked into the SLC directories of the others. The projects share
+    one adaptive transfer limit, one orbit index and, with the local
+    executor, one job budget, the TransferEngine of the run holds their
+    download session. Task names of a project are prefixed with
+    "<project>/", so the output layout of every project stays the same.
+
+    Args:
+        configs: Project configurations, with distinct project names
+        workers: Size of the shared download connection pool
+    """
+
+    def __init__(self, configs: List[ProjectConfig], workers: int):
+        self.configs = configs
+        self.workers = workers
+        self.groups = group_searches(configs)
+        self._group_of = {config.project_name: group for group in self.groups for config in group.projects}
+        self._lock = threading.Lock()
+        self._scheduled_searches = set()
+        self._results: Dict[str, object] = {}
+        self._owners: Dict[str, Tuple[str, Path]] = {}
+        self._concurrency = None
+        self._staging = None
+        self._space_plans: Dict[Path, object] = {}
+        self._orbit_index = None
+
+        self.job_budget = None
+        system = configs[0].system
+        if system.executor == Executors.LOCAL:
+            from .isce.isce import resource_budget
+            self.job_budget = resource_budget(system)
+
+    @staticmethod
+    def prefix(config: ProjectConfig) -> str:
+        return f"{config.project_name}/"
+
+    def search_task(self, scheduler, config: ProjectConfig) -> str:
+        """Name of the merged search task answering this project, added on first use"""
+        from .pipeline import Task
+
+        group = self._group_of[config.project_name]
+        name = f"search:{group.name}"
+        with self._lock:
+            if name in self._scheduled_searches:
+                return name
+            self._scheduled_searches.add(name)
+        scheduler.add(Task(name, lambda: self._search(group)))
+        return name
+
+    def _search(self, group: SearchGroup):
+        from .download.download import build_search_options, search_cache_dir, search_products
+        from .download.search_cache import merge_results, save_search, windowed_search
+
+        try:
+            if len(group.projects) == 1:
+                config = group.projects[0]
+                results = {config.project_name: search_products(config)}
+            else:
+                first = group.projects[0]
+                merged = merge_results(windowed_search(
+                    merged_search_options(group.projects),
+                    search_cache_dir(first),
+                    ttl=min(config.download.search_cache_ttl for config in group.projects),
+                    window_days=first.download.search_window_days,
+                    workers=first.download.search_workers,
+                ))
+                print(f"[bold cyan]Merged search of {', '.join(c.project_name for c in group.projects)}: "
+                      f"{len(merged)} products[/bold cyan]")
+                results = {}
+                for config in group.projects:
+                    selected = project_results(merged, config)
+                    results[config.project_name] = selected
+                    # later runs of the project alone (and the dem step) replay it
+                    if config.download.search_cache_ttl > 0 and selected.searchComplete:
+                        save_search(search_cache_dir(config), build_search_options(config.download), selected)
+        except Exception as e:
+            # reported by the search of each project
+            results = {config.project_name: e for config in group.projects}
+        with self._lock:
+            self._results.update(results)
+
+    def search_results(self, config: ProjectConfig):
+        """search_fn of search_downloads, returns the share of the merged search of a project"""
+        with self._lock:
+            results = self._results[config.project_name]
+        if isinstance(results, Exception):
+            raise results
+        return results
+
+    def claim(self, product, path: Path, task: str) -> Optional[Tuple[str, Path]]:
+        """
+        Register the download of a product by a project.
+
+        Returns:
+            (task, path) of the download owning the product, or None when
+            this project is the first to ask for it and downloads it
+        """
+        file_id = product.properties["fileID"]
+        with self._lock:
+            owner = self._owners.get(file_id)
+            if owner is None:
+                self._owners[file_id] = (task, path)
+            return owner
+
+    def concurrency(self):
+        """Adaptive transfer limit shared by the projects, they compete for the same bandwidth"""
+        from .download.concurrency import AdaptiveConcurrency
+
+        with self._lock:
+            if self._concurrency is None:
+                self._concurrency = AdaptiveConcurrency(self.workers)
+            return self._concurrency
+
+    def staging(self):
+        """Scratch staging shared by the projects, the in-flight quota holds for the whole batch"""
+        from .download.staging import ScratchStaging
+
+        with self._lock:
+            if self._staging is None:
+                self._staging = ScratchStaging.for_system(self.configs[0].system)
+            return self._staging
+
+    def space_plan(self, destination: Path):
+        """Download plan of a destination, projects downloading to the same one share its free space"""
+        from .download.staging import SpacePlan
+
+        staging = self.staging()
+        with self._lock:
+            if destination not in self._space_plans:
+                self._space_plans[destination] = SpacePlan(destination, staging)
+            return self._space_plans[destination]
+
+    def close(self):
+        """Wait for the moves of the shared staging still running"""
+        with self._lock:
+            staging = self._staging
+        if staging is not None:
+            staging.close()
+
+    def orbit_index(self, orbits_dir: Path):
+        from .jobfiles.orbit_store import OrbitIndex
+
+        with self._lock:
+            if self._orbit_index is None:
+                orbits_dir.mkdir(exist_ok=True)
+                self._orbit_index = OrbitIndex(orbits_dir)
+            return self._orbit_index
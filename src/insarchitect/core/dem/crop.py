@@ -0,0 +1,356 @@
+import os
+import math
+from pathlib import Path
+from dataclasses import dataclass, replace
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+import xml.etree.ElementTree as ET
+
+import numpy as np
+from shapely import wkt
+
+from ...models import ProjectConfig, ResampleMethod
+from .. import telemetry
+from .tiles import write_envi_header
+
+# ISCE data_type values and their little endian numpy types
+ISCE_DTYPES = {
+    "BYTE": np.dtype("<i1"),
+    "SHORT": np.dtype("<i2"),
+    "INT": np.dtype("<i4"),
+    "FLOAT": np.dtype("<f4"),
+    "DOUBLE": np.dtype("<f8"),
+}
+# float32 temporaries of the bilinear interpolation, per output sample
+BILINEAR_BYTES_PER_SAMPLE = 24
+
+
+@dataclass
+class DemGrid:
+    """
+    Raster grid of a DEM described by its ISCE XML.
+
+    Sample (row, col) lies at (north + row * step_y, west + col * step_x),
+    step_y is negative.
+    """
+    path: Path
+    width: int
+    length: int
+    west: float
+    north: float
+    step_x: float
+    step_y: float
+    dtype: np.dtype
+
+    @property
+    def east(self) -> float:
+        return self.west + (self.width - 1) * self.step_x
+
+    @property
+    def south(self) -> float:
+        return self.north + (self.length - 1) * self.step_y
+
+    @property
+    def nbytes(self) -> int:
+        return self.width * self.length * self.dtype.itemsize
+
+    def open(self) -> np.memmap:
+        return np.memmap(self.path, dtype=self.dtype, mode="r", shape=(self.length, self.width))
+
+
+def xml_path(path: Path) -> Path:
+    return Path(f"{path}.xml")
+
+
+def _properties(element) -> dict:
+    return {
+        prop.get("name").lower(): prop
+        for prop in element.findall("property")
+    }
+
+
+def _components(root) -> dict:
+    return {component.get("name").lower(): component for component in root.findall("component")}
+
+
+def _value(prop) -> str:
+    return prop.findtext("value").strip()
+
+
+def _set_value(properties: dict, name: str, value):
+    if name in properties:
+        properties[name].find("value").text = str(value)
+
+
+def read_isce_xml(path: Path) -> DemGrid:
+    """
+    Grid of a DEM from its ISCE XML (<path>.xml).
+
+    Raises:
+        ValueError: The XML misses the size or coordinates of the DEM, or
+            has a data type other than BYTE, SHORT, INT, FLOAT or DOUBLE
+    """
+    root = ET.parse(xml_path(path)).getroot()
+    properties = _properties(root)
+    components = _components(root)
+    try:
+        x_properties = _properties(components["coordinate1"])
+        y_properties = _properties(components["coordinate2"])
+        data_type = _value(properties["data_type"]).upper()
+        return DemGrid(
+            path=path,
+            width=int(_value(properties["width"])),
+            length=int(_value(properties["length"])),
+            west=float(_value(x_properties["startingvalue"])),
+            north=float(_value(y_properties["startingvalue"])),
+            step_x=float(_value(x_properties["delta"])),
+            step_y=float(_value(y_properties["delta"])),
+            dtype=ISCE_DTYPES[data_type],
+        )
+    except KeyError as e:
+        raise ValueError(f"{xml_path(path)}: unsupported or missing {e}") from None
+
+
+def write_isce_xml(source: DemGrid, target: DemGrid):
+    """ISCE XML of target, the XML of source with the size, coordinates and file names updated"""
+    tree = ET.parse(xml_path(source.path))
+    root = tree.getroot()
+    properties = _properties(root)
+    _set_value(properties, "width", target.width)
+    _set_value(properties, "length", target.length)
+    _set_value(properties, "file_name", target.path.name)
+    _set_value(properties, "extra_file_name", f"{target.path.name}.vrt")
+
+    components = _components(root)
+    for name, size, start, step in (
+        ("coordinate1", target.width, target.west, target.step_x),
+        ("coordinate2", target.length, target.north, target.step_y),
+    ):
+        coordinate = _properties(components[name])
+        _set_value(coordinate, "size", size)
+        _set_value(coordinate, "startingvalue", repr(start))
+        _set_value(coordinate, "delta", repr(step))
+        _set_value(coordinate, "endingvalue", repr(start + size * step))
+    tree.write(xml_path(target.path))
+
+
+def write_vrt(grid: DemGrid):
+    """GDAL VRT of a raw DEM, the extra file ISCE opens it through"""
+    gdal_types = {"i1": "Byte", "i2": "Int16", "i4": "Int32", "f4": "Float32", "f8": "Float64"}
+    itemsize = grid.dtype.itemsize
+    vrt = (
+        f'<VRTDataset rasterXSize="{grid.width}" rasterYSize="{grid.length}">\n'
+        f"    <SRS>EPSG:4326</SRS>\n"
+        f"    <GeoTransform>{grid.west!r}, {grid.step_x!r}, 0.0, {grid.north!r}, 0.0, {grid.step_y!r}</GeoTransform>\n"
+        f'    <VRTRasterBand band="1" dataType="{gdal_types[grid.dtype.str[1:]]}" subClass="VRTRawRasterBand">\n'
+        f'        <SourceFilename relativeToVRT="1">{grid.path.name}</SourceFilename>\n'
+        f"        <ByteOrder>LSB</ByteOrder>\n"
+        f"        <ImageOffset>0</ImageOffset>\n"
+        f"        <PixelOffset>{itemsize}</PixelOffset>\n"
+        f"        <LineOffset>{grid.width * itemsize}</LineOffset>\n"
+        f"    </VRTRasterBand>\n"
+        f"</VRTDataset>\n"
+    )
+    Path(f"{grid.path}.vrt").write_text(vrt)
+
+
+def target_grid(source: DemGrid, path: Path, bounds: Optional[Tuple[float, float, float, float]] = None, step: Optional[float] = None) -> DemGrid:
+    """
+    Grid of the cropped and resampled DEM.
+
+    Without step the samples of source inside bounds are kept as they are,
+    with step the bounds are sampled every step degrees from their north
+    west corner.
+
+    Args:
+        source: Grid of the input DEM
+        path: Output DEM
+        bounds: (west, south, east, north) to crop to, defaults to the whole DEM
+        step: Pixel size in degrees, defaults to the pixel size of source
+
+    Raises:
+        ValueError: bounds do not overlap the DEM
+    """
+    west, south, east, north = bounds or (source.west, source.south, source.east, source.north)
+    west, east = max(west, source.west), min(east, source.east)
+    south, north = max(south, source.south), min(north, source.north)
+    if west > east or south > north:
+        raise ValueError(f"{bounds} does not overlap the DEM {source.path.name}")
+
+    if step is None:
+        # whole source samples covering the bounds
+        col0 = math.floor((west - source.west) / source.step_x + 1e-9)
+        col1 = math.ceil((east - source.west) / source.step_x - 1e-9)
+        row0 = math.floor((north - source.north) / source.step_y + 1e-9)
+        row1 = math.ceil((south - source.north) / source.step_y - 1e-9)
+        return replace(
+            source,
+            path=path,
+            width=col1 - col0 + 1,
+            length=row1 - row0 + 1,
+            west=source.west + col0 * source.step_x,
+            north=source.north + row0 * source.step_y,
+        )
+    return replace(
+        source,
+        path=path,
+        width=math.floor((east - west) / step + 1e-9) + 1,
+        length=math.floor((north - south) / step + 1e-9) + 1,
+        west=west,
+        north=north,
+        step_x=step,
+        step_y=-step,
+    )
+
+
+def source_coordinates(source: DemGrid, target: DemGrid, rows: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """Fractional source rows of the target rows [start, stop) and source columns of every target column"""
+    start, stop = rows
+    y = (target.north + np.arange(start, stop) * target.step_y - source.north) / source.step_y
+    x = (target.west + np.arange(target.width) * target.step_x - source.west) / source.step_x
+    return y, x
+
+
+def _resample_window(data: np.ndarray, source: DemGrid, target: DemGrid, rows: Tuple[int, int], method: ResampleMethod) -> np.ndarray:
+    y, x = source_coordinates(source, target, rows)
+    if method == ResampleMethod.NEAREST:
+        iy = np.clip(np.rint(y).astype(np.intp), 0, source.length - 1)
+        ix = np.clip(np.rint(x).astype(np.intp), 0, source.width - 1)
+        window = np.asarray(data[iy.min():iy.max() + 1, ix.min():ix.max() + 1])
+        return window[np.ix_(iy - iy.min(), ix - ix.min())]
+
+    iy = np.clip(np.floor(y).astype(np.intp), 0, max(source.length - 2, 0))
+    ix = np.clip(np.floor(x).astype(np.intp), 0, max(source.width - 2, 0))
+    fy = np.clip(y - iy, 0, 1).astype(np.float32)[:, None]
+    fx = np.clip(x - ix, 0, 1).astype(np.float32)[None, :]
+    row0, col0 = iy.min(), ix.min()
+    # only the source rows and columns under this window are paged in
+    window = np.asarray(data[row0:iy.max() + 2, col0:ix.max() + 2], dtype=np.float32)
+    iy1 = np.minimum(iy + 1, source.length - 1) - row0
+    ix1 = np.minimum(ix + 1, source.width - 1) - col0
+    iy, ix = iy - row0, ix - col0
+    top = window[np.ix_(iy, ix)] * (1 - fx) + window[np.ix_(iy, ix1)] * fx
+    bottom = window[np.ix_(iy1, ix)] * (1 - fx) + window[np.ix_(iy1, ix1)] * fx
+    block = top * (1 - fy) + bottom * fy
+    if not np.issubdtype(source.dtype, np.floating):
+        block = np.rint(block)
+    return block.astype(source.dtype)
+
+
+def _crop_window(data: np.ndarray, source: DemGrid, target: DemGrid, rows: Tuple[int, int]) -> np.ndarray:
+    row0 = round((target.north - source.north) / source.step_y)
+    col0 = round((target.west - source.west) / source.step_x)
+    start, stop = rows
+    return np.asarray(data[row0 + start:row0 + stop, col0:col0 + target.width])
+
+
+def plan_windows(source: DemGrid, target: DemGrid, memory_budget: int, workers: int, resample: bool) -> List[Tuple[int, int]]:
+    """
+    Split the target rows in windows small enough for workers of them to fit memory_budget bytes together.
+
+    A window holds its output rows, the source rows under them and, when
+    resampling, the float32 temporaries of the interpolation.
+    """
+    row_bytes = target.width * target.dtype.itemsize
+    if resample:
+        source_rows = abs(target.step_y / source.step_y)
+        source_cols = target.width * abs(target.step_x / source.step_x) + 2
+        row_bytes += target.width * BILINEAR_BYTES_PER_SAMPLE + source_rows * source_cols * 4
+    else:
+        row_bytes *= 2
+    window_rows = max(1, min(target.length, int(memory_budget / max(workers, 1) // row_bytes)))
+    return [(start, min(start + window_rows, target.length)) for start in range(0, target.length, window_rows)]
+
+
+def crop_dem(
+    source_path: Path,
+    output_path: Path,
+    bounds: Optional[Tuple[float, float, float, float]] = None,
+    step: Optional[float] = None,
+    method: ResampleMethod = ResampleMethod.BILINEAR,
+    memory_budget: int = 512 * 1024**2,
+    workers: int = 4,
+) -> DemGrid:
+    """
+    Crop and resample a DEM with an ISCE XML, window by window.
+
+    The source is memory mapped and the output is cut in windows of rows
+    processed by a thread pool, each written at its offset of the output
+    file, so peak memory stays within memory_budget whatever the size of
+    the DEM. The output gets an ISCE XML derived from the source one, a
+    VRT and an ENVI header.
+
+    Args:
+        source_path: DEM written by the dem step
+        output_path: Cropped DEM
+        bounds: (west, south, east, north) to crop to, defaults to the whole DEM
+        step: Pixel size in degrees, defaults to the pixel size of the source
+        method: Resampling of the source samples
+        memory_budget: Bytes all windows in flight may take together
+        workers: Windows processed at the same time
+
+    Returns:
+        Grid of the output DEM
+
+    Raises:
+        ValueError: bounds do not overlap the DEM, or its XML is unusable
+    """
+    source = read_isce_xml(source_path)
+    target = target_grid(source, output_path, bounds, step)
+    resample = step is not None
+    windows = plan_windows(source, target, memory_budget, workers, resample)
+    data = source.open()
+    row_bytes = target.width * target.dtype.itemsize
+    tmp_path = output_path.with_name(f".{output_path.name}.part")
+
+    with telemetry.span("dem.crop", windows=len(windows), bytes=target.nbytes, resample=resample):
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, target.nbytes)
+
+            def process(rows: Tuple[int, int]):
+                if resample:
+                    block = _resample_window(data, source, target, rows, method)
+                else:
+                    block = _crop_window(data, source, target, rows)
+                os.pwrite(fd, np.ascontiguousarray(block), rows[0] * row_bytes)
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # list() re-raises the first failed window
+                list(executor.map(process, windows))
+        finally:
+            os.close(fd)
+        os.replace(tmp_path, output_path)
+
+    write_isce_xml(source, target)
+    write_vrt(target)
+    write_envi_header(output_path, (target.length, target.width), target.west, target.north, target.step_x, target.dtype)
+    telemetry.count("dem.crop_bytes", target.nbytes)
+    return target
+
+
+def cropped_name(dem_path: Path) -> Path:
+    return dem_path.with_name(f"{dem_path.stem}_aoi{dem_path.suffix}")
+
+
+def aoi_bounds(config: ProjectConfig) -> Tuple[float, float, float, float]:
+    """Bounds of the AOI of the project with the footprint buffer of the dem section"""
+    west, south, east, north = wkt.loads(config.download.bounding_box).bounds
+    buffer = config.dem.footprint_buffer
+    return west - buffer, south - buffer, east + buffer, north + buffer
+
+
+def postprocess_dem(config: ProjectConfig, dem_path: Path) -> Optional[DemGrid]:
+    """Crop the DEM of the dem step to the AOI and resample it, as the dem section asks, None when it asks for neither"""
+    dem_config = config.dem
+    if not dem_config.crop_to_aoi and dem_config.resample_step is None:
+        return None
+    return crop_dem(
+        dem_path,
+        cropped_name(dem_path),
+        bounds=aoi_bounds(config) if dem_config.crop_to_aoi else None,
+        step=dem_config.resample_step,
+        method=dem_config.resample_method,
+        memory_budget=int(dem_config.memory_budget_mb * 1024**2),
+        workers=dem_config.workers,
+    )
@@ -1,16 +1,16 @@
 from pathlib import Path
-import os
 import sys
 
-import math
-import shutil
 from rich import print
 
-import sardem.dem
-from insarchitect.config import load_config
-import insarchitect.core.dem.get_boundingbox_from_kml as boundingbox_from_kml 
+import sardem.utils
+import insarchitect.core.dem.tiles as dem_tiles
+from insarchitect.core.dem.tile_cache import TileCache
+from insarchitect.core.dem.crop import postprocess_dem
+from insarchitect.core.download.engine import TransferEngine
 
 from ...models import ProjectConfig
+from .. import telemetry
 
 
 def format_bbox(bbox: tuple) -> str:
@@ -36,42 +36,40 @@ def format_bbox(bbox: tuple) -> str:
     return name
 
 
-def exist_valid_dem_dir(dem_dir: Path) -> bool:
-    """
-    Check if a valid DEM directory exists.
-    
-    Args:
-        dem_dir: Path to DEM directory
-    
-    Returns:
-        True if valid DEM exists, False otherwise
-        
-    Note:
-        If directory exists but doesn't contain valid products, it will be removed.
-    """
-    if dem_dir.is_dir():
-        products = list(dem_dir.glob('*dem.wgs84*'))
-        if len(products) >= 3:
-            print('[bold yellow]\nDEM products already exist. If not satisfying, remove the folder and run again[/bold yellow]')
-            return True
-        else:
-            print('[bold yellow]\nIncomplete DEM directory found. Removing and recreating...[/bold yellow]')
-            shutil.rmtree(dem_dir)
-            return False
-    else:
-        return False
-
-
-def dem_main(config: ProjectConfig):
+def fetch_tiles(tile_cache: TileCache, tiles: list, data_source: str, config: ProjectConfig, engine=None) -> list:
+    """Paths of the tiles from the cache, the missing ones fetched concurrently on engine (a new one by default)"""
+    if engine is None:
+        with TransferEngine.for_system(config.system) as engine:
+            return fetch_tiles(tile_cache, tiles, data_source, config, engine)
+
+    host = dem_tiles.tile_host(data_source)
+    engine.set_default_limit(host, dem_tiles.DEM_HOST_LIMIT)
+    advance = engine.progress_task(f"DEM tiles {config.project_name}", len(tiles))
+
+    async def fetch_all():
+        return await engine.gather(
+            (engine.transfer(host, tile_cache.get, tile, data_source, engine) for tile in tiles),
+            on_result=lambda _: advance(),
+        )
+
+    return engine.run(fetch_all())
+
+
+def dem_main(config: ProjectConfig, engine=None):
     """
     Download DEM based on template file and KML bounding box.
+
+    The tiles are fetched concurrently on engine, a TransferEngine shared
+    with the other steps of a run, or one of the DEM step alone.
     
     This function:
     1. Reads the configuration from the template file
     2. Locates the SSARA KML file with bounding box information
-    3. Extracts the bounding box coordinates
-    4. Downloads the DEM using sardem from Copernicus or NASA DEM
-    5. Creates ISCE-compatible XML files
+    3. Extracts the product footprints
+    4. Selects the 1x1 degree tiles intersecting the product footprints
+    5. Downloads the missing tiles concurrently using sardem from Copernicus or NASA DEM
+    6. Stitches them and creates ISCE-compatible XML files
+    7. Crops and resamples the DEM to the AOI when the dem section asks for it
     """
     
     # Get config
@@ -97,11 +95,6 @@ def dem_main(config: ProjectConfig):
     print(f"[bold]Working directory[/bold]: {work_dir}")
     print(f"[bold]DEM directory[/bold]:  {dem_dir}")
     
-    # Check for existing valid DEM
-    if exist_valid_dem_dir(dem_dir):
-        print("\n[bold cyan]Valid DEM already exists. Exiting.[/bold cyan]")
-        sys.exit(1)
-    
     # Create DEM directory
     dem_dir.mkdir(parents=True, exist_ok=True)
     
@@ -118,6 +111,14 @@ def dem_main(config: ProjectConfig):
     print('[bold magenta]\nSearching for KML file...\n[/bold magenta]')
     try:
         kml_files = sorted(slc_dir.glob('ssara_*.kml'))
+        if not kml_files:
+            # rebuild the KML from a cached search without touching the network
+            from insarchitect.core.download.download import create_kml, load_cached_results
+            cached_results = load_cached_results(config)
+            if cached_results:
+                slc_dir.mkdir(parents=True, exist_ok=True)
+                create_kml(slc_dir, cached_results)
+                kml_files = sorted(slc_dir.glob('ssara_*.kml'))
         if not kml_files:
             raise FileNotFoundError(
                 f'[bold red]No ssara_*.kml found in {slc_dir}\n'
@@ -130,58 +131,52 @@ def dem_main(config: ProjectConfig):
     
     print(f'[bold]Using KML file[/bold]: {ssara_kml_file.name}')
     
-    # Get bounding box from KML
-    print('[bold magenta]\nExtracting bounding box from KML...\n[/bold magenta]')
+    # Plan DEM tiles from the product footprints
+    print('[bold magenta]\nPlanning DEM tiles from KML footprints...\n[/bold magenta]')
     try:
-        bbox = boundingbox_from_kml.main( [str(ssara_kml_file), '--delta_lon', '0'] )    
+        with telemetry.span("dem.plan") as span:
+            footprints = dem_tiles.footprints_from_kml(ssara_kml_file)
+            plan = dem_tiles.plan_dem_tiles(footprints, buffer=download_dem_config.footprint_buffer)
+            span.set(footprints=len(footprints), tiles=len(plan.tiles))
     except Exception as e:
         print(f'[bold red]Problem with KML file: {e}[/bold red]')
         sys.exit(1)
-    
-    # Parse bbox string
-    bbox = bbox.split('SNWE:')[1]
-    bbox = [val for val in bbox.split()]
-
-    south = bbox[0]
-    north = bbox[1]
-    west = bbox[2]
-    east = bbox[3].split('\'')[0]
-
-    # Expand bbox with buffer
-    south = math.floor(float(south))
-    north = math.ceil(float(north))
-    west = math.floor(float(west))
-    east = math.ceil(float(east))
-    
+
     # Format bbox for sardem (Left, Bottom, Right, Top)
-    bbox_LeftBottomRightTop = [int(west), int(south), int(east), int(north)]
+    bbox_LeftBottomRightTop = list(plan.bbox)
     print(f"[bold]Bounding box[/bold]: {bbox_LeftBottomRightTop}")
+    print(f"[bold]DEM tiles[/bold]: {len(plan.tiles)} of {len(plan.bbox_tiles)} tiles in bounding box")
+    print(f"[bold]Skipped[/bold]: {plan.saved_tiles} tiles, "
+          f"{plan.saved_area_km2:,.0f} km², {plan.saved_bytes / 1024**3:.2f} GB")
 
     output_name = f"elevation_{format_bbox(bbox_LeftBottomRightTop)}.dem"
+    # no chdir, the step shares the process with the threads of other steps and projects
+    output_path = dem_dir / output_name
     data_source_str = "NASA DEM" if data_source == "NASA" else "Copernicus DEM"
     print('[bold magenta]\nDownloading DEM...\n[/bold magenta]')
     print(f"[bold]Output file[/bold]: {output_name}")
     print(f"[bold]Data source[/bold]: {data_source_str}")
-    
-    command = (
-        f"sardem --bbox {int(west)} {int(south)} {int(east)} {int(north)} "
-        f"--data {data_source} --make-isce-xml --output {output_name}"
-    )
+
+    tile_cache = TileCache(config.system.dem_cache_dir, max_bytes=int(config.system.dem_cache_size_gb * 1024**3))
+    print(f"[bold]Tile cache[/bold]: {tile_cache.root}")
     print(f"[bold magenta]\nSARDEM execution...\n[/bold magenta]")
-    print(f'[bold]Command[/bold]: {command}')
-    # Change to DEM directory
-    original_dir = Path.cwd()
-    os.chdir(dem_dir)
-    
+
     try:
-        sardem.dem.main(
-            bbox=bbox_LeftBottomRightTop,
-            data_source=data_source,
-            make_isce_xml=True,
-            output_name=output_name
-        )
+        for tile in plan.tiles:
+            print(f"[bold]Tile[/bold]: {dem_tiles.tile_name(tile)}")
+        tile_paths = dict(zip(plan.tiles, fetch_tiles(tile_cache, plan.tiles, data_source, config, engine)))
+
+        with telemetry.span("dem.stitch", tiles=len(tile_paths)):
+            dem_tiles.stitch_tiles(plan, tile_paths, output_path)
+        tile_cache.evict(protect=tile_paths.values())
+        with telemetry.span("dem.isce_xml"):
+            sardem.utils.gdal2isce_xml(str(output_path))
+        cropped = postprocess_dem(config, output_path)
+        if cropped is not None:
+            print(f"[bold]AOI DEM[/bold]: {cropped.path.name}, {cropped.width}x{cropped.length} samples every {cropped.step_x:.6f}°")
+
         # Verify output files
-        dem_files = list(Path('.').glob(f'{output_name}*'))
+        dem_files = list(dem_dir.glob(f'{output_name}*'))
         if dem_files:
             print("[bold]\nCreated files[/bold]:")
             for f in sorted(dem_files):
@@ -196,5 +191,3 @@ def dem_main(config: ProjectConfig):
     except Exception as e:
         print(f"[bold red]\nERROR during DEM download: {e}[/bold red]")
         sys.exit(1)
-    finally:
-        os.chdir(original_dir)
\ No newline at end of file
@@ -4,29 +4,137 @@
 # Created: October 2021                       #
 ###############################################
 
-import argparse
+from typing import NamedTuple
+
 import numpy as np
 import xml.etree.ElementTree as ET
 
-EXAMPLE = """Example:
-   get_boundingbox_from_kml.py *_20211019042049.kml —-delta_lat 0.5 —-delta_lon 1.2
-"""
+KML_NAMESPACES = (
+    'http://earth.google.com/kml/2.1',
+    'http://www.opengis.net/kml/2.2',
+)
+COORDINATES_TAGS = {f'{{{namespace}}}coordinates' for namespace in KML_NAMESPACES}
+# footprint outlines: LineString in the ssara KML 2.1 files, LinearRing of a Polygon in KML 2.2
+RING_TAGS = {f'{{{namespace}}}{tag}' for namespace in KML_NAMESPACES for tag in ('LineString', 'LinearRing')}
+
+
+class BoundingBox(NamedTuple):
+    south: float
+    north: float
+    west: float
+    east: float
+
+    def expand(self, delta_lat, delta_lon):
+        """Add the deltas and round to 0.1 degree like the legacy script"""
+        return BoundingBox(
+            float(np.around(self.south - delta_lat, 1)),
+            float(np.around(self.north + delta_lat, 1)),
+            float(np.around(self.west - delta_lon, 1)),
+            float(np.around(self.east + delta_lon, 1)),
+        )
+
+
+class _RunningBounds:
+    """Running min/max over blocks of (lon, lat) points"""
+
+    def __init__(self):
+        self.lon_min = self.lat_min = np.inf
+        self.lon_max = self.lat_max = -np.inf
+
+    def update(self, lonlat):
+        if lonlat.size == 0:
+            return
+        lon_min, lat_min = lonlat.min(axis=0)
+        lon_max, lat_max = lonlat.max(axis=0)
+        self.lon_min = min(self.lon_min, lon_min)
+        self.lat_min = min(self.lat_min, lat_min)
+        self.lon_max = max(self.lon_max, lon_max)
+        self.lat_max = max(self.lat_max, lat_max)
+
+    def bbox(self, source):
+        if not np.isfinite(self.lon_min):
+            raise ValueError(f'No coordinates found in {source}')
+        return BoundingBox(float(self.lat_min), float(self.lat_max), float(self.lon_min), float(self.lon_max))
+
+
+def _parse_coordinates(text):
+    """Parse a KML coordinates string ("lon,lat[,alt] ...") into an (N, 2) array"""
+    tuples = text.split()
+    if not tuples:
+        return np.empty((0, 2))
+    ncomponents = tuples[0].count(',') + 1
+    values = np.array(text.replace(',', ' ').split(), dtype=float)
+    return values.reshape(-1, ncomponents)[:, :2]
+
+
+def footprint_rings(kml_file):
+    """
+    Stream the footprint outlines of a KML file as (N, 2) lon/lat arrays.
+
+    Only the coordinates of LineString and LinearRing elements are read,
+    the ones of Points or labels are skipped. Parsed placemarks are
+    released right away, so memory stays flat on KMLs with many of them.
+    """
+    for _, element in ET.iterparse(kml_file, events=('end',)):
+        if element.tag in RING_TAGS:
+            for child in element:
+                if child.tag in COORDINATES_TAGS and child.text:
+                    yield _parse_coordinates(child.text)
+            element.clear()
+        elif element.tag.endswith('Placemark'):
+            element.clear()
 
-def create_parser():
-    parser = argparse.ArgumentParser(description='Get bounding box coordinates from kml file',
-                                     formatter_class=argparse.RawTextHelpFormatter,
-                                     epilog=EXAMPLE)
 
-    parser.add_argument('file', nargs=1, type=str, help='kml file\n')
-    parser.add_argument('--delta_lat', type=float, nargs=1, help='Delta latitude to subtract/add from minimum/maximimum latitude', default=[0.0])
-    parser.add_argument('--delta_lon', nargs=1, type=float, help='Delta longitude to subtract/add from minimum/maximimum longitude', default=[0.0])
+def bbox_from_kml(kml_file, delta_lat=0.0, delta_lon=0.0):
+    """
+    Stream a KML file and return the bounding box of its footprints.
 
-    return parser
+    Both the KML 2.1 and 2.2 namespaces are accepted.
+
+    Args:
+        kml_file: Path to KML file (str or Path)
+        delta_lat: Delta latitude to subtract/add from min/max latitude
+        delta_lon: Delta longitude to subtract/add from min/max longitude
+
+    Returns:
+        BoundingBox with float south, north, west, east
+    """
+    bounds = _RunningBounds()
+    for lonlat in footprint_rings(kml_file):
+        bounds.update(lonlat)
+    return bounds.bbox(kml_file).expand(delta_lat, delta_lon)
+
+
+def _geometry_lonlat(coordinates):
+    """Flatten nested GeoJSON coordinates into an (N, 2) array"""
+    try:
+        array = np.asarray(coordinates, dtype=float)
+        if array.ndim >= 2:
+            return array.reshape(-1, array.shape[-1])[:, :2]
+    except ValueError:
+        # rings of different length (e.g. polygons with holes)
+        pass
+    blocks = [_geometry_lonlat(part) for part in coordinates]
+    return np.concatenate(blocks) if blocks else np.empty((0, 2))
+
+
+def bbox_from_results(results, delta_lat=0.0, delta_lon=0.0):
+    """
+    Compute the same bounding box as bbox_from_kml from in-memory search results.
+
+    Args:
+        results: Iterable of ASF products (anything with a GeoJSON .geometry)
+        delta_lat: Delta latitude to subtract/add from min/max latitude
+        delta_lon: Delta longitude to subtract/add from min/max longitude
+
+    Returns:
+        BoundingBox with float south, north, west, east
+    """
+    bounds = _RunningBounds()
+    for product in results:
+        bounds.update(_geometry_lonlat(product.geometry['coordinates']))
+    return bounds.bbox('search results').expand(delta_lat, delta_lon)
 
-def cmd_line_parse(iargs=None):
-    parser = create_parser()
-    inps = parser.parse_args(args=iargs)
-    return inps
 
 def process_kml(kml_file, delta_lat, delta_lon):
     """
@@ -38,61 +146,6 @@ def process_kml(kml_file, delta_lat, delta_lon):
         delta_lon: Delta longitude to subtract/add from min/max longitude
     
     Returns:
-        Tuple of (lat_min, lat_max, lon_min, lon_max)
+        BoundingBox with float south, north, west, east
     """
-    tree = ET.parse(kml_file)
-    #root = tree.getroot()
-
-    # read lon/lat coordinate into latlon_store matrix
-    lineStrings = tree.findall('.//{http://earth.google.com/kml/2.1}LineString')
-    if not lineStrings:
-        lineStrings = tree.findall('.//{http://www.opengis.net/kml/2.2}LinearRing')
-        latlon_store = np.empty(shape=[0,2], dtype=float)
-        for attributes in lineStrings:
-            for sub in attributes:
-                if sub.tag == '{http://www.opengis.net/kml/2.2}coordinates':
-                    corners = sub.text.split()
-                    for corner in corners[0:-1]:
-                        lon, lat, _ = corner.split(',')
-                        latlon_store = np.append(latlon_store,np.array([[float(lon), float(lat)]]),axis=0)
-    else:
-        latlon_store = np.empty(shape=[0,2],dtype=float)
-        for attributes in lineStrings:
-            for subAttribute in attributes:
-                if subAttribute.tag == '{http://earth.google.com/kml/2.1}coordinates':
-                    corners = subAttribute.text.split(' ')
-                    for corner in corners[0:-1]:
-                        lon, lat, _ = corner.split(',')
-                        latlon_store = np.append(latlon_store,np.array([[float(lon), float(lat)]]),axis=0)
-    # select the max/min lat and lon
-    lat_max = np.max(latlon_store[:,1])
-    lat_min = np.min(latlon_store[:,1])
-
-    lon_max = np.max(latlon_store[:,0])
-    lon_min = np.min(latlon_store[:,0])
-
-    # add the delta_lat/delta_lon
-    lat_max2 = np.around((lat_max + delta_lat), 1)
-    lat_min2 = np.around((lat_min - delta_lat), 1)
-
-    lon_max2 = np.around((lon_max + delta_lon), 1)
-    lon_min2 = np.around((lon_min - delta_lon), 1)
-
-    return lat_min2, lat_max2, lon_min2, lon_max2
-
-def main(iargs=None):
-    inps = cmd_line_parse(iargs)
-
-    kml_file = inps.file[0]
-
-    delta_lat = inps.delta_lat[0]
-    delta_lon = inps.delta_lon[0]
-
-    lat_min2, lat_max2, lon_min2, lon_max2 = process_kml(kml_file=kml_file, delta_lat=delta_lat, delta_lon=delta_lon)
-
-    lat_lon_str = f'SNWE: {lat_min2} {lat_max2} {lon_min2} {lon_max2}'
-    
-    return lat_lon_str
-
-if __name__ == '__main__':
-    main()
\ No newline at end of file
+    return bbox_from_kml(kml_file, delta_lat=delta_lat, delta_lon=delta_lon)
@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import tempfile
+from pathlib import Path
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Iterable, Optional
+
+from .. import telemetry
+from .tiles import Tile, tile_host, tile_name, fetch_tile
+
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+
+# fetch_fn(tile, data_source, directory) -> path of a new tile inside directory
+TileFetcher = Callable[[Tile, str, Path], Path]
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def directory_fetcher(source_dir: Path) -> TileFetcher:
+    """Fetcher copying <tile_name>_<data_source>.dem files from a local directory"""
+    def fetch(tile: Tile, data_source: str, directory: Path) -> Path:
+        name = f"{tile_name(tile)}_{data_source}.dem"
+        return Path(shutil.copy(source_dir / name, directory / name))
+    return fetch
+
+
+class TileCache:
+    """
+    System-wide, content-addressed store of DEM tiles.
+
+    Tiles are stored as objects/<sha256[:2]>/<sha256>.dem and an index maps
+    "<data_source>/<tile name>" to the object with its size and mtime. The
+    sha256 is computed once when a tile is added, lookups only compare the
+    size and mtime and record the use in the access time of the object, so
+    a warm cache neither reads the tiles nor rewrites the index. The index
+    is written atomically under an exclusive flock, and each tile key has
+    its own lock while being fetched, so concurrent Slurm jobs neither
+    corrupt the index nor download the same tile twice. When the store
+    grows past max_bytes, evict() removes the least recently used tiles.
+
+    Args:
+        root: Cache directory, shared between projects
+        max_bytes: Size cap of the stored objects
+        fetch_fn: Function creating a missing tile, defaults to sardem
+    """
+
+    def __init__(self, root: Path, max_bytes: int, fetch_fn: Optional[TileFetcher] = None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.fetch_fn = fetch_fn or fetch_tile
+        (self.root / "objects").mkdir(parents=True, exist_ok=True)
+        (self.root / "locks").mkdir(exist_ok=True)
+        self.index_path = self.root / "index.json"
+
+    @contextmanager
+    def _lock(self, name: str):
+        with open(self.root / "locks" / f"{name}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_index(self) -> dict:
+        try:
+            return json.loads(self.index_path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_index(self, index: dict):
+        tmp_path = self.index_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(index, indent=1))
+        os.replace(tmp_path, self.index_path)
+
+    def _object_path(self, digest: str) -> Path:
+        return self.root / "objects" / digest[:2] / f"{digest}.dem"
+
+    @staticmethod
+    def key(tile: Tile, data_source: str) -> str:
+        return f"{data_source}/{tile_name(tile)}"
+
+    def lookup(self, tile: Tile, data_source: str, verify: bool = False) -> Optional[Path]:
+        """
+        Return the cached tile, or None if it is missing or was changed since it was added.
+
+        Args:
+            tile: Tile to look up
+            data_source: DEM source of the tile
+            verify: Also check the sha256 of the object, reading it whole
+        """
+        key = self.key(tile, data_source)
+        # the index is replaced atomically, reading it needs no lock
+        entry = self._read_index().get(key)
+        if entry is None:
+            return None
+
+        path = self._object_path(entry["sha256"])
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            self._drop(key)
+            return None
+        if stat.st_size != entry["size"] or stat.st_mtime_ns != entry.get("mtime_ns", stat.st_mtime_ns):
+            self._drop(key)
+            return None
+        if verify and _sha256(path) != entry["sha256"]:
+            self._drop(key)
+            return None
+        # the access time is the last use evict() goes by, the mtime is left alone
+        os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+        return path
+
+    def _drop(self, key: str):
+        with self._lock("index"):
+            index = self._read_index()
+            entry = index.pop(key, None)
+            self._write_index(index)
+        if entry is not None and not any(e["sha256"] == entry["sha256"] for e in index.values()):
+            self._object_path(entry["sha256"]).unlink(missing_ok=True)
+
+    def add(self, tile: Tile, data_source: str, source: Path) -> Path:
+        """Move a new tile into the store, returns the object path"""
+        digest = _sha256(source)
+        path = self._object_path(digest)
+        path.parent.mkdir(exist_ok=True)
+        if path.exists():
+            source.unlink()
+        else:
+            os.replace(source, path)
+
+        stat = path.stat()
+        with self._lock("index"):
+            index = self._read_index()
+            index[self.key(tile, data_source)] = {
+                "sha256": digest,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "last_used": time.time(),
+            }
+            self._write_index(index)
+        return path
+
+    def get(self, tile: Tile, data_source: str, engine=None) -> Path:
+        """Return the tile from the store, fetching it first (in a slot of engine when given) if needed"""
+        path = self.lookup(tile, data_source)
+        if path is not None:
+            telemetry.count("dem.tile_cache_hits")
+            return path
+
+        key = self.key(tile, data_source).replace("/", "_")
+        with self._lock(key):
+            # another job may have fetched the tile while we waited
+            path = self.lookup(tile, data_source)
+            if path is not None:
+                return path
+            telemetry.count("dem.tile_cache_misses")
+            with tempfile.TemporaryDirectory(dir=self.root, prefix=".fetch_") as tmp_dir:
+                started = time.perf_counter()
+                with engine.slot(tile_host(data_source)) if engine is not None else nullcontext():
+                    with telemetry.span("dem.fetch_tile", tile=tile_name(tile)):
+                        fetched = self.fetch_fn(tile, data_source, Path(tmp_dir))
+                telemetry.observe("dem.fetch_latency", time.perf_counter() - started)
+                return self.add(tile, data_source, fetched)
+
+    def size(self) -> int:
+        with self._lock("index"):
+            index = self._read_index()
+        objects = {entry["sha256"]: entry["size"] for entry in index.values()}
+        return sum(objects.values())
+
+    def evict(self, protect: Iterable[Path] = ()) -> list:
+        """
+        Remove least recently used tiles until the store fits max_bytes.
+
+        Args:
+            protect: Object paths in use by the caller, never evicted
+
+        Returns:
+            Digests of the removed objects
+        """
+        protected = {Path(path).stem for path in protect}
+        removed = []
+        with self._lock("index"):
+            index = self._read_index()
+            last_used = {}
+            sizes = {}
+            for entry in index.values():
+                digest = entry["sha256"]
+                try:
+                    used = self._object_path(digest).stat().st_atime
+                except FileNotFoundError:
+                    used = 0
+                last_used[digest] = max(last_used.get(digest, 0), entry["last_used"], used)
+                sizes[digest] = entry["size"]
+            total = sum(sizes.values())
+
+            for digest in sorted(last_used, key=last_used.get):
+                if total <= self.max_bytes:
+                    break
+                if digest in protected:
+                    continue
+                total -= sizes[digest]
+                removed.append(digest)
+
+            if removed:
+                index = {key: entry for key, entry in index.items() if entry["sha256"] not in removed}
+                self._write_index(index)
+
+        # open memory maps keep working, the inode lives until they are closed
+        for digest in removed:
+            self._object_path(digest).unlink(missing_ok=True)
+        return removed
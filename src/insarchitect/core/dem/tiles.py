@@ -0,0 +1,210 @@
+import os
+import math
+import tempfile
+from pathlib import Path
+from dataclasses import dataclass
+from typing import List, Tuple
+
+import numpy as np
+import shapely
+from shapely.geometry import Polygon, shape, box
+from shapely.ops import unary_union
+
+import sardem.dem
+from sardem.constants import DEFAULT_RES
+
+from .get_boundingbox_from_kml import footprint_rings
+
+# pixels along one side of a 1x1 degree tile at the sardem default resolution
+TILE_PIXELS = round(1 / DEFAULT_RES)
+# float32 samples of one stitched tile
+TILE_BYTES = TILE_PIXELS * TILE_PIXELS * np.dtype(np.float32).itemsize
+KM_PER_DEGREE = 111.32
+NODATA = 0
+# ENVI "data type" codes of the sample types of a DEM
+ENVI_DATA_TYPES = {
+    ("i", 1): 1,
+    ("u", 1): 1,
+    ("i", 2): 2,
+    ("i", 4): 3,
+    ("f", 4): 4,
+    ("f", 8): 5,
+    ("u", 2): 12,
+    ("u", 4): 13,
+}
+# concurrent tile fetches from one DEM source, sardem picks the URLs so the limit is per source
+DEM_HOST_LIMIT = 4
+
+Tile = Tuple[int, int]
+
+
+@dataclass
+class DemPlan:
+    """1x1 degree tiles needed to cover a set of footprints"""
+    tiles: List[Tile]
+    bbox: Tuple[int, int, int, int]
+    bbox_tiles: List[Tile]
+
+    @property
+    def saved_tiles(self) -> int:
+        return len(self.bbox_tiles) - len(self.tiles)
+
+    @property
+    def saved_bytes(self) -> int:
+        return self.saved_tiles * TILE_BYTES
+
+    @property
+    def saved_area_km2(self) -> float:
+        selected = set(self.tiles)
+        return sum(tile_area_km2(tile) for tile in self.bbox_tiles if tile not in selected)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        west, south, east, north = self.bbox
+        return (north - south) * TILE_PIXELS, (east - west) * TILE_PIXELS
+
+
+def tile_area_km2(tile: Tile) -> float:
+    lon, lat = tile
+    return KM_PER_DEGREE ** 2 * abs(math.cos(math.radians(lat + 0.5)))
+
+
+def tile_name(tile: Tile) -> str:
+    lon, lat = tile
+    lat_str = f"S{abs(lat):02d}" if lat < 0 else f"N{lat:02d}"
+    lon_str = f"W{abs(lon):03d}" if lon < 0 else f"E{lon:03d}"
+    return f"{lat_str}{lon_str}"
+
+
+def tile_host(data_source: str) -> str:
+    """Host key of the tiles of a DEM source in a TransferEngine"""
+    return f"dem:{data_source}"
+
+
+def footprints_from_kml(kml_file) -> List[Polygon]:
+    """Read every footprint ring of an ssara KML as a shapely Polygon"""
+    return [Polygon(lonlat) for lonlat in footprint_rings(kml_file) if len(lonlat) >= 3]
+
+
+def footprints_from_results(results) -> List[Polygon]:
+    return [shape(product.geometry) for product in results]
+
+
+def plan_dem_tiles(footprints: List[Polygon], buffer: float = 0.1) -> DemPlan:
+    """
+    Select the 1x1 degree tiles that intersect the union of the footprints.
+
+    Args:
+        footprints: Product footprints in lon/lat
+        buffer: Degrees added around the union before selecting tiles
+
+    Returns:
+        DemPlan with the selected tiles and the whole-degree bounding box
+    """
+    if not footprints:
+        raise ValueError("No footprints to plan a DEM for")
+
+    coverage = unary_union(footprints).buffer(buffer)
+    min_lon, min_lat, max_lon, max_lat = coverage.bounds
+    west, south = math.floor(min_lon), math.floor(min_lat)
+    east, north = math.ceil(max_lon), math.ceil(max_lat)
+
+    bbox_tiles = [(lon, lat) for lat in range(south, north) for lon in range(west, east)]
+    boxes = np.array([box(lon, lat, lon + 1, lat + 1) for lon, lat in bbox_tiles])
+    shapely.prepare(coverage)
+    hits = shapely.intersects(boxes, coverage)
+    tiles = [tile for tile, hit in zip(bbox_tiles, hits) if hit]
+
+    # shrink the bbox to the selected tiles
+    lons = [lon for lon, _ in tiles]
+    lats = [lat for _, lat in tiles]
+    bbox = (min(lons), min(lats), max(lons) + 1, max(lats) + 1)
+    bbox_tiles = [tile for tile in bbox_tiles if bbox[0] <= tile[0] < bbox[2] and bbox[1] <= tile[1] < bbox[3]]
+    return DemPlan(tiles=tiles, bbox=bbox, bbox_tiles=bbox_tiles)
+
+
+def fetch_tile(tile: Tile, data_source: str, tile_dir: Path) -> Path:
+    """Create a single 1x1 degree WGS84 float32 DEM tile with sardem"""
+    tile_dir.mkdir(parents=True, exist_ok=True)
+    path = tile_dir / f"{tile_name(tile)}_{data_source}.dem"
+    if path.exists():
+        return path
+
+    lon, lat = tile
+    # sardem writes sidecar files next to its output, keep them in a private directory
+    with tempfile.TemporaryDirectory(dir=tile_dir, prefix=".fetch_") as tmp_dir:
+        tmp_path = Path(tmp_dir) / path.name
+        sardem.dem.main(
+            output_name=str(tmp_path),
+            bbox=(lon, lat, lon + 1, lat + 1),
+            data_source=data_source,
+            output_format="ENVI",
+            output_type="float32",
+        )
+        os.replace(tmp_path, path)
+    return path
+
+
+def read_tile(path: Path) -> np.ndarray:
+    """Memory map a raw float32 tile"""
+    tile = np.memmap(path, dtype=np.float32, mode="r")
+    side = math.isqrt(tile.size)
+    if side * side != tile.size:
+        raise ValueError(f"{path} is not a square float32 tile ({tile.size} samples)")
+    return tile.reshape(side, side)
+
+
+def write_envi_header(path: Path, shape: Tuple[int, int], west: float, north: float, step: float, dtype=np.float32):
+    """ENVI header so GDAL (and sardem.utils.gdal2isce_xml) can read the raw DEM of little endian dtype samples"""
+    rows, cols = shape
+    dtype = np.dtype(dtype)
+    data_type = ENVI_DATA_TYPES[dtype.kind, dtype.itemsize]
+    header = (
+        "ENVI\n"
+        f"samples = {cols}\n"
+        f"lines = {rows}\n"
+        "bands = 1\n"
+        "header offset = 0\n"
+        "file type = ENVI Standard\n"
+        f"data type = {data_type}\n"
+        "interleave = bsq\n"
+        "byte order = 0\n"
+        f"map info = {{Geographic Lat/Lon, 1, 1, {west}, {north}, {step}, {step}, WGS-84}}\n"
+    )
+    Path(f"{os.path.splitext(path)[0]}.hdr").write_text(header)
+
+
+def stitch_tiles(plan: DemPlan, tile_paths: dict, output_path: Path, max_block_bytes: int = 64 * 1024**2) -> Path:
+    """
+    Stitch tiles into a raw float32 DEM covering plan.bbox.
+
+    Tiles are memory mapped and the output is written in blocks of rows, so
+    peak memory is bounded by max_block_bytes whatever the size of the AOI.
+    Tiles outside the plan are left as nodata (0), so the DEM is masked to
+    the tile set while keeping a rectangular grid for ISCE.
+    """
+    west, south, east, north = plan.bbox
+    rows, cols = plan.shape
+    block_rows = max(1, min(TILE_PIXELS, max_block_bytes // (cols * np.dtype(np.float32).itemsize)))
+
+    with open(output_path, "wb") as f:
+        for lat in range(north - 1, south - 1, -1):
+            row_tiles = {}
+            for lon in range(west, east):
+                path = tile_paths.get((lon, lat))
+                if path is None:
+                    continue
+                data = read_tile(path)
+                if data.shape != (TILE_PIXELS, TILE_PIXELS):
+                    raise ValueError(f"{path}: expected {TILE_PIXELS}x{TILE_PIXELS} samples, got {data.shape}")
+                row_tiles[(lon - west) * TILE_PIXELS] = data
+
+            for start in range(0, TILE_PIXELS, block_rows):
+                stop = min(start + block_rows, TILE_PIXELS)
+                block = np.full((stop - start, cols), NODATA, dtype=np.float32)
+                for col, data in row_tiles.items():
+                    block[:, col:col + TILE_PIXELS] = data[start:stop]
+                block.tofile(f)
+
+    write_envi_header(output_path, plan.shape, west, north, DEFAULT_RES)
+    return output_path
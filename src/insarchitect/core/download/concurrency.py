@@ -0,0 +1,119 @@
+import time
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+from .. import telemetry
+from .transfer import DownloadCancelled
+
+# seconds of transfers compared when tuning the limit
+SAMPLE_INTERVAL = 5.0
+# relative throughput gain that justifies one more transfer
+MIN_GAIN = 0.1
+# intervals the limit is held after a plateau before probing upwards again
+PLATEAU_HOLD = 6
+
+
+class AdaptiveConcurrency:
+    """
+    Number of concurrent transfers tuned from the measured throughput.
+
+    Transfers take a slot before connecting and report the bytes they
+    receive. Every interval the throughput of the last interval is compared
+    with the best one seen: while one more transfer raises it by more than
+    min_gain, the limit grows by one up to maximum. Once throughput
+    plateaus the limit returns to the best value and is held for a while
+    before probing again, so a change of bandwidth is picked up. A
+    throttling answer (429, 503) halves the limit right away.
+
+    Args:
+        maximum: Upper bound of the limit, DownloadConfig.parallel_downloads
+        initial: Limit to start from, defaults to 2
+        interval: Seconds of transfers measured per sample
+        min_gain: Relative throughput gain needed to keep a higher limit
+        clock: Monotonic clock, replaceable for tests and benchmarks
+    """
+
+    def __init__(self, maximum: int, initial: Optional[int] = None, interval: float = SAMPLE_INTERVAL, min_gain: float = MIN_GAIN, clock=time.monotonic):
+        self.maximum = max(1, maximum)
+        self.limit = max(1, min(self.maximum, initial or 2))
+        self.interval = interval
+        self.min_gain = min_gain
+        self.clock = clock
+        self.running = 0
+
+        self._cond = threading.Condition()
+        self._bytes = 0
+        self._sample_start = clock()
+        self._best_throughput = 0.0
+        self._best_limit = self.limit
+        self._hold_until = 0.0
+        self._throttled_until = 0.0
+
+    @contextmanager
+    def slot(self, cancel: Optional[threading.Event] = None):
+        """
+        Wait until a transfer may start, the slot is released when the block exits.
+
+        Raises:
+            DownloadCancelled: cancel was set while waiting
+        """
+        with self._cond:
+            while self.running >= self.limit:
+                if cancel is not None and cancel.is_set():
+                    raise DownloadCancelled("waiting for a transfer slot")
+                self._cond.wait(timeout=1)
+            self.running += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.running -= 1
+                self._cond.notify_all()
+
+    def record(self, nbytes: int):
+        """Account for received bytes, adjusting the limit once per interval"""
+        with self._cond:
+            self._bytes += nbytes
+            now = self.clock()
+            elapsed = now - self._sample_start
+            if elapsed >= self.interval:
+                self._adjust(self._bytes / elapsed, now)
+                self._bytes = 0
+                self._sample_start = now
+
+    def _adjust(self, throughput: float, now: float):
+        telemetry.observe("download.concurrency", self.limit)
+        if now < self._hold_until:
+            return
+        if self.running < self.limit:
+            # too few transfers left to tell what the limit is worth
+            return
+        if throughput > self._best_throughput * (1 + self.min_gain):
+            self._best_throughput = throughput
+            self._best_limit = self.limit
+            if self.limit < self.maximum:
+                self.limit += 1
+                self._cond.notify_all()
+        elif self.limit > self._best_limit:
+            # the last transfer added nothing, bandwidth is saturated
+            self.limit = self._best_limit
+            self._hold_until = now + PLATEAU_HOLD * self.interval
+            # probe again after the hold, against what the link gives then
+            self._best_throughput = 0.0
+        else:
+            self._best_throughput = throughput
+
+    def throttled(self):
+        """The server asked to slow down: halve the limit and hold it for a couple of intervals"""
+        with self._cond:
+            now = self.clock()
+            telemetry.count("download.throttled")
+            # concurrent transfers throttled together count once
+            if now < self._throttled_until:
+                return
+            self.limit = max(1, self.limit // 2)
+            self._best_limit = self.limit
+            self._best_throughput = 0.0
+            self._throttled_until = now + self.interval
+            self._hold_until = now + 2 * self.interval
@@ -0,0 +1,132 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+import shapely
+import asf_search as asf
+from shapely import wkt
+from shapely.geometry import Polygon, shape
+from shapely.strtree import STRtree
+
+# coverage below 1 by less than this is rounding, not a gap
+COVERAGE_TOLERANCE = 1e-6
+
+
+@dataclass
+class DateCoverage:
+    """Fraction of the AOI covered by the selected products of an acquisition date"""
+    date: str
+    coverage: float
+    products: int
+
+
+@dataclass
+class Selection:
+    """Products kept for download, the dropped ones and the AOI coverage of every date"""
+    results: asf.ASFSearchResults
+    dropped: list = field(default_factory=list)
+    dates: List[DateCoverage] = field(default_factory=list)
+    dropped_dates: List[str] = field(default_factory=list)
+
+    @property
+    def saved_bytes(self) -> int:
+        return sum(int(product.properties.get("bytes") or 0) for product in self.dropped)
+
+    @property
+    def incomplete_dates(self) -> List[DateCoverage]:
+        return [date for date in self.dates if date.coverage < 1 - COVERAGE_TOLERANCE]
+
+
+def acquisition_date(product) -> str:
+    return product.properties["startTime"][:10]
+
+
+def burst_id(product) -> Optional[str]:
+    return (product.properties.get("burst") or {}).get("fullBurstID")
+
+
+def _date_selection(clipped: np.ndarray, min_gain: float) -> tuple:
+    """
+    Greedily pick the clipped footprints of a date that add coverage.
+
+    The largest footprints are taken first, a footprint is kept when the AOI
+    area it adds to the ones already kept exceeds min_gain.
+
+    Returns:
+        Tuple of (positions of the kept footprints, covered area)
+    """
+    kept = []
+    covered = Polygon()
+    for position in np.argsort(-shapely.area(clipped), kind="stable"):
+        gain = shapely.area(shapely.difference(clipped[position], covered))
+        if gain > min_gain:
+            kept.append(int(position))
+            covered = shapely.union(covered, clipped[position])
+    return kept, shapely.area(covered)
+
+
+def select_products(results, aoi_wkt: str, min_contribution: float = 0.0, min_date_coverage: float = 0.0) -> Selection:
+    """
+    Keep the products that contribute to the AOI coverage of their acquisition date.
+
+    An STRtree over the footprints finds the products intersecting the AOI,
+    then the footprints of each date are clipped to the AOI and kept while
+    they add more than min_contribution of the AOI area to the coverage of
+    that date. Frames that only touch the AOI, or whose clip is already
+    covered by the other frames of the date, are dropped. Bursts are
+    selected by burst ID instead, a burst contributing on any date is kept
+    on every date so the stack stays consistent.
+
+    Args:
+        results: ASF search results
+        aoi_wkt: AOI polygon as WKT (DownloadConfig.bounding_box)
+        min_contribution: Fraction of the AOI a product must add to be kept
+        min_date_coverage: Dates covering less of the AOI are dropped entirely
+
+    Returns:
+        Selection with the kept results in search order
+    """
+    products = list(results)
+    aoi = wkt.loads(aoi_wkt)
+    aoi_area = shapely.area(aoi)
+    if not products or aoi_area == 0:
+        # a point or line AOI has no area to cover
+        return Selection(results)
+
+    footprints = np.array([shape(product.geometry) for product in products])
+    tree = STRtree(footprints)
+    hits = set(tree.query(aoi, predicate="intersects").tolist())
+
+    by_date: Dict[str, List[int]] = {}
+    for index, product in enumerate(products):
+        if index in hits:
+            by_date.setdefault(acquisition_date(product), []).append(index)
+
+    contributing = set()
+    dates = []
+    dropped_dates = []
+    shapely.prepare(aoi)
+    for date in sorted(by_date):
+        indices = by_date[date]
+        clipped = shapely.intersection(footprints[indices], aoi)
+        kept, covered = _date_selection(clipped, min_contribution * aoi_area)
+        coverage = covered / aoi_area
+        if coverage < min_date_coverage:
+            dropped_dates.append(date)
+            continue
+        contributing.update(indices[position] for position in kept)
+        dates.append(DateCoverage(date, coverage, len(kept)))
+
+    if any(burst_id(product) for product in products):
+        bursts = {burst_id(products[index]) for index in contributing}
+        keep = {
+            index for index, product in enumerate(products)
+            if burst_id(product) in bursts and acquisition_date(product) not in dropped_dates
+        }
+    else:
+        keep = contributing
+
+    selected = asf.ASFSearchResults([product for index, product in enumerate(products) if index in keep])
+    selected.searchComplete = True
+    dropped = [product for index, product in enumerate(products) if index not in keep]
+    return Selection(selected, dropped, dates, dropped_dates)
@@ -1,26 +1,108 @@
 import os
 import sys
 import datetime
-import warnings
 from functools import reduce
 from pathlib import Path
-import time
-from concurrent.futures import ThreadPoolExecutor
 
 from asf_search.exceptions import ASFAuthenticationError
 from rich import print
-from rich.progress import Progress, BarColumn, TextColumn, DownloadColumn, TransferSpeedColumn
+from rich.progress import Progress
 from shapely.geometry import Polygon, shape
 import asf_search as asf
+import requests
 import simplekml
 
-from ...models import ProjectConfig
+from ...models import ProjectConfig, DownloadConfig
+from .. import telemetry
+from .transfer import ChecksumMismatch, DownloadFailures, ProductNotReady, Throttled, download_products, part_path, product_target
+from .engine import TransferEngine
+from .progress import DownloadProgress, RichProgressDisplay, progress_columns
+from .search_cache import SearchCacheMiss, load_cached_search, invalidate_search_cache, merge_results, windowed_search
+from .slc_store import SlcStore
+from .staging import InsufficientSpace, ScratchStaging, SpacePlan
+from .coverage import select_products
+
+
+def download_main(config: ProjectConfig, progress_callbacks: tuple = ()):
+    """
+    Download SLC images and a KML file based on config
+
+    Products are queued for download as soon as their search window
+    completes, the KML is written once the whole search is in.
+    progress_callbacks receive (file_stats, aggregate_stats) TransferStats
+    with byte counts, throughput and ETA as the transfers advance.
+    """
+    slc_dir = print_download_summary(config)
+    results = []
+    failures = None
+    store = SlcStore.for_system(config.system)
+    staging = ScratchStaging.for_system(config.system)
+    plan = SpacePlan(store.root if store is not None else slc_dir, staging)
+
+    with Progress(*progress_columns()) as progress:
+        download_progress = DownloadProgress(callbacks=[RichProgressDisplay(progress, None), *progress_callbacks])
+
+        def stream():
+            for window in iter_search(config):
+                resume_incomplete_downloads(slc_dir, window)
+                check_space(plan, window, slc_dir, store)
+                download_progress.add_total(products_bytes(window))
+                results.extend(window)
+                yield from window
+
+        try:
+            # Ctrl-C stops the transfers, leaving the engine waits for the running ones to keep their .part files
+            with TransferEngine.for_system(config.system, config.download.parallel_downloads, progress=progress) as engine:
+                download_products(
+                    stream(),
+                    slc_dir,
+                    workers=config.download.parallel_downloads,
+                    progress=download_progress,
+                    store=store,
+                    adaptive=config.download.adaptive_downloads,
+                    staging=staging,
+                    engine=engine,
+                )
+        except DownloadFailures as e:
+            # the products that made it are usable, describe them before failing
+            failures = e
+        except SystemExit:
+            # the search already reported the error
+            raise
+        except BaseException as e:
+            report_download_error(e)
+            sys.exit(1)
+        finally:
+            if staging is not None:
+                staging.close()
+
+    total_bytes = print_search_summary(results)
+    create_kml(slc_dir, results)
+    if config.extract is not None and not config.download.burst_download:
+        extract_downloads(config, results, slc_dir)
+    if failures is not None:
+        report_download_error(failures)
+        sys.exit(1)
+    print(f"[bold green]Finished downloading {round(total_bytes / (1024**3), 2)} GB for a total of {len(results)} images[/bold green]")
 
-warnings.filterwarnings('ignore', message='File already exists, skipping download:*')
 
+def extract_downloads(config: ProjectConfig, results, slc_dir: Path):
+    """Extract the needed subswaths of the downloaded products"""
+    from .extract import extract_products, print_extract_summary, project_aoi, safe_dir
 
-def download_main(config: ProjectConfig):
-    """Download SLC images and a KML file based on config"""
+    zip_paths = [path for path in (product_target(product, slc_dir) for product in results) if path.exists()]
+    print(f"[bold]Extracting[/bold] {len(zip_paths)} products to {safe_dir(config)}")
+    plans = extract_products(zip_paths, safe_dir(config), project_aoi(config), config.extract)
+    print_extract_summary(plans)
+
+
+def print_download_summary(config: ProjectConfig) -> Path:
+    """
+    Print the download settings and create the SLC directory.
+
+    Returns:
+        The SLC directory
+    """
     download_config = config.download
     if download_config is None:
         print(f"[Bold red]No valid configuration given for download command[/bold red]")
@@ -45,70 +127,143 @@ def download_main(config: ProjectConfig):
     print(f"[bold]Bounding Box[/bold]:       {download_config.bounding_box}")
     print(f"[bold]Output Directory[/bold]:   {slc_dir}")
     print(f"[bold]Date Range[/bold]:         {download_config.start_date} to {download_config.end_date}")
-    print(f"[bold]Max Results[/bold]:        {download_config.max_results}")
+    print(f"[bold]Search Windows[/bold]:     {download_config.search_window_days} days, {download_config.search_workers} at a time")
     print(f"[bold]Parallel Downloads[/bold]: {download_config.parallel_downloads}")
+    return slc_dir
 
-    start = datetime.datetime.strptime(str(download_config.start_date), "%Y%m%d")
-    end = datetime.datetime.strptime(str(download_config.end_date), "%Y%m%d")
 
-    opts = {
-        'platform': download_config.platform.value,
-        'maxResults': download_config.max_results,
-        'start': start,
-        'end': end,
-        'processingLevel': product_type,
-        "intersectsWith": download_config.bounding_box
-    }
+def iter_search(config: ProjectConfig, search_fn=None):
+    """
+    Search ASF (through the search cache) and yield the products window by window.
+
+    Windows are searched concurrently and yielded as they complete, without
+    the products of earlier windows. With aoi_selection each window goes
+    through the coverage selection, windows hold whole acquisition dates.
+    Bursts are selected across dates, so a burst search is selected once on
+    the merged windows and yielded as a single window.
 
+    Args:
+        config: Project configuration
+        search_fn: Function returning all the results of a project at once, instead of the windowed search
 
+    Yields:
+        ASFSearchResults of each window
+    """
+    download_config = config.download
     try:
-        results = asf.geo_search(**opts)
-        results.raise_if_incomplete()
-        print(results[0])
+        with telemetry.span("download.search") as span:
+            if search_fn is not None:
+                windows = iter([search_fn(config)])
+            else:
+                windows = windowed_search(
+                    build_search_options(download_config),
+                    search_cache_dir(config),
+                    ttl=download_config.search_cache_ttl,
+                    offline=download_config.offline,
+                    window_days=download_config.search_window_days,
+                    workers=download_config.search_workers,
+                )
+            if download_config.aoi_selection and download_config.burst_download:
+                # a burst kept on one date is kept on every date, the selection needs the whole stack
+                windows = iter([merge_results(windows)])
+            found = 0
+            for window in windows:
+                found += len(window)
+                if download_config.aoi_selection:
+                    window = select_downloads(window, download_config)
+                yield window
+            span.set(products=found)
+    except SearchCacheMiss as e:
+        print(f"[bold red]ERROR: {e}[/bold red]")
+        print("[bold yellow]Run once without --offline to populate the search cache[/bold yellow]")
+        sys.exit(1)
     except asf.exceptions.ASFSearchError as e:
         print(f"[bold red]ERROR: ASF search incomplete: {e}[/bold red]")
         sys.exit(1)
 
-    # Get total bytes for loading bar
-    total_bytes = reduce(lambda x, y: x + int(y.properties["bytes"]), results, 0)
-    total_gigabytes = round(total_bytes / (1024**3), 2)
-    print(f"[bold cyan]\nFound {len(results)} products for a total of {total_gigabytes}GB[/bold cyan]")
 
-    create_kml(slc_dir, results)
-    remove_incomplete_downloads(slc_dir, results)
-
-    with Progress(
-        TextColumn("[progress.description]{task.description}"),
-        BarColumn(),
-        DownloadColumn(binary_units=True),
-        TransferSpeedColumn(),
-        TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
-    ) as progress:
-        task = progress.add_task("Downloading", total=total_bytes)
-
-        with ThreadPoolExecutor(max_workers=1) as executor:
-            future = executor.submit(
-                lambda: results.download(
-                    path=str(slc_dir.resolve()),
-                    processes=download_config.parallel_downloads
-                )
-            )
+def products_bytes(results) -> int:
+    return reduce(lambda x, y: x + int(y.properties["bytes"]), results, 0)
 
-            while not future.done():
-                if burst_flag:
-                    downloaded_bytes = sum(file.stat().st_size for file in slc_dir.glob("*.tiff"))
-                else:
-                    downloaded_bytes = sum(file.stat().st_size for file in slc_dir.glob("*.zip"))
-                progress.update(task, completed=downloaded_bytes)
-                time.sleep(1)
 
-        try:
-            future.result()
-            print(f"[bold green]Finished downloading {total_gigabytes} GB for a total of {len(results)} images[/bold green]")
-        except ASFAuthenticationError as e:
-            print(f"[bold red]ERROR: Authentication failed[/bold red]")
-            print(f"[bold red]{e}[/bold red]")
-            print("""
+def missing_bytes(results, slc_dir: Path, store=None) -> int:
+    """Bytes still to download for the products: complete and stored ones are left out, .part files count as done"""
+    total = 0
+    for product in results:
+        size = int(product.properties["bytes"])
+        path = product_target(product, slc_dir)
+        if path.exists() and path.stat().st_size == size:
+            continue
+        if store is not None and store.lookup(product) is not None:
+            continue
+        partial = part_path(path)
+        total += size - (partial.stat().st_size if partial.exists() else 0)
+    return total
+
+
+def check_space(plan: SpacePlan, results, slc_dir: Path, store=None):
+    """Add the products of a search window to the download plan, exits when they do not fit on disk"""
+    try:
+        plan.add(missing_bytes(results, slc_dir, store))
+    except InsufficientSpace as e:
+        print(f"[bold red]ERROR: Not enough disk space for the downloads[/bold red]")
+        print(f"[bold red]{e}[/bold red]")
+        print(f"[bold yellow]Free some space, lower scratch_quota_gb or narrow the search[/bold yellow]")
+        sys.exit(1)
+
+
+def print_search_summary(results) -> int:
+    """Print the number and volume of the products, returns their total bytes"""
+    total_bytes = products_bytes(results)
+    total_gigabytes = round(total_bytes / (1024**3), 2)
+    print(f"[bold cyan]\nFound {len(results)} products for a total of {total_gigabytes}GB[/bold cyan]")
+    return total_bytes
+
+
+def search_downloads(config: ProjectConfig, search_fn=None):
+    """
+    Print the download summary and search ASF (through the search cache).
+
+    Args:
+        config: Project configuration
+        search_fn: Function returning the results of a project, defaults to the windowed search
+
+    Returns:
+        Tuple of (results, slc_dir, total_bytes)
+    """
+    slc_dir = print_download_summary(config)
+    results = merge_results(iter_search(config, search_fn))
+    total_bytes = print_search_summary(results)
+    return results, slc_dir, total_bytes
+
+
+def select_downloads(results, download_config: DownloadConfig):
+    """Drop the products that add no AOI coverage and report the coverage of every date"""
+    with telemetry.span("download.select") as span:
+        selection = select_products(
+            results,
+            download_config.bounding_box,
+            min_contribution=download_config.min_contribution,
+            min_date_coverage=download_config.min_date_coverage,
+        )
+        span.set(kept=len(selection.results), dropped=len(selection.dropped))
+
+    print(f"[bold cyan]Selected {len(selection.results)} of {len(results)} products covering the AOI, "
+          f"skipping {len(selection.dropped)} ({selection.saved_bytes / 1024**3:.2f} GB)[/bold cyan]")
+    for date in selection.incomplete_dates:
+        print(f"[bold yellow]Incomplete AOI coverage on {date.date}: {date.coverage:.1%}[/bold yellow]")
+    if selection.dropped_dates:
+        print(f"[bold yellow]Dropped {len(selection.dropped_dates)} dates below "
+              f"{download_config.min_date_coverage:.0%} coverage: {', '.join(selection.dropped_dates)}[/bold yellow]")
+    return selection.results
+
+
+def report_download_error(e: BaseException):
+    """Print a helpful message for an exception raised while downloading"""
+    if isinstance(e, ASFAuthenticationError):
+        print(f"[bold red]ERROR: Authentication failed[/bold red]")
+        print(f"[bold red]{e}[/bold red]")
+        print("""
 [bold yellow]Configure your NASA Earthdata credentials:[/bold yellow]
 Place your credentials in ~/.netrc:
 
@@ -116,18 +271,82 @@ Place your credentials in ~/.netrc:
     login your_username
     password your_password[/bold]
                 """)
-            # Using os._exit to avoid mp error message from download
-            os._exit(1)
+    elif isinstance(e, ChecksumMismatch):
+        print(f"[bold red]ERROR: Corrupted download, it will be fetched again on the next run[/bold red]")
+        print(f"[bold red]{e}[/bold red]")
+    elif isinstance(e, DownloadFailures):
+        print(f"[bold red]ERROR: {len(e.failures)} products failed to download, run again to resume them[/bold red]")
+        for name, error in sorted(e.failures.items()):
+            print(f"[bold red]  {name}: {describe_download_error(error)}[/bold red]")
+    elif isinstance(e, KeyboardInterrupt):
+        print("\n[bold red]Download interrupted by user[/bold red]")
+    else:
+        print(f"[bold red]Download failed: {describe_download_error(e)}[/bold red]")
+
+
+def describe_download_error(e: BaseException) -> str:
+    if isinstance(e, Throttled):
+        return f"server kept throttling ({e})"
+    if isinstance(e, ChecksumMismatch):
+        return f"corrupted download, fetched again on the next run ({e})"
+    if isinstance(e, ProductNotReady):
+        return f"not processed by ASF yet, try again later ({e})"
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        return f"server refused the file with HTTP {e.response.status_code}, it may have been withdrawn"
+    return f"{type(e).__name__}: {e}"
+
+
+def build_search_options(download_config: DownloadConfig) -> dict:
+    """Build asf.geo_search keyword arguments from the download section"""
+    product_type = "BURST" if download_config.burst_download else "SLC"
+    start = datetime.datetime.strptime(str(download_config.start_date), "%Y%m%d")
+    end = datetime.datetime.strptime(str(download_config.end_date), "%Y%m%d")
 
-        except KeyboardInterrupt:
-            print("\n[bold red]Download interrupted by user[/bold red]")
-            sys.exit(1)
+    return {
+        'platform': download_config.platform.value,
+        'relativeOrbit': download_config.relative_orbit,
+        'maxResults': download_config.max_results,
+        'start': start,
+        'end': end,
+        'processingLevel': product_type,
+        "intersectsWith": download_config.bounding_box
+    }
 
-        except:
-            print("[bold red]Connection lost during download[/bold red]")
-            sys.exit(1)
+
+def search_cache_dir(config: ProjectConfig) -> Path:
+    return config.system.cache_dir / "search"
 
 
+def search_products(config: ProjectConfig):
+    """Search ASF through the search cache in concurrent windows, honoring TTL and offline mode"""
+    download_config = config.download
+    return merge_results(windowed_search(
+        build_search_options(download_config),
+        search_cache_dir(config),
+        ttl=download_config.search_cache_ttl,
+        offline=download_config.offline,
+        window_days=download_config.search_window_days,
+        workers=download_config.search_workers,
+    ))
+
+
+def load_cached_results(config: ProjectConfig):
+    """Return the cached search results for this project without touching the network, or None"""
+    if config.download is None:
+        return None
+    opts = build_search_options(config.download)
+    return load_cached_search(search_cache_dir(config), opts)
+
+
+def apply_search_flags(config: ProjectConfig, offline: bool = False, refresh_search: bool = False):
+    """Apply --offline/--refresh-search command line flags to the project config"""
+    if config.download is None:
+        return
+    if offline:
+        config.download.offline = True
+    if refresh_search:
+        opts = build_search_options(config.download)
+        invalidate_search_cache(search_cache_dir(config), opts)
 
 
 def create_kml(slc_dir: Path, results):
@@ -151,7 +370,14 @@ def create_kml(slc_dir: Path, results):
     kml.save(slc_dir / f"ssara_search_{datetime.datetime.now().strftime('%Y%m%d')}.kml")
     print(f"[bold cyan]✓ KML saved:[/bold cyan] ssara_search.kml")
 
-def remove_incomplete_downloads(slc_dir: Path, results):
+def resume_incomplete_downloads(slc_dir: Path, results):
+    """
+    Turn truncated products into .part files so the next transfer resumes them.
+
+    A .part file left by an earlier interrupted transfer is kept when it is
+    the longer of the two. Truncated links into the SLC store are removed
+    rather than resumed, appending to them would write into the store.
+    """
     print(f"[bold yellow]Checking for incomplete downloads...[/bold yellow]")
     for product in results:
         filename = product.properties.get('fileName')
@@ -162,6 +388,17 @@ def remove_incomplete_downloads(slc_dir: Path, results):
             actual_size = filepath.stat().st_size
 
             if actual_size < expected_size:
-                print(f"[bold yellow]Removing incomplete file: {filename} ({actual_size/1024**3:.2f}/{expected_size/1024**3:.2f} GB)[/bold yellow]")
+                if filepath.is_symlink() or filepath.stat().st_nlink > 1:
+                    print(f"[bold yellow]Removing incomplete link: {filename}[/bold yellow]")
+                    filepath.unlink()
+                    continue
+                print(f"[bold yellow]Resuming incomplete file: {filename} ({actual_size/1024**3:.2f}/{expected_size/1024**3:.2f} GB)[/bold yellow]")
+                tmp_path = part_path(filepath)
+                if tmp_path.exists() and tmp_path.stat().st_size >= actual_size:
+                    # an earlier interrupted transfer got further
+                    filepath.unlink()
+                else:
+                    os.replace(filepath, tmp_path)
+            elif actual_size > expected_size:
+                print(f"[bold yellow]Removing oversized file: {filename} ({actual_size/1024**3:.2f}/{expected_size/1024**3:.2f} GB)[/bold yellow]")
                 filepath.unlink()
-
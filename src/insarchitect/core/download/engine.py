@@ -0,0 +1,190 @@
+import asyncio
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from typing import Callable, Dict, Iterable, Optional
+
+from .. import telemetry
+
+DEFAULT_MAX_TRANSFERS = 16
+DEFAULT_HOST_LIMIT = 8
+
+
+class TransferCancelled(Exception):
+    """Raised inside a transfer when the engine it runs on is being cancelled"""
+
+
+def url_host(url: str) -> str:
+    return urlparse(url).netloc
+
+
+class TransferEngine:
+    """
+    Concurrency budget, connection pools and cancellation shared by every remote transfer.
+
+    SLC downloads, orbit files and DEM tiles take a slot before they
+    connect: one of max_transfers for the whole engine and one of the limit
+    of their host, so a step can neither starve the others nor hammer one
+    server. Transfers stay blocking (requests, s1_orbits and sardem are),
+    asyncio code starts them with transfer() on a thread pool of their host
+    sized to its limit and waits for them with gather(), threads of the run
+    scheduler take a slot() around their own transfers. Setting cancel,
+    which gather() does on Ctrl-C and on the first failure, makes waiting
+    transfers raise TransferCancelled and running downloads stop at their
+    next chunk, keeping their .part files for a later resume.
+
+    Args:
+        max_transfers: Transfers running at the same time, all hosts together
+        host_limits: Transfers running at the same time per host, SystemConfig.transfer_host_limits
+        default_host_limit: Limit of the hosts without one
+        cancel: Event cancelling the transfers, e.g. the one of the run scheduler
+        progress: rich Progress the steps add their transfers to
+    """
+
+    def __init__(
+        self,
+        max_transfers: int = DEFAULT_MAX_TRANSFERS,
+        host_limits: Optional[Dict[str, int]] = None,
+        default_host_limit: int = DEFAULT_HOST_LIMIT,
+        cancel: Optional[threading.Event] = None,
+        progress=None,
+    ):
+        self.max_transfers = max(1, max_transfers)
+        self.host_limits = dict(host_limits or {})
+        self.default_host_limit = max(1, default_host_limit)
+        self.cancel = cancel or threading.Event()
+        self.progress = progress
+
+        self._cond = threading.Condition()
+        self._running = 0
+        self._running_hosts: Dict[str, int] = {}
+        self._default_limits: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._sessions: Dict[str, object] = {}
+
+    @classmethod
+    def for_system(cls, system, default_host_limit: int = DEFAULT_HOST_LIMIT, cancel: Optional[threading.Event] = None, progress=None) -> "TransferEngine":
+        return cls(system.max_transfers, system.transfer_host_limits, default_host_limit, cancel, progress)
+
+    def set_default_limit(self, host: str, limit: int):
+        """Limit of a host when the system configuration sets none, e.g. the orbit service"""
+        with self._cond:
+            self._default_limits[host] = max(1, limit)
+
+    def limit(self, host: str) -> int:
+        with self._cond:
+            return self.host_limits.get(host) or self._default_limits.get(host, self.default_host_limit)
+
+    @contextmanager
+    def slot(self, host: str):
+        """
+        Wait until a transfer to host may start, the slot is released when the block exits.
+
+        Raises:
+            TransferCancelled: cancel was set while waiting
+        """
+        limit = self.limit(host)
+        with self._cond:
+            while self._running >= self.max_transfers or self._running_hosts.get(host, 0) >= limit:
+                if self.cancel.is_set():
+                    break
+                self._cond.wait(timeout=1)
+            if self.cancel.is_set():
+                raise TransferCancelled(f"transfer from {host}")
+            self._running += 1
+            self._running_hosts[host] = self._running_hosts.get(host, 0) + 1
+            telemetry.observe("transfer.running", self._running)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running -= 1
+                self._running_hosts[host] -= 1
+                self._cond.notify_all()
+
+    def session(self, name: str, factory: Callable[[], object]):
+        """Session created once by factory and shared by the transfers, so they share its connection pool"""
+        with self._lock:
+            if name not in self._sessions:
+                self._sessions[name] = factory()
+            return self._sessions[name]
+
+    def executor(self, host: str) -> ThreadPoolExecutor:
+        """Threads running the transfers started with transfer() for a host, as many as its limit"""
+        with self._lock:
+            if host not in self._executors:
+                self._executors[host] = ThreadPoolExecutor(max_workers=self.limit(host), thread_name_prefix=f"transfer-{host}")
+            return self._executors[host]
+
+    def transfer(self, host: str, func: Callable, *args, **kwargs) -> asyncio.Future:
+        """
+        Start func(*args, **kwargs) on the threads of host right away.
+
+        func takes its slot() around the part that talks to host, so the
+        transfers it skips (complete files, cache hits) never wait for one.
+
+        Returns:
+            Future of the running event loop
+        """
+        return asyncio.wrap_future(self.executor(host).submit(func, *args, **kwargs))
+
+    async def gather(self, transfers: Iterable[asyncio.Future], on_result: Optional[Callable] = None) -> list:
+        """
+        Wait for transfers, returns their results in order.
+
+        The first failure, or the cancellation of the caller (Ctrl-C in
+        asyncio.run), sets cancel: transfers not started yet are dropped
+        and running ones stop at their next check.
+
+        Args:
+            transfers: Futures of transfer()
+            on_result: Called with the result of each transfer as it completes
+        """
+        transfers = list(transfers)
+        if on_result is not None:
+            def report(future: asyncio.Future):
+                if not future.cancelled() and future.exception() is None:
+                    on_result(future.result())
+
+            for future in transfers:
+                future.add_done_callback(report)
+        try:
+            return await asyncio.gather(*transfers)
+        except BaseException:
+            self.cancel.set()
+            for future in transfers:
+                future.cancel()
+            raise
+
+    def run(self, main) -> object:
+        """asyncio.run a coroutine gathering transfers, from a thread without an event loop"""
+        try:
+            return asyncio.run(main)
+        except BaseException:
+            self.cancel.set()
+            raise
+
+    def progress_task(self, description: str, total: int) -> Callable[..., None]:
+        """Callback advancing a new task of the shared progress display, a no-op without one"""
+        if self.progress is None:
+            return lambda advance=1: None
+        task = self.progress.add_task(description, total=total)
+        return lambda advance=1: self.progress.update(task, advance=advance)
+
+    def close(self):
+        """Wait for the running transfers, the ones not started yet are dropped"""
+        with self._lock:
+            executors = list(self._executors.values())
+            self._executors.clear()
+        for executor in executors:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self) -> "TransferEngine":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.cancel.set()
+        self.close()
@@ -0,0 +1,187 @@
+import os
+import re
+import sys
+import shutil
+import zipfile
+from pathlib import Path, PurePosixPath
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Set
+from xml.etree import ElementTree
+
+from rich import print
+from shapely import wkt
+from shapely.geometry import MultiPoint
+
+from ...models import ProjectConfig, ExtractConfig
+from .. import telemetry
+from .transfer import part_path
+
+# s1a-iw2-slc-vv-20230105t...-001.tiff, the same name after a calibration-,
+# noise- or rfi- prefix names the other annotation files of the subswath
+MEMBER_PATTERN = re.compile(
+    r"^(?:(?:calibration|noise|rfi)-)?s1[a-d]-(?P<swath>iw\d|ew\d|s\d|wv\d)-slc-(?P<polarization>hh|hv|vv|vh)-",
+    re.IGNORECASE,
+)
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+
+
+@dataclass
+class ExtractPlan:
+    """Members of a SAFE zip to extract, with the subswaths covering the AOI"""
+    product: Path
+    members: List[zipfile.ZipInfo]
+    swaths: List[str]
+    total_bytes: int
+    extracted_bytes: int = 0
+
+    @property
+    def selected_bytes(self) -> int:
+        return sum(info.file_size for info in self.members)
+
+
+def member_swath(name: str) -> Optional[tuple]:
+    """(subswath, polarization) of a per-subswath member of a SAFE product, None for shared files"""
+    match = MEMBER_PATTERN.match(PurePosixPath(name).name)
+    if match is None:
+        return None
+    return match["swath"].lower(), match["polarization"].lower()
+
+
+def swath_footprint(archive: zipfile.ZipFile, info: zipfile.ZipInfo):
+    """Footprint of a subswath from the geolocation grid of its annotation, streamed from the zip"""
+    points = []
+    with archive.open(info) as stream:
+        for _, element in ElementTree.iterparse(stream):
+            if element.tag == "geolocationGridPoint":
+                points.append((float(element.findtext("longitude")), float(element.findtext("latitude"))))
+                element.clear()
+    if len(points) < 3:
+        return None
+    return MultiPoint(points).convex_hull
+
+
+def plan_extraction(archive: zipfile.ZipFile, aoi, polarizations: Iterable[str], swaths: Optional[Iterable[int]] = None) -> ExtractPlan:
+    """
+    Select the members of a SAFE zip needed for the AOI from its central directory.
+
+    Measurement, annotation, calibration and noise files are kept for the
+    requested polarizations and for the subswaths whose annotation
+    geolocation grid intersects the AOI (or the given subswath numbers).
+    Shared files (manifest, support, preview) are always kept, they are
+    small and ISCE reads the manifest.
+    """
+    polarizations = {polarization.lower() for polarization in polarizations}
+    infos = [info for info in archive.infolist() if not info.is_dir()]
+
+    if swaths is not None:
+        covering: Set[str] = {f"iw{number}" for number in swaths}
+    else:
+        covering = set()
+        for info in infos:
+            parsed = member_swath(info.filename)
+            # main annotations only, not the calibration/ and rfi/ ones
+            if parsed is None or PurePosixPath(info.filename).parent.name != "annotation" or parsed[1] not in polarizations:
+                continue
+            footprint = swath_footprint(archive, info)
+            if footprint is None or footprint.intersects(aoi):
+                covering.add(parsed[0])
+
+    members = []
+    for info in infos:
+        parsed = member_swath(info.filename)
+        if parsed is None or (parsed[0] in covering and parsed[1] in polarizations):
+            members.append(info)
+    return ExtractPlan(Path(archive.filename), members, sorted(covering), sum(info.file_size for info in infos))
+
+
+def _extract_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo, target_dir: Path) -> int:
+    target = (target_dir / info.filename).resolve()
+    if not target.is_relative_to(target_dir.resolve()):
+        raise zipfile.BadZipFile(f"{info.filename} points outside of {target_dir}")
+    if target.exists() and target.stat().st_size == info.file_size:
+        return 0
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = part_path(target)
+    # decompressed straight into place, the CRC is checked at the end of the stream
+    with archive.open(info) as src, open(tmp_path, "wb") as dst:
+        shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+    os.replace(tmp_path, target)
+    return info.file_size
+
+
+def extract_product(zip_path: Path, target_dir: Path, aoi, polarizations: Iterable[str], swaths: Optional[Iterable[int]] = None) -> ExtractPlan:
+    """
+    Extract the members of a SAFE zip needed for the AOI into target_dir.
+
+    Members already extracted with the right size are skipped, so an
+    interrupted extraction resumes where it stopped.
+
+    Args:
+        zip_path: Downloaded SLC zip
+        target_dir: Directory receiving the <product>.SAFE directory
+        aoi: AOI geometry
+        polarizations: Polarizations to extract
+        swaths: Subswath numbers to extract, defaults to the ones covering the AOI
+
+    Returns:
+        ExtractPlan with the extracted bytes
+    """
+    with telemetry.span("extract.product", product=zip_path.name) as span:
+        with zipfile.ZipFile(zip_path) as archive:
+            plan = plan_extraction(archive, aoi, polarizations, swaths)
+            for info in plan.members:
+                plan.extracted_bytes += _extract_member(archive, info, target_dir)
+        span.set(swaths=plan.swaths, bytes=plan.extracted_bytes)
+        telemetry.count("extract.bytes", plan.extracted_bytes)
+        telemetry.count("extract.skipped_bytes", plan.total_bytes - plan.selected_bytes)
+        return plan
+
+
+def extract_products(zip_paths: List[Path], target_dir: Path, aoi, extract_config: ExtractConfig) -> List[ExtractPlan]:
+    """Extract several SAFE zips concurrently, zlib releases the GIL while decompressing"""
+    target_dir.mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=extract_config.workers) as executor:
+        futures = [
+            executor.submit(extract_product, path, target_dir, aoi, extract_config.polarizations, extract_config.swaths)
+            for path in zip_paths
+        ]
+        return [future.result() for future in futures]
+
+
+def safe_dir(config: ProjectConfig) -> Path:
+    return config.system.work_dir / config.project_name / config.extract.safe_dir
+
+
+def project_aoi(config: ProjectConfig):
+    return wkt.loads(config.download.bounding_box)
+
+
+def print_extract_summary(plans: List[ExtractPlan]):
+    total = sum(plan.total_bytes for plan in plans)
+    selected = sum(plan.selected_bytes for plan in plans)
+    extracted = sum(plan.extracted_bytes for plan in plans)
+    saved = 1 - selected / total if total else 0
+    print(f"[bold green]Extracted {extracted / 1024**3:.2f} GB from {len(plans)} products, "
+          f"{selected / 1024**3:.2f} of {total / 1024**3:.2f} GB needed ({saved:.0%} skipped)[/bold green]")
+
+
+def extract_main(config: ProjectConfig):
+    """Extract the subswaths and polarizations covering the AOI from the downloaded SLC zips"""
+    if config.download is None or config.extract is None:
+        print(f"[bold red]The extract command needs the download and extract sections[/bold red]")
+        sys.exit(1)
+    slc_dir = config.system.work_dir / config.project_name / config.download.slc_dir
+    zip_paths = sorted(slc_dir.glob("*.zip"))
+    target_dir = safe_dir(config)
+
+    print(f"[bold]Extracting[/bold]: {len(zip_paths)} products to {target_dir}, "
+          f"polarizations {', '.join(config.extract.polarizations)}, "
+          f"subswaths {', '.join(map(str, config.extract.swaths)) if config.extract.swaths else 'covering the AOI'}")
+    try:
+        plans = extract_products(zip_paths, target_dir, project_aoi(config), config.extract)
+    except zipfile.BadZipFile as e:
+        print(f"[bold red]ERROR: Damaged product, check the downloads with insarchitect verify[/bold red]")
+        print(f"[bold red]{e}[/bold red]")
+        sys.exit(1)
+    print_extract_summary(plans)
@@ -0,0 +1,174 @@
+import time
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+from rich.progress import Progress, TaskID, BarColumn, TextColumn, DownloadColumn, TransferSpeedColumn, TimeRemainingColumn
+
+# seconds of history used to estimate throughput
+SPEED_WINDOW = 10.0
+# minimum seconds between two callback notifications for the same file
+NOTIFY_INTERVAL = 0.5
+
+
+def progress_columns() -> tuple:
+    return (
+        TextColumn("[progress.description]{task.description}"),
+        BarColumn(),
+        DownloadColumn(binary_units=True),
+        TransferSpeedColumn(),
+        TimeRemainingColumn(),
+        TextColumn("[progress.percentage]{task.percentage:>3.0f}%"),
+    )
+
+
+@dataclass
+class TransferStats:
+    """Snapshot of a transfer, either a single file or the aggregate of all files"""
+    name: str
+    total: Optional[int]
+    completed: int
+    speed: float
+    eta: Optional[float]
+    finished: bool = False
+
+
+ProgressCallback = Callable[[TransferStats, TransferStats], None]
+
+
+class _Counter:
+    def __init__(self, name: str, total: Optional[int]):
+        self.name = name
+        self.total = total
+        self.completed = 0
+        self.finished = False
+        self.samples = deque()
+        self.last_notify = 0.0
+
+    def add(self, nbytes: int, now: float, sample: bool = True):
+        self.completed += nbytes
+        if not sample:
+            # bytes that were not transferred now must not count towards the speed
+            self.samples = deque((t, c + nbytes) for t, c in self.samples)
+            return
+        self.samples.append((now, self.completed))
+        while len(self.samples) > 2 and now - self.samples[0][0] > SPEED_WINDOW:
+            self.samples.popleft()
+
+    def stats(self) -> TransferStats:
+        speed = 0.0
+        if len(self.samples) >= 2:
+            (t0, c0), (t1, c1) = self.samples[0], self.samples[-1]
+            if t1 > t0:
+                speed = max(c1 - c0, 0) / (t1 - t0)
+        eta = None
+        if self.total is not None and speed > 0:
+            eta = max(self.total - self.completed, 0) / speed
+        return TransferStats(self.name, self.total, self.completed, speed, eta, self.finished)
+
+
+class DownloadProgress:
+    """
+    Byte accounting fed by the download workers.
+
+    Workers report the bytes they write, so progress never needs to scan the
+    output directory. Callbacks receive (file_stats, aggregate_stats) and are
+    throttled per file, start and finish events are always delivered.
+
+    Args:
+        total_bytes: Expected size of the whole batch
+        callbacks: Functions called with (TransferStats, TransferStats)
+    """
+
+    def __init__(self, total_bytes: Optional[int] = None, callbacks: tuple = ()):
+        self._lock = threading.Lock()
+        self._files: Dict[str, _Counter] = {}
+        self._aggregate = _Counter("total", total_bytes)
+        self._callbacks = list(callbacks)
+
+    def add_total(self, nbytes: int):
+        """Grow the expected size of the batch, e.g. as search windows complete"""
+        with self._lock:
+            self._aggregate.total = (self._aggregate.total or 0) + nbytes
+
+    def add_callback(self, callback: ProgressCallback):
+        self._callbacks.append(callback)
+
+    def start_file(self, name: str, total: Optional[int]):
+        with self._lock:
+            self._files[name] = _Counter(name, total)
+        self._notify(name, force=True)
+
+    def advance(self, name: str, nbytes: int, sample: bool = True):
+        now = time.monotonic()
+        with self._lock:
+            self._files[name].add(nbytes, now, sample)
+            self._aggregate.add(nbytes, now, sample)
+        self._notify(name)
+
+    def finish_file(self, name: str):
+        with self._lock:
+            self._files[name].finished = True
+        self._notify(name, force=True)
+
+    def skip_file(self, name: str, size: int):
+        """Account for a file that is already complete on disk"""
+        self.start_file(name, size)
+        self.advance(name, size, sample=False)
+        self.finish_file(name)
+
+    def file_callback(self, name: str) -> Callable[[int], None]:
+        """Byte counter callback for a single transfer"""
+        return lambda nbytes: self.advance(name, nbytes)
+
+    def file_stats(self, name: str) -> TransferStats:
+        with self._lock:
+            return self._files[name].stats()
+
+    def stats(self) -> TransferStats:
+        with self._lock:
+            return self._aggregate.stats()
+
+    def _notify(self, name: str, force: bool = False):
+        if not self._callbacks:
+            return
+        now = time.monotonic()
+        with self._lock:
+            counter = self._files[name]
+            if not force and now - counter.last_notify < NOTIFY_INTERVAL:
+                return
+            counter.last_notify = now
+            file_stats = counter.stats()
+            aggregate_stats = self._aggregate.stats()
+        for callback in self._callbacks:
+            callback(file_stats, aggregate_stats)
+
+
+class RichProgressDisplay:
+    """DownloadProgress callback that renders an aggregate bar and one bar per active file"""
+
+    def __init__(self, progress: Progress, total_bytes: Optional[int], description: str = "Downloading"):
+        self.progress = progress
+        self.total_task = progress.add_task(description, total=total_bytes)
+        self.file_tasks: Dict[str, TaskID] = {}
+        self.finished = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, file_stats: TransferStats, aggregate_stats: TransferStats):
+        with self._lock:
+            self.progress.update(self.total_task, total=aggregate_stats.total, completed=aggregate_stats.completed)
+            name = file_stats.name
+
+            if file_stats.finished:
+                self.finished.add(name)
+                if name in self.file_tasks:
+                    self.progress.remove_task(self.file_tasks.pop(name))
+                return
+            # a throttled update can arrive after the finish event
+            if name in self.finished:
+                return
+
+            if name not in self.file_tasks:
+                self.file_tasks[name] = self.progress.add_task(f"  {name}", total=file_stats.total)
+            self.progress.update(self.file_tasks[name], completed=file_stats.completed)
@@ -0,0 +1,336 @@
+import json
+import os
+import time
+import hashlib
+import datetime
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+import asf_search as asf
+from rich import print
+from asf_search import ASFProduct
+from asf_search.search.search_generator import as_ASFProduct
+from shapely import wkt
+
+CACHE_VERSION = 1
+# full windows are split in two until they are this short
+MIN_WINDOW = datetime.timedelta(days=1)
+
+
+class SearchCacheMiss(Exception):
+    """Raised when an offline search has no usable cache entry"""
+
+
+def normalize_search_options(opts: dict) -> dict:
+    """
+    Normalize ASF search options so equivalent searches share a cache key.
+
+    Args:
+        opts: Keyword arguments given to asf.geo_search
+
+    Returns:
+        Dictionary with JSON serializable, canonical values
+    """
+    normalized = {}
+    for key, value in opts.items():
+        if value is None:
+            continue
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            value = value.isoformat()
+        elif key == "intersectsWith":
+            value = wkt.dumps(wkt.loads(value).normalize(), rounding_precision=6)
+        elif isinstance(value, str):
+            value = value.upper()
+        normalized[key] = value
+    return normalized
+
+
+def search_cache_key(opts: dict) -> str:
+    """Hash of the normalized search options"""
+    payload = json.dumps(normalize_search_options(opts), sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def _entry_path(cache_dir: Path, opts: dict) -> Path:
+    return cache_dir / f"{search_cache_key(opts)}.json"
+
+
+def _load_entry(cache_dir: Path, opts: dict, ttl: Optional[float]) -> Optional[dict]:
+    entry_path = _entry_path(cache_dir, opts)
+    try:
+        entry = json.loads(entry_path.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    if entry.get("version") != CACHE_VERSION:
+        return None
+    if ttl is not None and time.time() - entry["created"] > ttl:
+        return None
+    return entry
+
+
+def cached_search_files(cache_dir: Path, opts: dict, ttl: Optional[float] = None) -> Optional[List[tuple]]:
+    """
+    Sorted (fileID, md5sum) of the products of a cache entry.
+
+    Read straight from the stored UMM, without rebuilding the products, for
+    callers that only need to know whether the search found the same files.
+    Takes the same arguments as load_cached_search and returns None in the
+    same cases.
+    """
+    entry = _load_entry(cache_dir, opts, ttl)
+    if entry is None:
+        return None
+    return sorted(
+        (
+            ASFProduct.umm_get(item["umm"], "GranuleUR"),
+            ASFProduct.umm_get(item["umm"], "AdditionalAttributes", ("Name", "MD5SUM"), "Values", 0),
+        )
+        for item in entry["products"]
+    )
+
+
+def load_cached_search(cache_dir: Path, opts: dict, ttl: Optional[float] = None) -> Optional[asf.ASFSearchResults]:
+    """
+    Rebuild search results from the cache.
+
+    Args:
+        cache_dir: Directory holding cache entries
+        opts: Search options used as key
+        ttl: Maximum age in seconds, None to accept any age
+
+    Returns:
+        ASFSearchResults or None if there is no valid entry
+    """
+    entry = _load_entry(cache_dir, opts, ttl)
+    if entry is None:
+        return None
+
+    session = asf.ASFSession()
+    results = asf.ASFSearchResults(
+        [as_ASFProduct({"umm": item["umm"], "meta": item["meta"]}, session) for item in entry["products"]]
+    )
+    results.searchComplete = True
+    return results
+
+
+def save_search(cache_dir: Path, opts: dict, results) -> Path:
+    """Write complete search results to the cache atomically"""
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    entry = {
+        "version": CACHE_VERSION,
+        "created": time.time(),
+        "options": normalize_search_options(opts),
+        "products": [{"umm": product.umm, "meta": product.meta} for product in results],
+    }
+    entry_path = _entry_path(cache_dir, opts)
+    tmp_path = entry_path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(entry))
+    os.replace(tmp_path, entry_path)
+    return entry_path
+
+
+def invalidate_search_cache(cache_dir: Path, opts: Optional[dict] = None) -> int:
+    """
+    Remove cache entries.
+
+    Args:
+        cache_dir: Directory holding cache entries
+        opts: Remove only the entry for these options, or every entry if None
+
+    Returns:
+        Number of removed entries
+    """
+    if opts is not None:
+        entries = [_entry_path(cache_dir, opts)]
+    else:
+        entries = list(cache_dir.glob("*.json"))
+
+    removed = 0
+    for entry_path in entries:
+        if entry_path.exists():
+            entry_path.unlink()
+            removed += 1
+    return removed
+
+
+def cached_search(
+    opts: dict,
+    cache_dir: Path,
+    ttl: float,
+    offline: bool = False,
+    search_fn: Optional[Callable] = None,
+) -> asf.ASFSearchResults:
+    """
+    Run an ASF geo search through the on-disk cache.
+
+    Args:
+        opts: Keyword arguments for the search function
+        cache_dir: Directory holding cache entries
+        ttl: Seconds a cache entry stays valid, 0 disables the cache
+        offline: Only replay cached results, never touch the network
+        search_fn: Search function, defaults to asf.geo_search (handy to point at a stand-in)
+
+    Returns:
+        ASFSearchResults from cache or from a fresh search
+
+    Raises:
+        SearchCacheMiss: offline is set and no entry exists for opts
+        ASFSearchError: the fresh search failed or was incomplete and nothing is cached
+    """
+    if offline:
+        results = load_cached_search(cache_dir, opts, ttl=None)
+        if results is None:
+            raise SearchCacheMiss(f"No cached search in {cache_dir} for {normalize_search_options(opts)}")
+        return results
+
+    if ttl > 0:
+        results = load_cached_search(cache_dir, opts, ttl=ttl)
+        if results is not None:
+            return results
+
+    search_fn = search_fn or asf.geo_search
+    try:
+        results = search_fn(**opts)
+        results.raise_if_incomplete()
+    except (asf.exceptions.ASFSearchError, requests.RequestException) as e:
+        # a flaky network should not block a rerun that already has results
+        stale_results = load_cached_search(cache_dir, opts, ttl=None)
+        if stale_results is None:
+            raise
+        print(f"[bold yellow]ASF search failed ({e}), replaying expired cached search[/bold yellow]")
+        return stale_results
+
+    max_results = opts.get("maxResults")
+    # a result at the ceiling may have been cut, exhaustive_search splits it
+    if ttl > 0 and not (max_results and len(results) >= max_results):
+        save_search(cache_dir, opts, results)
+    return results
+
+
+def split_windows(opts: dict, window_days: int) -> List[dict]:
+    """Split the start..end range of the search options into windows of window_days"""
+    start, end = opts["start"], opts["end"]
+    step = datetime.timedelta(days=window_days)
+    if window_days <= 0 or end - start <= step:
+        return [opts]
+    windows = []
+    while start < end:
+        stop = min(start + step, end)
+        windows.append({**opts, "start": start, "end": stop})
+        start = stop
+    return windows
+
+
+def merge_results(results_list) -> asf.ASFSearchResults:
+    """Concatenate search results, keeping the first product of each fileID, complete when all of them are"""
+    seen = set()
+    products = []
+    complete = True
+    for results in results_list:
+        complete = complete and getattr(results, "searchComplete", True)
+        for product in results:
+            file_id = product.properties["fileID"]
+            if file_id not in seen:
+                seen.add(file_id)
+                products.append(product)
+    merged = asf.ASFSearchResults(products)
+    merged.searchComplete = complete
+    return merged
+
+
+def exhaustive_search(opts: dict, cache_dir: Path, ttl: float, search_fn: Optional[Callable] = None) -> asf.ASFSearchResults:
+    """
+    cached_search without a result ceiling.
+
+    A window returning maxResults products may have been cut, it is split in
+    two halves searched again, until windows are MIN_WINDOW long. A
+    MIN_WINDOW window still at maxResults is returned with searchComplete
+    unset, products may be missing from it.
+    """
+    results = cached_search(opts, cache_dir, ttl, search_fn=search_fn)
+    max_results = opts.get("maxResults")
+    span = opts["end"] - opts["start"]
+    if not max_results or len(results) < max_results:
+        return results
+    if span <= MIN_WINDOW:
+        print(
+            f"[bold yellow]ASF returned max_results ({max_results}) products between {opts['start']} and "
+            f"{opts['end']}, some may be missing, raise max_results to find them[/bold yellow]"
+        )
+        results.searchComplete = False
+        return results
+    middle = opts["start"] + span / 2
+    return merge_results([
+        exhaustive_search({**opts, "end": middle}, cache_dir, ttl, search_fn),
+        exhaustive_search({**opts, "start": middle}, cache_dir, ttl, search_fn),
+    ])
+
+
+def windowed_search(
+    opts: dict,
+    cache_dir: Path,
+    ttl: float,
+    offline: bool = False,
+    window_days: int = 30,
+    workers: int = 4,
+    search_fn: Optional[Callable] = None,
+) -> Iterator[asf.ASFSearchResults]:
+    """
+    Search the date range of opts as concurrent windows, yielding each window as it completes.
+
+    Every window goes through the cache on its own, so extending the end
+    date of a project only searches the new windows. Once every window
+    completed the merged results are also cached under the whole range,
+    which is what offline runs and load_cached_search replay, unless a
+    window was cut at maxResults.
+
+    Args:
+        opts: Keyword arguments for the search function
+        cache_dir: Directory holding cache entries
+        ttl: Seconds a cache entry stays valid, 0 disables the cache
+        offline: Only replay the cached results of the whole range
+        window_days: Days covered by each window, 0 searches the whole range at once
+        workers: Windows searched concurrently
+        search_fn: Search function, defaults to asf.geo_search (handy to point at a stand-in)
+
+    Yields:
+        ASFSearchResults of each window, without products of earlier windows
+
+    Raises:
+        SearchCacheMiss: offline is set and the whole range is not cached
+        ASFSearchError: a window failed and nothing is cached for it
+    """
+    if offline or ttl > 0:
+        results = load_cached_search(cache_dir, opts, ttl=None if offline else ttl)
+        if results is not None:
+            yield results
+            return
+    if offline:
+        raise SearchCacheMiss(f"No cached search in {cache_dir} for {normalize_search_options(opts)}")
+
+    windows = split_windows(opts, window_days)
+    seen = set()
+    windows_results = []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(windows)))) as executor:
+        futures = [executor.submit(exhaustive_search, window, cache_dir, ttl, search_fn) for window in windows]
+        try:
+            for future in as_completed(futures):
+                products = [product for product in future.result() if product.properties["fileID"] not in seen]
+                seen.update(product.properties["fileID"] for product in products)
+                results = asf.ASFSearchResults(products)
+                results.searchComplete = future.result().searchComplete
+                windows_results.append(results)
+                yield results
+        finally:
+            for future in futures:
+                future.cancel()
+
+    merged = merge_results(windows_results)
+    if not merged.searchComplete:
+        # replaying it would hide the missing products until the cache expires
+        print("[bold yellow]Search cut at max_results, not caching it[/bold yellow]")
+    elif ttl > 0:
+        save_search(cache_dir, opts, merged)
@@ -0,0 +1,317 @@
+import os
+import json
+import time
+import fcntl
+import stat
+from pathlib import Path
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Union
+
+from .. import telemetry
+from .transfer import ChecksumMismatch, part_path, then
+
+# index entry stored next to each object
+ENTRY_NAME = "entry.json"
+# objects younger than this are kept by gc even without references, their
+# links may not be registered yet
+GC_MIN_AGE = 24 * 3600
+
+
+def product_key(product) -> str:
+    """Store key of an ASF product: "<fileID>/<md5sum>", the size stands in for a missing md5sum"""
+    properties = product.properties
+    checksum = properties.get("md5sum") or f"size{properties.get('bytes')}"
+    return f"{properties['fileID']}/{checksum}"
+
+
+def _lock_name(key: str) -> str:
+    return key.replace("/", "_")
+
+
+def _references(link: Path, path: Path) -> bool:
+    """True when link is a hard link or a symlink to path"""
+    try:
+        return os.path.samefile(link, path)
+    except OSError:
+        return False
+
+
+class SlcStore:
+    """
+    System-wide store of SLC products, shared by every project.
+
+    Products are stored once as objects/<fileID>/<md5sum>/<fileName> and
+    hard linked into the SLC directory of each project, or symlinked when the
+    project lives on another file system. The index entry of each object,
+    its size, last use and the project paths linking to it, is stored next
+    to it as entry.json, replaced atomically and only changed under the
+    flock of its key. Each key also has its own lock while being downloaded,
+    so concurrent runs never fetch a product twice, and runs working on
+    different products never wait for each other. Objects are read-only, a
+    process writing through one link would corrupt every project. gc()
+    removes the objects no project links to.
+
+    Args:
+        root: Store directory, shared between projects
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        (self.root / "objects").mkdir(parents=True, exist_ok=True)
+        (self.root / "locks").mkdir(exist_ok=True)
+        # single index of the stores created before the entries were sharded
+        self.index_path = self.root / "index.json"
+        if self.index_path.exists():
+            self._migrate_index()
+
+    @classmethod
+    def for_system(cls, system) -> Optional["SlcStore"]:
+        """Store of the system configuration, or None when it is disabled"""
+        if not system.slc_store:
+            return None
+        return cls(system.slc_store_dir)
+
+    @contextmanager
+    def _lock(self, name: str):
+        with open(self.root / "locks" / f"{name}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _entry_path(self, key: str) -> Path:
+        return self.root / "objects" / key / ENTRY_NAME
+
+    def _read_entry(self, key: str) -> Optional[dict]:
+        try:
+            return json.loads(self._entry_path(key).read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _write_entry(self, key: str, entry: dict):
+        entry_path = self._entry_path(key)
+        tmp_path = entry_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(entry, indent=1))
+        os.replace(tmp_path, entry_path)
+
+    def _keys(self) -> List[str]:
+        return [str(path.parent.relative_to(self.root / "objects")) for path in (self.root / "objects").glob(f"*/*/{ENTRY_NAME}")]
+
+    def _migrate_index(self):
+        """Split the index.json of an older store into the entries of its objects"""
+        with self._lock("index"):
+            try:
+                index = json.loads(self.index_path.read_text())
+            except FileNotFoundError:
+                # migrated by a concurrent run
+                return
+            except json.JSONDecodeError:
+                index = {}
+            for key, entry in index.items():
+                if (self.root / entry["path"]).exists() and self._read_entry(key) is None:
+                    self._write_entry(key, entry)
+            self.index_path.unlink()
+
+    def object_path(self, product) -> Path:
+        return self.root / "objects" / product_key(product) / product.properties["fileName"]
+
+    def lookup(self, product) -> Optional[Path]:
+        """Return the stored product, or None if it is missing or truncated"""
+        # entries are replaced atomically, reading one needs no lock
+        entry = self._read_entry(product_key(product))
+        if entry is None:
+            return None
+        path = self.root / entry["path"]
+        if not path.exists() or path.stat().st_size != entry["size"]:
+            return None
+        return path
+
+    def _register(self, product, path: Path, link: Optional[Path] = None):
+        key = product_key(product)
+        with self._lock(f"{_lock_name(key)}.entry"):
+            entry = self._read_entry(key) or {
+                "path": str(path.relative_to(self.root)),
+                "size": path.stat().st_size,
+                "refs": [],
+            }
+            entry["last_used"] = time.time()
+            if link is not None and str(link) not in entry["refs"]:
+                entry["refs"].append(str(link))
+            self._write_entry(key, entry)
+
+    def fetch(self, product, download: Callable[[Path], Union[Path, Future]], partial: Optional[Path] = None) -> Union[Path, Future]:
+        """
+        Download a missing product into the store.
+
+        Args:
+            product: ASF product
+            download: Function downloading the product to the given path (through its .part file),
+                or returning a Future of it when the file is moved in place in the background
+            partial: .part file of an earlier download into a project, resumed when possible
+
+        Returns:
+            Path of the stored object, or a Future of it when download returned one, the
+            lock of the product is held until it is done
+        """
+        key = product_key(product)
+        lock = ExitStack()
+        lock.enter_context(self._lock(_lock_name(key)))
+        try:
+            # another run may have fetched it while we waited
+            path = self.lookup(product)
+            if path is not None:
+                lock.close()
+                return path
+
+            path = self.object_path(product)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if partial is not None and partial.exists() and not part_path(path).exists():
+                try:
+                    os.replace(partial, part_path(path))
+                except OSError:
+                    # another file system, start over in the store
+                    pass
+            result = download(path)
+        except BaseException:
+            lock.close()
+            raise
+
+        def finish(done: Future) -> Path:
+            with lock:
+                return self._stored(product, done.result())
+
+        if isinstance(result, Future):
+            return then(result, finish)
+        with lock:
+            return self._stored(product, result)
+
+    def _stored(self, product, path: Path) -> Path:
+        path.chmod(stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        self._register(product, path)
+        telemetry.count("download.store_fetches")
+        return path
+
+    def adopt(self, product, target: Path) -> Optional[Path]:
+        """
+        Move a complete product downloaded into a project before the store existed into the store.
+
+        The file is checked against the md5sum of the product first, every
+        project linking to the object would share a corrupt copy.
+
+        Returns:
+            Path of the stored object, or None when target lives on another file system
+
+        Raises:
+            ChecksumMismatch: target does not match the md5sum of the product
+        """
+        path = self.lookup(product)
+        if path is not None:
+            if not _references(target, path):
+                self.link(product, path, target)
+            return path
+
+        path = self.object_path(product)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.adopt")
+        tmp_path.unlink(missing_ok=True)
+        try:
+            os.link(target, tmp_path)
+        except OSError:
+            # hard links cannot cross file systems
+            return None
+        md5sum = product.properties.get("md5sum")
+        if md5sum:
+            from .verify import md5_file
+
+            with telemetry.span("download.store_adopt", file=path.name):
+                md5 = md5_file(tmp_path)
+            if md5 != md5sum:
+                tmp_path.unlink()
+                telemetry.count("download.store_adopt_rejected")
+                raise ChecksumMismatch(f"{target.name}: md5 {md5} does not match {md5sum}")
+        os.replace(tmp_path, path)
+        path.chmod(stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        self._register(product, path, target)
+        return path
+
+    def link(self, product, path: Path, target: Path) -> Path:
+        """Link a stored object into a project directory and record the reference"""
+        if not _references(target, path):
+            tmp_path = part_path(target)
+            tmp_path.unlink(missing_ok=True)
+            try:
+                os.link(path, tmp_path)
+            except OSError:
+                # hard links cannot cross file systems
+                os.symlink(path, tmp_path)
+            os.replace(tmp_path, target)
+            telemetry.count("download.store_links")
+        self._register(product, path, target)
+        return target
+
+    def discard(self, product, link: Path) -> bool:
+        """
+        Remove a damaged object linked at link from the store, the links of
+        other projects keep their copy until they are verified too.
+
+        Returns:
+            True when link referenced the stored object
+        """
+        key = product_key(product)
+        with self._lock(f"{_lock_name(key)}.entry"):
+            entry = self._read_entry(key)
+            if entry is None or not _references(link, self.root / entry["path"]):
+                return False
+            self._entry_path(key).unlink()
+        (self.root / entry["path"]).unlink(missing_ok=True)
+        telemetry.count("download.store_discarded")
+        return True
+
+    def size(self) -> int:
+        entries = (self._read_entry(key) for key in self._keys())
+        return sum(entry["size"] for entry in entries if entry is not None)
+
+    def gc(self, dry_run: bool = False, min_age: float = GC_MIN_AGE) -> List[dict]:
+        """
+        Remove the objects no project links to anymore.
+
+        References whose project file was deleted or replaced are dropped
+        first. Unreferenced objects used within min_age seconds are kept.
+
+        Args:
+            dry_run: Only report what would be removed
+            min_age: Seconds an unreferenced object is kept after its last use
+
+        Returns:
+            Index entries of the removed objects, with their key
+        """
+        now = time.time()
+        removed = []
+        for key in self._keys():
+            with self._lock(f"{_lock_name(key)}.entry"):
+                entry = self._read_entry(key)
+                if entry is None:
+                    continue
+                path = self.root / entry["path"]
+                refs = [ref for ref in entry["refs"] if _references(Path(ref), path)]
+                if refs or now - entry.get("last_used", 0) < min_age:
+                    if not dry_run and refs != entry["refs"]:
+                        self._write_entry(key, {**entry, "refs": refs})
+                    continue
+                removed.append({"key": key, **entry, "refs": refs})
+                if not dry_run:
+                    self._entry_path(key).unlink()
+
+        if dry_run:
+            return removed
+        for entry in removed:
+            path = self.root / entry["path"]
+            path.unlink(missing_ok=True)
+            for directory in (path.parent, path.parent.parent):
+                try:
+                    directory.rmdir()
+                except OSError:
+                    pass
+        return removed
@@ -0,0 +1,217 @@
+import os
+import shutil
+import threading
+from pathlib import Path
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from .. import telemetry
+from .transfer import DownloadCancelled, part_path
+
+GB = 1024 ** 3
+# free space left untouched on either file system
+FREE_SPACE_MARGIN = 1 * GB
+# concurrent moves from scratch to the destinations
+MOVERS = 2
+
+
+class InsufficientSpace(Exception):
+    """Raised when a file system cannot hold the planned downloads"""
+
+
+def same_filesystem(a: Path, b: Path) -> bool:
+    return os.stat(a).st_dev == os.stat(b).st_dev
+
+
+class ScratchStaging:
+    """
+    Downloads staged on the scratch file system and moved to their destination in the background.
+
+    Transfers write to <root>/incoming, once complete a mover thread links
+    (same file system) or copies the file to its destination. download()
+    returns a Future of the move, so the transfer thread is free for the
+    next product while the slower work file system catches up. Bytes admitted and not yet moved are in flight, a
+    transfer waits until its size fits in the quota (a product larger than
+    the quota runs alone). Moved files stay in <root>/done as a cache,
+    evicted least recently used first beyond cache_size or when scratch
+    runs out of space, and serve later requests for the same file.
+
+    Args:
+        root: Staging directory on the scratch file system
+        quota: Max bytes in flight
+        cache_size: Max bytes of completed files kept on scratch
+        movers: Number of concurrent moves
+    """
+
+    def __init__(self, root: Path, quota: int, cache_size: int, movers: int = MOVERS):
+        self.root = root
+        self.incoming = root / "incoming"
+        self.done = root / "done"
+        self.incoming.mkdir(parents=True, exist_ok=True)
+        self.done.mkdir(exist_ok=True)
+        self.quota = quota
+        self.cache_size = cache_size
+        self.in_flight = 0
+
+        self._cond = threading.Condition()
+        self._evict_lock = threading.Lock()
+        self._movers = ThreadPoolExecutor(max_workers=movers, thread_name_prefix="staging")
+
+    @classmethod
+    def for_system(cls, system) -> Optional["ScratchStaging"]:
+        """Staging of the system configuration, or None when it is disabled"""
+        if not system.scratch_downloads:
+            return None
+        return cls(system.scratch_dir / "downloads", int(system.scratch_quota_gb * GB), int(system.scratch_cache_gb * GB))
+
+    def cached_bytes(self) -> int:
+        return sum(path.stat().st_size for path in self.done.iterdir())
+
+    def evict(self, needed: int = 0) -> int:
+        """
+        Remove completed files, least recently used first, until the cache
+        fits in cache_size and scratch has needed bytes free.
+
+        Returns:
+            Number of bytes removed
+        """
+        with self._evict_lock:
+            files = sorted(((path.stat(), path) for path in self.done.iterdir()), key=lambda item: item[0].st_mtime)
+            cached = sum(st.st_size for st, _ in files)
+            removed = 0
+            for st, path in files:
+                if cached <= self.cache_size and shutil.disk_usage(self.root).free >= needed + FREE_SPACE_MARGIN:
+                    break
+                path.unlink(missing_ok=True)
+                cached -= st.st_size
+                removed += st.st_size
+        if removed:
+            telemetry.count("download.scratch_evicted", removed)
+        return removed
+
+    def _admit(self, size: int, cancel: Optional[threading.Event]):
+        with self._cond:
+            while self.in_flight and self.in_flight + size > self.quota:
+                if cancel is not None and cancel.is_set():
+                    raise DownloadCancelled(f"waiting for {size} bytes of scratch quota")
+                self._cond.wait(timeout=1)
+            self.in_flight += size
+        self.evict(size)
+
+    def _release(self, size: int):
+        with self._cond:
+            self.in_flight -= size
+            self._cond.notify_all()
+
+    def _lookup(self, name: str, size: Optional[int]) -> Optional[Path]:
+        path = self.done / name
+        if not path.exists() or (size is not None and path.stat().st_size != size):
+            return None
+        # the modification time orders the eviction
+        os.utime(path)
+        return path
+
+    @staticmethod
+    def _place(source: Path, target: Path):
+        tmp_path = part_path(target)
+        tmp_path.unlink(missing_ok=True)
+        try:
+            os.link(source, tmp_path)
+        except OSError:
+            shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, target)
+
+    def _deliver(self, staged: Path, target: Path, size: int) -> Path:
+        try:
+            with telemetry.span("download.stage_move", file=target.name):
+                self._place(staged, target)
+            os.replace(staged, self.done / staged.name)
+        finally:
+            self._release(size)
+        self.evict()
+        return target
+
+    def download(self, target: Path, size: Optional[int], fetch: Callable[[Path], Path], cancel: Optional[threading.Event] = None) -> Future:
+        """
+        Download a file through scratch.
+
+        Args:
+            target: Final path of the file
+            size: Expected size in bytes, if known
+            fetch: Function downloading the file to the given path (through its .part file)
+            cancel: Event interrupting the wait for quota
+
+        Returns:
+            Future of target, done once the file is in place
+        """
+        cached = self._lookup(target.name, size)
+        if cached is not None:
+            telemetry.count("download.scratch_hits")
+            self._place(cached, target)
+            moved = Future()
+            moved.set_result(target)
+            return moved
+
+        size = size or 0
+        self._admit(size, cancel)
+        try:
+            staged = self.incoming / target.name
+            if part_path(target).exists() and not part_path(staged).exists():
+                # resume a transfer started without staging
+                shutil.move(part_path(target), part_path(staged))
+            staged = fetch(staged)
+        except BaseException:
+            self._release(size)
+            raise
+        return self._movers.submit(self._deliver, staged, target, size)
+
+    def close(self):
+        """Wait for the moves still running"""
+        self._movers.shutdown(wait=True)
+
+
+class SpacePlan:
+    """
+    Planned download volume checked against the free space of the file systems.
+
+    Free space is measured once, before anything is downloaded, and the
+    volume of every search window is added as it comes in, so the check
+    stays valid while earlier windows are downloading. With staging, scratch
+    must hold the in-flight quota, counting the completed files it can evict.
+
+    Args:
+        destination: Directory the products end up in (SLC directory or store)
+        staging: ScratchStaging of the downloads, if enabled
+    """
+
+    def __init__(self, destination: Path, staging: Optional[ScratchStaging] = None):
+        destination.mkdir(parents=True, exist_ok=True)
+        self.destination = destination
+        self.staging = staging
+        self.planned = 0
+        self._lock = threading.Lock()
+        self.free = shutil.disk_usage(destination).free
+        self.scratch_free = None
+        if staging is not None and not same_filesystem(destination, staging.root):
+            self.scratch_free = shutil.disk_usage(staging.root).free + staging.cached_bytes()
+
+    def add(self, nbytes: int):
+        """
+        Add bytes still to download to the plan.
+
+        Raises:
+            InsufficientSpace: One of the file systems cannot hold the plan
+        """
+        with self._lock:
+            self.planned += nbytes
+            planned = self.planned
+        if planned + FREE_SPACE_MARGIN > self.free:
+            raise InsufficientSpace(
+                f"{self.destination}: {planned / GB:.1f} GB to download, {self.free / GB:.1f} GB free"
+            )
+        if self.scratch_free is not None:
+            needed = min(planned, self.staging.quota)
+            if needed + FREE_SPACE_MARGIN > self.scratch_free:
+                raise InsufficientSpace(
+                    f"scratch {self.staging.root}: {needed / GB:.1f} GB in flight, {self.scratch_free / GB:.1f} GB free"
+                )
@@ -0,0 +1,486 @@
+import os
+import time
+import random
+import asyncio
+import threading
+import hashlib
+from pathlib import Path
+from contextlib import nullcontext
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional
+
+import requests
+import asf_search as asf
+from rich import print
+from asf_search.download.download import strip_auth_if_aws
+from asf_search.exceptions import ASFAuthenticationError
+
+from .. import telemetry
+from .engine import TransferCancelled, TransferEngine, url_host
+
+# small stream chunks: urllib3 drops a partially read chunk when the connection breaks
+CHUNK_SIZE = 64 * 1024
+HASH_BLOCK_SIZE = 8 * 1024 * 1024
+MAX_RETRIES = 8
+MAX_BACKOFF = 60
+TIMEOUT = 60
+# seconds an unprocessed burst product may keep answering 202
+PROCESSING_TIMEOUT = 15 * 60
+
+# session of the ASF transfers in a TransferEngine
+ASF_SESSION = "asf"
+
+# answers asking the client to slow down, retried after a backoff
+THROTTLE_STATUS = (429, 503)
+# answers refusing the credentials, they concern every product of a batch
+AUTH_STATUS = (401, 403)
+
+# errors after which a transfer is resumed from the current offset
+RESUMABLE_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+
+class ChecksumMismatch(Exception):
+    """Raised when a finished download does not match the expected md5sum"""
+
+
+class DownloadCancelled(TransferCancelled):
+    """Raised inside a transfer when the batch it belongs to is being cancelled"""
+
+
+class ProductNotReady(Exception):
+    """Raised when a burst product is still being processed after PROCESSING_TIMEOUT"""
+
+
+class IncompleteDownload(Exception):
+    """Raised when the server closes the stream before the expected size is reached"""
+
+
+class Throttled(Exception):
+    """Raised when the server answers 429 or 503, with the delay it asked for"""
+
+    def __init__(self, status: int, retry_after: Optional[float] = None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class DownloadFailures(Exception):
+    """Raised after a batch when some products could not be downloaded, maps file names to their error"""
+
+    def __init__(self, failures: Dict[str, BaseException]):
+        super().__init__(f"{len(failures)} products failed to download")
+        self.failures = failures
+
+
+def backoff_delay(failures: int, retry_after: Optional[float] = None) -> float:
+    """
+    Seconds to wait before the next attempt of a transfer.
+
+    Exponential backoff with full jitter, so transfers failing together do
+    not retry together. A Retry-After sent by the server takes precedence.
+    """
+    if retry_after is not None:
+        return min(retry_after, MAX_BACKOFF)
+    return random.uniform(0, min(2 ** failures, MAX_BACKOFF))
+
+
+def _retry_after(response: requests.Response) -> Optional[float]:
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        # missing, or an HTTP date which ASF does not send
+        return None
+
+
+def then(future: Future, fn: Callable[[Future], object]) -> Future:
+    """Future of fn(future), called in the thread completing future once it is done"""
+    chained = Future()
+
+    def done(completed: Future):
+        try:
+            chained.set_result(fn(completed))
+        except BaseException as e:
+            chained.set_exception(e)
+
+    future.add_done_callback(done)
+    return chained
+
+
+def placed(result):
+    """Path of a download, waiting for its move from scratch when it is still running"""
+    return result.result() if isinstance(result, Future) else result
+
+
+def part_path(path: Path) -> Path:
+    """Path of the in-progress file for a download target"""
+    return path.with_name(path.name + ".part")
+
+
+def _hash_existing(path: Path, md5) -> int:
+    """Feed already downloaded bytes of a resumed file into md5, returns the offset"""
+    offset = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_BLOCK_SIZE):
+            md5.update(chunk)
+            offset += len(chunk)
+    return offset
+
+
+def _open_stream(session: requests.Session, url: str, offset: int, cancel: Optional[threading.Event] = None) -> requests.Response:
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    cancel = cancel or threading.Event()
+    deadline = time.monotonic() + PROCESSING_TIMEOUT
+    while True:
+        response = session.get(url, headers=headers, stream=True, timeout=TIMEOUT, hooks={"response": strip_auth_if_aws})
+        # unprocessed burst products answer 202 until they are ready
+        if response.status_code != 202:
+            break
+        response.close()
+        if time.monotonic() > deadline:
+            raise ProductNotReady(f"{url}: still processing after {PROCESSING_TIMEOUT} s")
+        if cancel.wait(1):
+            raise DownloadCancelled(url)
+
+    if response.status_code == 416:
+        return response
+    if response.status_code in THROTTLE_STATUS:
+        response.close()
+        raise Throttled(response.status_code, _retry_after(response))
+    try:
+        response.raise_for_status()
+    except requests.HTTPError as e:
+        if response.status_code in AUTH_STATUS:
+            raise ASFAuthenticationError(f"HTTP {response.status_code}: {response.text}") from e
+        raise
+    return response
+
+
+def download_file(
+    url: str,
+    path: Path,
+    session: Optional[requests.Session] = None,
+    expected_size: Optional[int] = None,
+    md5sum: Optional[str] = None,
+    on_progress: Optional[Callable[[int], None]] = None,
+    max_retries: int = MAX_RETRIES,
+    cancel: Optional[threading.Event] = None,
+    concurrency=None,
+) -> Path:
+    """
+    Download a file resuming from an existing .part file.
+
+    Bytes are written to <path>.part and hashed while they stream in.
+    When the size and md5sum match, the .part file is renamed to path.
+    Dropped connections resume with an HTTP Range request after a jittered
+    exponential backoff, throttling answers wait for their Retry-After.
+
+    Args:
+        url: URL to download
+        path: Final path of the file
+        session: Authenticated session, defaults to a new ASFSession
+        expected_size: Size in bytes announced by ASF, if known
+        md5sum: md5 hex digest announced by ASF, if known
+        on_progress: Called with the number of new bytes (negative when a transfer restarts)
+        max_retries: Number of consecutive failed attempts before giving up
+        cancel: Event checked between chunks, the .part file is kept for a later resume
+        concurrency: AdaptiveConcurrency fed with the received bytes and told about throttling
+
+    Returns:
+        Path of the completed file
+
+    Raises:
+        ASFAuthenticationError: Server refused the credentials
+        requests.HTTPError: Server refused the file, e.g. 404 for a withdrawn product
+        ProductNotReady: Burst product still processing after PROCESSING_TIMEOUT
+        ChecksumMismatch: Completed file does not match md5sum
+        IncompleteDownload: Retries exhausted before the file was complete
+        Throttled: Retries exhausted while the server kept throttling
+        DownloadCancelled: cancel was set during the transfer
+    """
+    with telemetry.span("download.file", file=path.name) as span:
+        return _download_file(url, path, session, expected_size, md5sum, on_progress, max_retries, cancel, concurrency, span)
+
+
+def _download_file(url, path, session, expected_size, md5sum, on_progress, max_retries, cancel, concurrency, span) -> Path:
+    session = session or asf.ASFSession()
+    on_progress = on_progress or (lambda _: None)
+    tmp_path = part_path(path)
+    started = time.perf_counter()
+
+    md5 = hashlib.md5()
+    offset = 0
+    if tmp_path.exists():
+        if expected_size is not None and tmp_path.stat().st_size > expected_size:
+            tmp_path.unlink()
+        else:
+            # the prefix is read once, the rest is hashed while streaming
+            offset = _hash_existing(tmp_path, md5)
+            on_progress(offset)
+    resumed_from = offset
+
+    failures = 0
+    while expected_size is None or offset < expected_size:
+        try:
+            with _open_stream(session, url, offset, cancel) as response:
+                if response.status_code == 416:
+                    break
+                if offset and response.status_code != 206:
+                    # server ignored the Range header, start over
+                    on_progress(-offset)
+                    offset = 0
+                    md5 = hashlib.md5()
+
+                with open(tmp_path, "ab" if offset else "wb") as f:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        if cancel is not None and cancel.is_set():
+                            raise DownloadCancelled(path.name)
+                        f.write(chunk)
+                        md5.update(chunk)
+                        offset += len(chunk)
+                        failures = 0
+                        on_progress(len(chunk))
+                        if concurrency is not None:
+                            concurrency.record(len(chunk))
+
+            if expected_size is None:
+                break
+            if offset < expected_size:
+                raise IncompleteDownload(f"{path.name}: stream ended at {offset}/{expected_size} bytes")
+        except (*RESUMABLE_ERRORS, IncompleteDownload, Throttled) as e:
+            telemetry.count("download.retries")
+            failures += 1
+            if failures > max_retries:
+                raise
+            retry_after = None
+            if isinstance(e, Throttled):
+                retry_after = e.retry_after
+                if concurrency is not None:
+                    concurrency.throttled()
+            delay = backoff_delay(failures, retry_after)
+            if cancel is not None:
+                if cancel.wait(delay):
+                    raise DownloadCancelled(path.name)
+            else:
+                time.sleep(delay)
+
+    if md5sum and md5.hexdigest() != md5sum:
+        tmp_path.unlink()
+        on_progress(-offset)
+        raise ChecksumMismatch(f"{path.name}: md5 {md5.hexdigest()} does not match {md5sum}")
+
+    os.replace(tmp_path, path)
+
+    transferred = offset - resumed_from
+    elapsed = time.perf_counter() - started
+    span.set(bytes=transferred, resumed_from=resumed_from)
+    telemetry.count("download.bytes", transferred)
+    if elapsed > 0:
+        telemetry.observe("download.throughput", transferred / elapsed)
+    return path
+
+
+def product_target(product, directory: Path) -> Path:
+    return directory / product.properties["fileName"]
+
+
+def product_host(product) -> str:
+    return url_host(product.properties["url"])
+
+
+def download_product(product, directory: Path, session: requests.Session, progress=None, cancel=None, store=None, concurrency=None, staging=None, engine=None) -> Path:
+    """
+    Download one ASF product into directory, skipping it when already complete.
+
+    With a SlcStore the product is downloaded into the store, unless it is
+    stored already, and linked into directory. With an AdaptiveConcurrency
+    the transfer waits for a slot, and then for a slot of the TransferEngine
+    for its host, skipped and linked products never do. With a
+    ScratchStaging the transfer goes through scratch and the slots are
+    released before the file is moved to its destination, in the background.
+
+    Returns:
+        Path of the product, or with a ScratchStaging a Future of it, done
+        once the file is moved in place (see placed())
+    """
+    path = product_target(product, directory)
+    name = path.name
+    expected_size = product.properties.get("bytes")
+    expected_size = int(expected_size) if expected_size else None
+
+    if path.exists() and (expected_size is None or path.stat().st_size == expected_size):
+        try:
+            if store is not None:
+                store.adopt(product, path)
+        except ChecksumMismatch as e:
+            # a corrupt copy predating the store, fetched again below
+            print(f"[bold yellow]{e}, downloading it again[/bold yellow]")
+            path.unlink()
+        else:
+            telemetry.count("download.skipped")
+            if progress is not None:
+                progress.skip_file(name, path.stat().st_size)
+            return path
+
+    if store is not None:
+        stored = store.lookup(product)
+        if stored is not None:
+            store.link(product, stored, path)
+            telemetry.count("download.skipped")
+            if progress is not None:
+                progress.skip_file(name, stored.stat().st_size)
+            return path
+
+    on_progress = None
+    if progress is not None:
+        progress.start_file(name, expected_size)
+        on_progress = progress.file_callback(name)
+
+    def fetch(target: Path) -> Path:
+        # the adaptive limit first, waiting for it must not hold a slot of the engine
+        with concurrency.slot(cancel) if concurrency is not None else nullcontext(), \
+                engine.slot(product_host(product)) if engine is not None else nullcontext():
+            return download_file(
+                product.properties["url"],
+                target,
+                session=session,
+                expected_size=expected_size,
+                md5sum=product.properties.get("md5sum"),
+                on_progress=on_progress,
+                cancel=cancel,
+                concurrency=concurrency,
+            )
+
+    def download(target: Path):
+        if staging is not None:
+            return staging.download(target, expected_size, fetch, cancel)
+        return fetch(target)
+
+    def finish(downloaded: Path) -> Path:
+        if store is not None:
+            downloaded = store.link(product, downloaded, path)
+        if progress is not None:
+            progress.finish_file(name)
+        return downloaded
+
+    if store is not None:
+        result = store.fetch(product, download, partial=part_path(path))
+    else:
+        result = download(path)
+    if isinstance(result, Future):
+        # the transfer thread is free for the next product while the file moves
+        return then(result, lambda done: finish(done.result()))
+    return finish(result)
+
+
+def make_session(workers: int) -> requests.Session:
+    """ASFSession with a connection pool large enough for all workers"""
+    session = asf.ASFSession()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def try_download_product(product, failures: Dict[str, BaseException], *args, **kwargs) -> Optional[Path]:
+    """
+    download_product recording a failed product in failures instead of raising.
+
+    Refused credentials and cancellation still raise, they concern every
+    product of the batch.
+
+    Returns:
+        Path of the product, or None when it failed, or a Future of either
+        while the file moves from scratch
+    """
+    result = _settle(product, failures, lambda: download_product(product, *args, **kwargs))
+    if isinstance(result, Future):
+        # the move may fail too
+        return then(result, lambda done: _settle(product, failures, done.result))
+    return result
+
+
+def _settle(product, failures: Dict[str, BaseException], get: Callable):
+    try:
+        return get()
+    except (ASFAuthenticationError, TransferCancelled):
+        raise
+    except Exception as e:
+        name = product.properties["fileName"]
+        telemetry.count("download.failed")
+        print(f"[bold red]{name}: download failed after retries: {e}[/bold red]")
+        failures[name] = e
+        return None
+
+
+def download_products(
+    results,
+    directory: Path,
+    workers: int = 8,
+    session: Optional[requests.Session] = None,
+    progress=None,
+    store=None,
+    adaptive: bool = True,
+    staging=None,
+    engine: Optional[TransferEngine] = None,
+) -> list:
+    """
+    Download ASF products concurrently with resumable transfers.
+
+    The transfers run on a TransferEngine, up to workers of them at a time
+    sharing one pooled session. Products are submitted as results yields
+    them, so the first ones download while a windowed search is still
+    running. With adaptive the number of running transfers starts lower
+    and is tuned from the measured throughput (see AdaptiveConcurrency). A
+    product failing after its retries does not stop the others, the
+    failures are raised together once the batch is done. Ctrl-C cancels
+    the batch, the .part files resume next time.
+
+    Args:
+        results: Iterable of ASFProduct
+        directory: Directory to place the files
+        workers: Maximum number of concurrent transfers
+        session: Shared authenticated session, defaults to the ASF session of the engine
+        progress: DownloadProgress fed with the bytes written by each worker
+        store: SlcStore holding the products, linked into directory
+        adaptive: Tune the number of concurrent transfers up to workers
+        staging: ScratchStaging the transfers go through
+        engine: TransferEngine running the transfers, defaults to one of workers transfers
+
+    Returns:
+        List of downloaded paths
+
+    Raises:
+        DownloadFailures: Some products failed, the others are downloaded
+    """
+    from .concurrency import AdaptiveConcurrency
+
+    concurrency = AdaptiveConcurrency(workers) if adaptive else None
+    failures: Dict[str, BaseException] = {}
+
+    async def download_all(engine: TransferEngine) -> list:
+        nonlocal session
+        session = session or engine.session(ASF_SESSION, lambda: make_session(workers))
+        products = iter(results)
+        transfers = []
+        # the search windows come in on a thread while the first products download
+        while (product := await asyncio.to_thread(next, products, None)) is not None:
+            transfers.append(engine.transfer(
+                product_host(product), try_download_product,
+                product, failures, directory, session, progress, engine.cancel, store, concurrency, staging, engine,
+            ))
+        transferred = await engine.gather(transfers)
+        # the files still moving from scratch are collected once every transfer is done
+        return [await asyncio.wrap_future(path) if isinstance(path, Future) else path for path in transferred]
+
+    if engine is None:
+        with TransferEngine(max_transfers=workers, default_host_limit=workers) as engine:
+            paths = engine.run(download_all(engine))
+    else:
+        paths = engine.run(download_all(engine))
+    if failures:
+        raise DownloadFailures(failures)
+    return [path for path in paths if path is not None]
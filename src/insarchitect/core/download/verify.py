@@ -0,0 +1,329 @@
+import os
+import sys
+import json
+import time
+import fcntl
+import hashlib
+import threading
+import zipfile
+from pathlib import Path
+from contextlib import contextmanager
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional
+
+from rich import print
+from rich.progress import Progress
+
+from ...models import ProjectConfig
+from .. import telemetry
+from .progress import progress_columns
+
+# large sequential reads, hashlib releases the GIL on buffers this size
+READ_BLOCK_SIZE = 16 * 1024 * 1024
+# verified files written to the cache at a time, an interrupted audit keeps its progress
+FLUSH_EVERY = 32
+
+OK = "ok"
+CORRUPT = "corrupt"
+TRUNCATED = "truncated"
+BAD_ZIP = "bad zip"
+NO_CHECKSUM = "no checksum"
+
+
+@dataclass
+class FileCheck:
+    """Outcome of the audit of one product file"""
+    product: object
+    path: Path
+    status: str
+    detail: str = ""
+    cached: bool = False
+
+
+def md5_file(path: Path, on_progress: Optional[Callable[[int], None]] = None) -> str:
+    """md5 hex digest of a file, read in large blocks into a reused buffer"""
+    md5 = hashlib.md5()
+    buffer = bytearray(READ_BLOCK_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while nbytes := f.readinto(buffer):
+            md5.update(view[:nbytes])
+            if on_progress is not None:
+                on_progress(nbytes)
+    return md5.hexdigest()
+
+
+def check_zip(path: Path) -> Optional[str]:
+    """
+    Validate the central directory of a zip without decompressing it.
+
+    Returns:
+        The problem found, or None when every member lies within the file
+    """
+    size = path.stat().st_size
+    try:
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if info.header_offset + info.compress_size > size:
+                    return f"{info.filename} extends past the end of the file"
+    except (zipfile.BadZipFile, OSError) as e:
+        return str(e)
+    return None
+
+
+class VerifyCache:
+    """
+    Files already audited, keyed on their resolved path, size and mtime.
+
+    A file rewritten or replaced after its audit no longer matches its entry
+    and is hashed again. Products linked from the SLC store are audited
+    under the path of the store object, so they are hashed once for all
+    projects. The JSON file is only read and written under an exclusive
+    flock.
+
+    Args:
+        path: JSON file of the cache, shared between projects
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._entries = self._read()
+        self._mutex = threading.Lock()
+        self._dropped = set()
+
+    @classmethod
+    def for_system(cls, system) -> "VerifyCache":
+        return cls(system.cache_dir / "verified.json")
+
+    @contextmanager
+    def _lock(self):
+        with open(self.path.with_suffix(".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self) -> dict:
+        try:
+            return json.loads(self.path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    @staticmethod
+    def _key(path: Path) -> tuple:
+        stat = path.stat()
+        return str(path.resolve()), stat.st_size, stat.st_mtime_ns
+
+    def get(self, path: Path) -> Optional[dict]:
+        real_path, size, mtime = self._key(path)
+        with self._mutex:
+            entry = self._entries.get(real_path)
+        if entry is None or entry["size"] != size or entry["mtime_ns"] != mtime:
+            return None
+        return entry
+
+    def put(self, path: Path, **values):
+        real_path, size, mtime = self._key(path)
+        with self._mutex:
+            self._entries[real_path] = {"size": size, "mtime_ns": mtime, "verified": time.time(), **values}
+
+    def flush(self):
+        """Merge the entries into the file, entries of concurrent audits are kept"""
+        with self._mutex, self._lock():
+            entries = self._read()
+            entries.update(self._entries)
+            for real_path in self._dropped:
+                entries.pop(real_path, None)
+            tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_text(json.dumps(entries))
+            os.replace(tmp_path, self.path)
+            self._entries = entries
+            self._dropped.clear()
+
+    def drop(self, path: Path):
+        real_path = str(path.resolve())
+        with self._mutex:
+            self._entries.pop(real_path, None)
+            self._dropped.add(real_path)
+
+
+def _check(product, path: Path, md5: Optional[str], zip_problem: Optional[str], cached: bool) -> FileCheck:
+    expected = product.properties.get("md5sum")
+    if zip_problem:
+        return FileCheck(product, path, BAD_ZIP, zip_problem, cached)
+    if not expected:
+        return FileCheck(product, path, NO_CHECKSUM, cached=cached)
+    if md5 != expected:
+        return FileCheck(product, path, CORRUPT, f"md5 {md5} does not match {expected}", cached)
+    return FileCheck(product, path, OK, cached=cached)
+
+
+def _audited_path(product, path: Path, store) -> Path:
+    """Store object a project file links to, or the file itself"""
+    if store is not None:
+        stored = store.object_path(product)
+        if stored.exists() and os.path.samefile(stored, path):
+            return stored
+    return path
+
+
+def verify_products(results, slc_dir: Path, cache: VerifyCache, workers: Optional[int] = None, check_zips: bool = False, progress=None, store=None) -> List[FileCheck]:
+    """
+    Check the downloaded products of slc_dir against their ASF md5sum.
+
+    Sizes are compared first, files whose resolved path, size and mtime are
+    in the cache are not read again, the others are hashed concurrently with
+    large sequential reads. With check_zips the central directory of each
+    zip is validated too.
+
+    Args:
+        results: ASF products of the project
+        slc_dir: Directory holding the products
+        cache: VerifyCache of the system
+        workers: Files hashed at a time, defaults to the number of CPUs
+        check_zips: Also validate the zip central directories
+        progress: rich Progress showing the hashed bytes
+        store: SlcStore the products may be linked from
+
+    Returns:
+        FileCheck of every product present in slc_dir
+    """
+    workers = workers or os.cpu_count() or 4
+    checks = []
+    pending = []
+    for product in results:
+        path = slc_dir / product.properties["fileName"]
+        if not path.exists():
+            continue
+        expected_size = int(product.properties.get("bytes") or 0)
+        size = path.stat().st_size
+        if expected_size and size != expected_size:
+            checks.append(FileCheck(product, path, TRUNCATED, f"{size}/{expected_size} bytes"))
+            continue
+        entry = cache.get(_audited_path(product, path, store))
+        if entry is not None and (not check_zips or "zip" in entry):
+            checks.append(_check(product, path, entry["md5"], entry.get("zip"), cached=True))
+        else:
+            pending.append((product, path, size))
+
+    task = None
+    if progress is not None and pending:
+        task = progress.add_task("Verifying", total=sum(size for _, _, size in pending))
+
+    def audit(product, path: Path) -> FileCheck:
+        on_progress = (lambda nbytes: progress.advance(task, nbytes)) if task is not None else None
+        with telemetry.span("verify.file", file=path.name):
+            md5 = md5_file(path, on_progress)
+            values = {"md5": md5}
+            zip_problem = None
+            if check_zips:
+                zip_problem = check_zip(path)
+                values["zip"] = zip_problem
+        telemetry.count("verify.bytes", path.stat().st_size)
+        cache.put(_audited_path(product, path, store), **values)
+        return _check(product, path, md5, zip_problem, cached=False)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(audit, product, path) for product, path, _ in pending]
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                checks.append(future.result())
+                if done % FLUSH_EVERY == 0:
+                    cache.flush()
+        finally:
+            for future in futures:
+                future.cancel()
+            cache.flush()
+    return checks
+
+
+def remove_damaged(config: ProjectConfig, checks: List[FileCheck], cache: VerifyCache) -> int:
+    """
+    Delete damaged products so the next download fetches them again.
+
+    Stored products are discarded from the SLC store and from the scratch
+    cache too, otherwise the next download would link the same damaged file
+    back. The download step is invalidated in the run journal.
+
+    Returns:
+        Number of removed products
+    """
+    from ..journal import RunJournal
+    from .slc_store import SlcStore
+    from .staging import ScratchStaging
+
+    store = SlcStore.for_system(config.system)
+    staging = ScratchStaging.for_system(config.system)
+    damaged = [check for check in checks if check.status in (CORRUPT, TRUNCATED, BAD_ZIP)]
+    for check in damaged:
+        cache.drop(_audited_path(check.product, check.path, store))
+        if store is not None:
+            store.discard(check.product, check.path)
+        if staging is not None:
+            (staging.done / check.path.name).unlink(missing_ok=True)
+        check.path.unlink(missing_ok=True)
+    if damaged:
+        cache.flush()
+        RunJournal.for_project(config).invalidate("download")
+    return len(damaged)
+
+
+def verify_main(config: ProjectConfig, workers: Optional[int] = None, check_zips: bool = False, remove: bool = False):
+    """
+    Audit the SLC directory of a project against the ASF md5sums.
+
+    The products come from the cached search of the project (of any age),
+    ASF is only searched when there is none.
+    """
+    from .download import iter_search, load_cached_results
+    from .search_cache import merge_results
+    from .slc_store import SlcStore
+
+    if config.download is None:
+        print(f"[bold red]No valid configuration given for verify command[/bold red]")
+        sys.exit(1)
+
+    slc_dir = config.system.work_dir / config.project_name / config.download.slc_dir
+    results = load_cached_results(config)
+    if results is None:
+        results = merge_results(iter_search(config))
+
+    cache = VerifyCache.for_system(config.system)
+    started = time.perf_counter()
+    with Progress(*progress_columns()) as progress:
+        checks = verify_products(results, slc_dir, cache, workers, check_zips, progress, SlcStore.for_system(config.system))
+    elapsed = time.perf_counter() - started
+
+    hashed = [check for check in checks if not check.cached]
+    hashed_bytes = sum(check.path.stat().st_size for check in hashed if check.path.exists())
+    missing = len(results) - len(checks)
+    counts: Dict[str, int] = {}
+    for check in checks:
+        counts[check.status] = counts.get(check.status, 0) + 1
+
+    print(f"[bold]Verified[/bold]: {len(checks)} products in {slc_dir}, {len(checks) - len(hashed)} unchanged since their last audit")
+    if elapsed > 0 and hashed_bytes:
+        print(f"[bold]Hashed[/bold]: {hashed_bytes / 1024**3:.2f} GB in {elapsed:.1f} s ({hashed_bytes / elapsed / 1024**2:.0f} MB/s)")
+    for status, count in sorted(counts.items()):
+        color = "green" if status == OK else "yellow" if status == NO_CHECKSUM else "red"
+        print(f"  [bold {color}]{status}[/bold {color}]: {count}")
+    if missing:
+        print(f"  [bold yellow]not downloaded[/bold yellow]: {missing}")
+
+    damaged = [check for check in checks if check.status in (CORRUPT, TRUNCATED, BAD_ZIP)]
+    for check in sorted(damaged, key=lambda check: check.path.name):
+        print(f"[bold red]  {check.path.name}: {check.status}, {check.detail}[/bold red]")
+    if not damaged:
+        print(f"[bold green]All downloaded products are intact[/bold green]")
+        return
+    if remove:
+        removed = remove_damaged(config, damaged, cache)
+        print(f"[bold yellow]Removed {removed} damaged products, the next download fetches them again[/bold yellow]")
+    else:
+        print(f"[bold yellow]Run with --remove to delete them so the next download fetches them again[/bold yellow]")
+    sys.exit(1)
@@ -0,0 +1,121 @@
+import sys
+import time
+import statistics
+import subprocess
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Sequence, Tuple
+
+# modules a command imports by the time it does its work, the command
+# modules themselves only import typer
+COMMAND_MODULES = {
+    "download": ("insarchitect.core.download.download",),
+    "dem": ("insarchitect.core.dem.dem", "insarchitect.core.pipeline"),
+    "jobfiles": ("insarchitect.core.jobfiles.jobfiles", "insarchitect.core.download.download"),
+    "isce": ("insarchitect.core.isce.isce",),
+    "run": (
+        "insarchitect.core.pipeline",
+        "insarchitect.core.download.download",
+        "insarchitect.core.dem.dem",
+        "insarchitect.core.jobfiles.jobfiles",
+        "insarchitect.core.isce.isce",
+    ),
+    "gc": ("insarchitect.core.download.slc_store",),
+    "verify": ("insarchitect.core.download.verify", "insarchitect.core.download.download"),
+    "extract": ("insarchitect.core.download.extract",),
+}
+
+
+@dataclass
+class ImportProfile:
+    """
+    Startup cost of importing some modules in a fresh interpreter.
+
+    Args:
+        target: Name shown in the report
+        seconds: Median wall time of the interpreter, startup included
+        import_seconds: Median time spent importing, as reported by -X importtime
+        packages: (top level package, seconds) of the slowest packages
+    """
+    target: str
+    seconds: float
+    import_seconds: float
+    packages: List[Tuple[str, float]]
+
+
+def parse_importtime(output: str) -> List[Tuple[str, int, int]]:
+    """
+    Parse the stderr of python -X importtime.
+
+    Returns:
+        List of (module, self microseconds, cumulative microseconds)
+    """
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        entries.append((name.strip(), int(self_us), int(cumulative_us)))
+    return entries
+
+
+def profile_import(target: str, modules: Sequence[str], repeats: int = 3, top: int = 5) -> ImportProfile:
+    """
+    Import modules in fresh interpreters with -X importtime.
+
+    Args:
+        target: Name shown in the report
+        modules: Modules to import
+        repeats: Interpreters started, the median is reported
+        top: Number of slowest top level packages to keep
+
+    Returns:
+        ImportProfile of the imports
+    """
+    command = [sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"]
+    wall_times, import_times = [], []
+    package_times = defaultdict(list)
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = subprocess.run(command, capture_output=True, text=True)
+        wall_times.append(time.perf_counter() - started)
+        if result.returncode != 0:
+            raise RuntimeError(f"Importing {', '.join(modules)} failed:\n{result.stderr.strip().splitlines()[-1]}")
+
+        entries = parse_importtime(result.stderr)
+        import_times.append(sum(self_us for _, self_us, _ in entries) / 1e6)
+        totals: Dict[str, int] = defaultdict(int)
+        for name, self_us, _ in entries:
+            totals[name.split(".")[0]] += self_us
+        for package, total in totals.items():
+            package_times[package].append(total / 1e6)
+
+    packages = sorted(
+        ((package, statistics.median(times)) for package, times in package_times.items()),
+        key=lambda item: item[1],
+        reverse=True,
+    )
+    return ImportProfile(target, statistics.median(wall_times), statistics.median(import_times), packages[:top])
+
+
+def profile_cli(repeats: int = 3) -> List[ImportProfile]:
+    """Startup cost of the CLI itself and of every command once it runs"""
+    profiles = [profile_import("insarchitect (startup)", ["insarchitect.cli"], repeats)]
+    for command, modules in COMMAND_MODULES.items():
+        profiles.append(profile_import(f"insarchitect {command}", ["insarchitect.cli", *modules], repeats))
+    return profiles
+
+
+def print_import_profile(profiles: List[ImportProfile]):
+    from rich.console import Console
+    from rich.table import Table
+
+    table = Table(title="Import profile (median of fresh interpreters)")
+    table.add_column("Command")
+    table.add_column("Wall (s)", justify="right")
+    table.add_column("Imports (s)", justify="right")
+    table.add_column("Slowest packages")
+    for profile in profiles:
+        packages = ", ".join(f"{package} {seconds:.3f}" for package, seconds in profile.packages)
+        table.add_row(profile.target, f"{profile.seconds:.3f}", f"{profile.import_seconds:.3f}", packages)
+    Console().print(table)
@@ -0,0 +1,118 @@
+import sys
+import threading
+import subprocess
+from pathlib import Path
+from typing import Optional
+from rich import print
+
+from ...models import ProjectConfig, Executors
+from ..jobfiles.slurm import load_job_arrays, submit_job_arrays, wait_for_jobs, failed_stages
+from ..jobfiles.local import LocalExecutor, ResourceBudget, StageCancelled, TaskError
+
+
+def isce_main(config: ProjectConfig, budget: Optional[ResourceBudget] = None, cancel: Optional[threading.Event] = None):
+    """
+    Run the job arrays written by the jobfiles step with the configured executor.
+
+    With the slurm executor the stages are submitted as an afterok
+    dependency chain, so a failing stage cancels the rest of the chain.
+    With the local executor they run on this machine, one stage after the
+    other, within budget when projects processed together share one.
+    Setting cancel stops the running tasks, or cancels the submitted job
+    arrays with the slurm executor.
+    """
+    if config.jobfiles is None:
+        print("[bold red]No valid configuration given for jobfiles, cannot locate job arrays[/bold red]")
+        sys.exit(1)
+
+    work_dir = config.system.work_dir / config.project_name
+    jobfiles_dir = work_dir / config.jobfiles.jobfiles_dir
+
+    try:
+        jobs = load_job_arrays(jobfiles_dir)
+    except FileNotFoundError as e:
+        print(f"[bold red]ERROR: {e}[/bold red]")
+        sys.exit(1)
+
+    if not jobs:
+        print("[bold yellow]No job arrays to run[/bold yellow]")
+        return
+
+    print(f"[bold green]{'='*60}[/bold green]")
+    print("[bold green]ISCE PROCESSING[/bold green]")
+    print(f"[bold green]{'='*60}[/bold green]")
+    print(f"[bold]Executor[/bold]: {config.system.executor.value}")
+
+    if config.system.executor == Executors.LOCAL:
+        run_local(config, jobs, budget, cancel)
+    else:
+        run_slurm(config, jobs, cancel)
+    print("[bold green]ISCE PROCESSING COMPLETED SUCCESSFULLY[/bold green]")
+
+
+def run_slurm(config: ProjectConfig, jobs, cancel: Optional[threading.Event] = None):
+    system = config.system
+    try:
+        job_ids = submit_job_arrays(jobs, system.sbatch_command)
+        for job, job_id in zip(jobs, job_ids):
+            print(f"  - [bold cyan]{job.name}[/bold cyan]: job {job_id} ({job.packs} array elements)")
+
+        def on_update(pending):
+            print(f"[bold]{len(pending)}/{len(job_ids)} stages queued or running[/bold]")
+
+        cancelled = wait_for_jobs(
+            job_ids, system.squeue_command, system.job_poll_interval,
+            on_update=on_update, cancel=cancel, scancel_command=system.scancel_command,
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"[bold red]ERROR talking to Slurm: {e}[/bold red]")
+        sys.exit(1)
+
+    if cancelled:
+        stage = next(job for job, job_id in zip(jobs, job_ids) if job_id in cancelled)
+        print(f"[bold red]Run cancelled, job arrays from {stage.name} on were cancelled[/bold red]")
+        raise StageCancelled(stage.name)
+
+    failed = failed_stages(jobs)
+    if failed:
+        print(f"[bold red]Stage {failed[0].name} did not complete, see the logs in {Path(failed[0].script).parent}[/bold red]")
+        sys.exit(1)
+
+
+def resource_budget(system) -> ResourceBudget:
+    """Local executor budget from the system configuration"""
+    memory = int(system.local_memory_gb * 1024) if system.local_memory_gb else None
+    return ResourceBudget(system.max_parallel_jobs, cpus=system.local_cpus, memory=memory)
+
+
+def run_local(config: ProjectConfig, jobs, budget: Optional[ResourceBudget] = None, cancel: Optional[threading.Event] = None):
+    system = config.system
+    work_dir = system.work_dir / config.project_name
+
+    executor = LocalExecutor(
+        scratch_dir=system.scratch_dir / config.project_name,
+        log_dir=work_dir / config.jobfiles.jobfiles_dir / "logs",
+        max_parallel_jobs=system.max_parallel_jobs,
+        retries=system.task_retries,
+        cwd=work_dir,
+        budget=budget or resource_budget(system),
+        cancel=cancel,
+    )
+    print(f"[bold]Resources[/bold]: {executor.max_parallel_jobs} jobs, {executor.cpus} CPUs, {executor.memory / 1024:.1f} GB")
+
+    def on_progress(stage, completed, total):
+        if completed == total or completed % max(1, total // 10) == 0:
+            print(f"  - [bold cyan]{stage}[/bold cyan]: {completed}/{total} tasks")
+
+    try:
+        executor.run(jobs, on_progress)
+    except TaskError as e:
+        print(f"[bold red]ERROR: {e}[/bold red]")
+        sys.exit(1)
+    except StageCancelled as e:
+        # whatever cancelled the run reports why
+        print(f"[bold red]{e}, running tasks stopped[/bold red]")
+        raise
+    except KeyboardInterrupt:
+        print("[bold red]\nProcessing interrupted by user[/bold red]")
+        sys.exit(1)
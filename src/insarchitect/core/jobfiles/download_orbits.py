@@ -1,43 +1,100 @@
 import sys
-import asyncio
-from concurrent.futures import ThreadPoolExecutor
-from s1_orbits import fetch_for_scene
-from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, TaskProgressColumn, TransferSpeedColumn, DownloadColumn
+from typing import List
+from rich import print
+from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, TaskProgressColumn, MofNCompleteColumn
 from ...models import ProjectConfig
+from .. import telemetry
+from ..download.engine import TransferEngine
+from .orbit_store import ORBIT_HOST_LIMIT, OrbitIndex, Scene, VectorConverter, group_missing, orbit_host, resolve_group
+
+def project_scenes(config: ProjectConfig) -> List[Scene]:
+    """Scenes of a project, from its cached search or else from the products in its SLC directory"""
+    work_dir = config.system.work_dir / config.project_name
+    slc_dir = work_dir / config.download.slc_dir
+
+    burst_flag = config.download.burst_download
+    if burst_flag:
+        cached_results = None
+    else:
+        # asf_search is only needed to replay the cached search
+        from ..download.download import load_cached_results
+        cached_results = load_cached_results(config)
+    if cached_results and config.download.aoi_selection:
+        # no orbits for the products the download step skipped
+        from ..download.coverage import select_products
+        cached_results = select_products(
+            cached_results,
+            config.download.bounding_box,
+            min_contribution=config.download.min_contribution,
+            min_date_coverage=config.download.min_date_coverage,
+        ).results
+    if cached_results:
+        # scene names come from the cached search, no need to scan slc_dir
+        scene_names = [product.properties["sceneName"] for product in cached_results]
+    else:
+        pattern = "*.tiff" if burst_flag else "*.zip"
+        scene_names = [product.stem for product in slc_dir.glob(pattern)]
+
+    scenes = []
+    for name in dict.fromkeys(scene_names):
+        scene = Scene.from_name(name)
+        if scene is None:
+            print(f"[bold yellow]Skipping {name}: not a Sentinel-1 scene name[/bold yellow]")
+            continue
+        scenes.append(scene)
+    return scenes
+
 
 async def download_orbits(config: ProjectConfig):
+    """
+    Fetch the orbit files of the scenes of a project into the shared store.
+
+    Each fetched EOF file is converted to binary state vectors in a worker
+    process while the other fetches go on.
+    """
     if not config.download:
         print("No valid download config file given")
         sys.exit(1)
 
-    work_dir = config.system.work_dir / config.project_name
-    slc_dir = work_dir / config.download.slc_dir
     orbits_dir = config.system.orbits_dir
     orbits_dir.mkdir(exist_ok=True)
+    scenes = project_scenes(config)
 
-    burst_flag = config.download.burst_download
-    pattern = "*.tiff" if burst_flag else "*.zip"
-    downloaded_products = list(slc_dir.glob(pattern))
-
-    loop = asyncio.get_event_loop()
-    avg_file_size = int(4.3 * 1_000_000)
-
-    with Progress(
-        SpinnerColumn(),
-        TextColumn("[progress.description]{task.description}"),
-        BarColumn(),
-        TransferSpeedColumn(),
-        DownloadColumn(),
-    ) as progress:
-        task = progress.add_task("Downloading orbits...", total=len(downloaded_products) * avg_file_size)
-
-        with ThreadPoolExecutor(max_workers=50) as executor:
-            tasks = []
-            for orbit in downloaded_products:
-                tasks.append(loop.run_in_executor(executor, fetch_for_scene, orbit.stem, orbits_dir))
-
-            results = []
-            for coro in asyncio.as_completed(tasks):
-                result = await coro
-                results.append(result)
-                progress.update(task, advance=avg_file_size)
+    # resolve from the local store first, only the rest goes to the network
+    with telemetry.span("orbit.index", scenes=len(scenes)):
+        index = OrbitIndex(orbits_dir)
+    found = [index.lookup(scene) for scene in scenes]
+    missing = [scene for scene, path in zip(scenes, found) if path is None]
+    groups = group_missing(missing)
+    print(f"[bold cyan]{len(scenes) - len(missing)}/{len(scenes)} orbits found in {orbits_dir}, "
+          f"fetching {len(groups)} orbit groups[/bold cyan]")
+
+    with VectorConverter(index) as converter:
+        # files fetched before the state vector store existed are converted too
+        converter.submit(found)
+        if groups:
+            with Progress(
+                SpinnerColumn(),
+                TextColumn("[progress.description]{task.description}"),
+                BarColumn(),
+                MofNCompleteColumn(),
+                TaskProgressColumn(),
+            ) as progress:
+                with TransferEngine.for_system(config.system, progress=progress) as engine:
+                    # each group fetches at most a couple of small EOF files
+                    host = orbit_host()
+                    engine.set_default_limit(host, ORBIT_HOST_LIMIT)
+                    advance = engine.progress_task("Downloading orbits...", len(missing))
+
+                    def on_result(resolved):
+                        advance(len(resolved))
+                        # converted while the other groups are fetched
+                        converter.submit(resolved.values())
+
+                    await engine.gather(
+                        (engine.transfer(host, resolve_group, index, group, engine) for group in groups.values()),
+                        on_result=on_result,
+                    )
+        converted = converter.close()
+    if converted:
+        print(f"[bold cyan]Converted {converted} orbit files to binary state vectors[/bold cyan]")
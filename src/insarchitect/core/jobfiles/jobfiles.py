@@ -0,0 +1,107 @@
+import sys
+import csv
+import asyncio
+from pathlib import Path
+from typing import Optional
+from rich import print
+
+from ...models import ProjectConfig, Platforms
+from .download_orbits import download_orbits, project_scenes
+from .orbit_store import OrbitIndex
+from .slurm import write_job_arrays
+
+BASELINES_NAME = "baselines.csv"
+
+
+def jobfiles_main(config: ProjectConfig, orbits: bool = True):
+    """
+    Fetch the orbits and write the Slurm job arrays of the ISCE run files.
+
+    Args:
+        config: Project configuration
+        orbits: Fetch the orbit files first (the run pipeline fetches them per product)
+    """
+    if orbits and config.download and config.download.platform == Platforms.SENTINEL:
+        asyncio.run(download_orbits(config))
+
+    write_jobfiles(config)
+
+
+def write_baselines(config: ProjectConfig, jobfiles_dir: Path) -> Optional[Path]:
+    """
+    Write the baselines of the stack relative to its first scene to jobfiles_dir.
+
+    They come from the binary state vectors of the orbit store, so the
+    stack can be planned before ISCE runs. Skipped when some scene has no
+    local orbit file.
+
+    Returns:
+        Path of the baselines table, or None when none was written
+    """
+    if config.download is None or config.download.platform != Platforms.SENTINEL:
+        return None
+    scenes = sorted(project_scenes(config), key=lambda scene: scene.start)
+    if len(scenes) < 2 or not config.system.orbits_dir.is_dir():
+        return None
+
+    index = OrbitIndex(config.system.orbits_dir)
+    try:
+        baselines = index.vectors.baselines(index, scenes[0], scenes)
+    except (LookupError, ValueError) as e:
+        print(f"[bold yellow]Skipping the baselines: {e}[/bold yellow]")
+        return None
+
+    jobfiles_dir.mkdir(parents=True, exist_ok=True)
+    path = jobfiles_dir / BASELINES_NAME
+    perpendicular = baselines.perpendicular()
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["scene", "along_m", "cross_m", "radial_m", "perpendicular_m"])
+        for row in zip(baselines.names, baselines.along, baselines.cross, baselines.radial, perpendicular):
+            writer.writerow([row[0], *(f"{value:.3f}" for value in row[1:])])
+    print(f"[bold]Baselines[/bold]:         {len(scenes)} scenes relative to {scenes[0].name}, "
+          f"perpendicular {perpendicular.min():.1f} to {perpendicular.max():.1f} m")
+    return path
+
+
+def write_jobfiles(config: ProjectConfig):
+    """Write the baselines of the stack and pack the tasks of every run_NN_* file into one job array per stage"""
+    jobfiles_config = config.jobfiles
+    if jobfiles_config is None:
+        print("[bold yellow]No jobfiles config given, skipping job array generation[/bold yellow]")
+        return
+
+    work_dir = config.system.work_dir / config.project_name
+    run_files_dir = work_dir / jobfiles_config.run_files_dir
+    jobfiles_dir = work_dir / jobfiles_config.jobfiles_dir
+    write_baselines(config, jobfiles_dir)
+
+    if not run_files_dir.is_dir():
+        print(f"[bold yellow]No run files in {run_files_dir}, skipping job array generation[/bold yellow]")
+        return
+
+    print(f"[bold green]{'='*60}[/bold green]")
+    print("[bold green]JOB FILES[/bold green]")
+    print(f"[bold green]{'='*60}[/bold green]")
+    print(f"[bold]Run files[/bold]:         {run_files_dir}")
+    print(f"[bold]Job files[/bold]:         {jobfiles_dir}")
+    print(f"[bold]Partition[/bold]:         {config.system.slurm_partition}")
+    print(f"[bold]Max parallel jobs[/bold]: {config.system.max_parallel_jobs}")
+
+    try:
+        jobs = write_job_arrays(
+            run_files_dir,
+            jobfiles_dir,
+            partition=config.system.slurm_partition,
+            max_parallel_jobs=config.system.max_parallel_jobs,
+            max_walltime=jobfiles_config.max_walltime,
+            max_array_size=jobfiles_config.max_array_size,
+            overrides=jobfiles_config.stage_estimates,
+        )
+    except OSError as e:
+        print(f"[bold red]ERROR writing job files: {e}[/bold red]")
+        sys.exit(1)
+
+    for job in jobs:
+        print(f"  - [bold cyan]{job.name}[/bold cyan]: {job.tasks} tasks in {job.packs} array elements")
+    print(f"[bold green]Wrote {len(jobs)} job arrays[/bold green]")
@@ -0,0 +1,262 @@
+import os
+import time
+import signal
+import shutil
+import threading
+import subprocess
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from .slurm import StageJob, read_run_file
+
+POLL_INTERVAL = 0.1
+# seconds a stopped task has to exit before its process group is killed
+TERMINATE_TIMEOUT = 10
+
+
+@dataclass(eq=False)
+class LocalTask:
+    stage: str
+    index: int
+    command: str
+    cpus: int
+    memory: int
+    attempts: int = 0
+
+
+class TaskError(Exception):
+    """A task still failed after its retries"""
+
+    def __init__(self, task: LocalTask, returncode: int, log_path: Path):
+        super().__init__(f"{task.stage}[{task.index}] exited with {returncode} after {task.attempts} attempts, see {log_path}")
+        self.task = task
+        self.returncode = returncode
+        self.log_path = log_path
+
+
+class StageCancelled(Exception):
+    """The run was cancelled while a stage was running, its tasks were stopped"""
+
+    def __init__(self, stage: str):
+        super().__init__(f"{stage} cancelled")
+        self.stage = stage
+
+
+def signal_group(process: subprocess.Popen, signum: int):
+    """Send signum to the process group of a task, the commands started by its shell included"""
+    try:
+        os.killpg(process.pid, signum)
+    except ProcessLookupError:
+        # the group already exited
+        pass
+
+
+def terminate(processes: List[subprocess.Popen], timeout: float = TERMINATE_TIMEOUT):
+    """Stop the process groups of tasks, killing the ones still running after timeout"""
+    for process in processes:
+        signal_group(process, signal.SIGTERM)
+    deadline = time.monotonic() + timeout
+    for process in processes:
+        try:
+            process.wait(max(0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            pass
+        # children of the shell may outlive it
+        signal_group(process, signal.SIGKILL)
+        process.wait()
+
+
+def available_cpus() -> int:
+    return len(os.sched_getaffinity(0))
+
+
+def available_memory() -> int:
+    """Physical memory in MB"""
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 1024**2
+
+
+class ResourceBudget:
+    """
+    Jobs, CPUs and memory shared by the local executors of a run.
+
+    Several projects processed in one run share a single budget, so their
+    stages run side by side without oversubscribing the machine.
+
+    Args:
+        max_parallel_jobs: Maximum running tasks
+        cpus: CPUs available to the tasks
+        memory: Memory in MB available to the tasks
+    """
+
+    def __init__(self, max_parallel_jobs: int, cpus: Optional[int] = None, memory: Optional[int] = None):
+        self.max_parallel_jobs = max(1, max_parallel_jobs)
+        self.cpus = cpus or available_cpus()
+        self.memory = memory or available_memory()
+        self.running = 0
+        self.free_cpus = self.cpus
+        self.free_memory = self.memory
+        self._lock = threading.Lock()
+
+    def try_acquire(self, cpus: int, memory: int) -> bool:
+        with self._lock:
+            if self.running >= self.max_parallel_jobs:
+                return False
+            # a task larger than the machine still runs, alone
+            if self.running and (cpus > self.free_cpus or memory > self.free_memory):
+                return False
+            self.running += 1
+            self.free_cpus -= cpus
+            self.free_memory -= memory
+            return True
+
+    def release(self, cpus: int, memory: int):
+        with self._lock:
+            self.running -= 1
+            self.free_cpus += cpus
+            self.free_memory += memory
+
+
+class LocalExecutor:
+    """
+    Run the tasks of the generated job arrays on this machine.
+
+    A task starts only when max_parallel_jobs, the free CPUs and the free
+    memory all allow its declared needs, so large tasks are not starved by
+    small ones and the machine is not oversubscribed. Each task runs in its
+    own process group with TMPDIR pointing to a private directory of
+    scratch_dir, which is removed once the task succeeded. Interrupting the
+    run, or setting cancel, stops the whole group of each running task. Failed tasks are queued again
+    up to retries times, a task failing for good stops the run once the
+    running tasks finished.
+
+    Args:
+        scratch_dir: Root of the per-task temporary directories
+        log_dir: Directory for the per-task logs
+        max_parallel_jobs: Maximum running tasks
+        cpus: CPUs available to the tasks
+        memory: Memory in MB available to the tasks
+        retries: Extra attempts of a failed task
+        cwd: Working directory of the tasks
+        budget: Budget shared with other executors, replaces max_parallel_jobs, cpus and memory
+        cancel: Event stopping the running tasks once set, the tasks run in
+            their own sessions and do not get the SIGINT of Ctrl-C
+    """
+
+    def __init__(
+        self,
+        scratch_dir: Path,
+        log_dir: Path,
+        max_parallel_jobs: int,
+        cpus: Optional[int] = None,
+        memory: Optional[int] = None,
+        retries: int = 2,
+        cwd: Optional[Path] = None,
+        budget: Optional[ResourceBudget] = None,
+        cancel: Optional[threading.Event] = None,
+    ):
+        self.scratch_dir = scratch_dir
+        self.log_dir = log_dir
+        self.budget = budget or ResourceBudget(max_parallel_jobs, cpus, memory)
+        self.retries = retries
+        self.cwd = cwd
+        self.cancel = cancel or threading.Event()
+
+    @property
+    def max_parallel_jobs(self) -> int:
+        return self.budget.max_parallel_jobs
+
+    @property
+    def cpus(self) -> int:
+        return self.budget.cpus
+
+    @property
+    def memory(self) -> int:
+        return self.budget.memory
+
+    def _log_path(self, task: LocalTask) -> Path:
+        return self.log_dir / f"{task.stage}_{task.index}.log"
+
+    def _task_dir(self, task: LocalTask) -> Path:
+        return self.scratch_dir / task.stage / str(task.index)
+
+    def _start(self, task: LocalTask) -> subprocess.Popen:
+        task.attempts += 1
+        tmp_dir = self._task_dir(task)
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        env = {
+            **os.environ,
+            "TMPDIR": str(tmp_dir),
+            "OMP_NUM_THREADS": str(task.cpus),
+        }
+        with open(self._log_path(task), "a") as log:
+            log.write(f"# attempt {task.attempts}: {task.command}\n")
+            log.flush()
+            return subprocess.Popen(
+                ["bash", "-e", "-c", task.command],
+                cwd=self.cwd,
+                env=env,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                start_new_session=True,
+            )
+
+    def run_stage(self, job: StageJob, on_progress: Optional[Callable[[str, int, int], None]] = None):
+        """
+        Run every task of a stage, returns when all of them succeeded.
+
+        Raises:
+            TaskError: A task failed more than retries times
+            StageCancelled: cancel was set, the running tasks were stopped
+        """
+        commands = read_run_file(Path(job.tasks_file))
+        pending = [LocalTask(job.name, i, command, job.cpus, job.memory) for i, command in enumerate(commands)]
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+
+        running = {}
+        completed = 0
+        failure = None
+        try:
+            while running or (pending and failure is None):
+                if self.cancel.is_set():
+                    raise StageCancelled(job.name)
+                # start tasks in order while they fit
+                while pending and failure is None and self.budget.try_acquire(pending[0].cpus, pending[0].memory):
+                    task = pending.pop(0)
+                    try:
+                        running[task] = self._start(task)
+                    except BaseException:
+                        self.budget.release(task.cpus, task.memory)
+                        raise
+
+                time.sleep(POLL_INTERVAL)
+                for task, process in list(running.items()):
+                    returncode = process.poll()
+                    if returncode is None:
+                        continue
+                    del running[task]
+                    self.budget.release(task.cpus, task.memory)
+
+                    if returncode == 0:
+                        shutil.rmtree(self._task_dir(task), ignore_errors=True)
+                        completed += 1
+                        if on_progress is not None:
+                            on_progress(job.name, completed, len(commands))
+                    elif task.attempts <= self.retries:
+                        pending.append(task)
+                    elif failure is None:
+                        failure = TaskError(task, returncode, self._log_path(task))
+        except BaseException:
+            terminate(list(running.values()))
+            for task in running:
+                self.budget.release(task.cpus, task.memory)
+            raise
+
+        if failure is not None:
+            raise failure
+        shutil.rmtree(self.scratch_dir / job.name, ignore_errors=True)
+
+    def run(self, jobs: List[StageJob], on_progress: Optional[Callable[[str, int, int], None]] = None):
+        """Run the stages one after the other"""
+        for job in jobs:
+            self.run_stage(job, on_progress)
@@ -0,0 +1,302 @@
+import os
+import re
+import fcntl
+import bisect
+import time
+import tempfile
+import threading
+import multiprocessing
+import datetime
+from pathlib import Path
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+from xml.etree import ElementTree
+
+from s1_orbits import fetch_for_scene
+from s1_orbits import s1_orbits as orbit_api
+
+from .. import telemetry
+from ..download.engine import url_host
+from .local import available_cpus
+from .state_vectors import StateVectorStore
+
+EOF_PATTERN = re.compile(
+    r"^(?P<mission>S1[A-D])_OPER_AUX_(?P<type>POEORB|RESORB)_OPOD_\d{8}T\d{6}_V(?P<start>\d{8}T\d{6})_(?P<end>\d{8}T\d{6})\.EOF$"
+)
+SCENE_PATTERN = re.compile(r"^(?P<mission>S1[A-D])_.*?_(?P<start>\d{8}T\d{6})_(?P<end>\d{8}T\d{6})_")
+TIME_FORMAT = "%Y%m%dT%H%M%S"
+
+# orbit files must cover the scene with some slack on both sides
+COVERAGE_MARGIN = datetime.timedelta(seconds=60)
+# longest validity window of an orbit file, bounds the backwards scan of a lookup
+MAX_VALIDITY = datetime.timedelta(days=2)
+# precise orbits win over restituted ones
+TYPE_PRIORITY = {"POEORB": 0, "RESORB": 1}
+# concurrent fetches from the orbit service, each fetch is a couple of small requests
+ORBIT_HOST_LIMIT = 16
+# processes converting EOF files to binary state vectors after a fetch
+CONVERT_WORKERS = 4
+
+
+@dataclass(order=True)
+class OrbitFile:
+    start: datetime.datetime
+    end: datetime.datetime
+    orbit_type: str = field(compare=False)
+    path: Path = field(compare=False)
+
+    @classmethod
+    def from_path(cls, path: Path) -> Optional["OrbitFile"]:
+        match = EOF_PATTERN.match(path.name)
+        if match is None:
+            return None
+        return cls(
+            start=datetime.datetime.strptime(match["start"], TIME_FORMAT),
+            end=datetime.datetime.strptime(match["end"], TIME_FORMAT),
+            orbit_type=match["type"],
+            path=path,
+        )
+
+
+@dataclass
+class Scene:
+    name: str
+    mission: str
+    start: datetime.datetime
+    end: datetime.datetime
+
+    @classmethod
+    def from_name(cls, name: str) -> Optional["Scene"]:
+        match = SCENE_PATTERN.match(name)
+        if match is None:
+            return None
+        return cls(
+            name=name,
+            mission=match["mission"],
+            start=datetime.datetime.strptime(match["start"], TIME_FORMAT),
+            end=datetime.datetime.strptime(match["end"], TIME_FORMAT),
+        )
+
+    @property
+    def group_key(self) -> tuple:
+        """Scenes of the same mission and day share one orbit file"""
+        return self.mission, self.start.date()
+
+
+class OrbitIndex:
+    """
+    Sorted per-mission index of the EOF files in an orbits directory.
+
+    Lookups bisect on the validity start, so resolving a scene is O(log n).
+    Files fetched while the index is alive are added with add(). The binary
+    state vectors of the indexed files live in vectors, the orbit step
+    converts each file it resolved in a worker process as soon as it is
+    fetched.
+    """
+
+    def __init__(self, orbits_dir: Path):
+        self.orbits_dir = orbits_dir
+        self.vectors = StateVectorStore(orbits_dir)
+        self._entries: Dict[str, List[OrbitFile]] = {}
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        """Rescan orbits_dir, picking up files written by other jobs"""
+        entries: Dict[str, List[OrbitFile]] = {}
+        with os.scandir(self.orbits_dir) as it:
+            for dir_entry in it:
+                orbit = OrbitFile.from_path(Path(dir_entry.path))
+                if orbit is not None:
+                    entries.setdefault(dir_entry.name[:3], []).append(orbit)
+        for orbits in entries.values():
+            orbits.sort()
+        with self._lock:
+            self._entries = entries
+
+    def add(self, path: Path) -> Optional[OrbitFile]:
+        orbit = OrbitFile.from_path(path)
+        if orbit is None:
+            return None
+        with self._lock:
+            orbits = self._entries.setdefault(path.name[:3], [])
+            if not any(o.path == orbit.path for o in orbits):
+                bisect.insort(orbits, orbit)
+        return orbit
+
+    def __len__(self):
+        return sum(len(orbits) for orbits in self._entries.values())
+
+    def lookup(self, scene: Scene) -> Optional[Path]:
+        """Return the best local orbit file covering the scene, or None"""
+        start = scene.start - COVERAGE_MARGIN
+        end = scene.end + COVERAGE_MARGIN
+        with self._lock:
+            orbits = self._entries.get(scene.mission, [])
+            # only files starting before the scene can cover it
+            position = bisect.bisect_right(orbits, OrbitFile(start, start, "", Path()))
+            best = None
+            for i in range(position - 1, -1, -1):
+                orbit = orbits[i]
+                if orbit.start < start - MAX_VALIDITY:
+                    break
+                if orbit.end < end:
+                    continue
+                if best is None or TYPE_PRIORITY[orbit.orbit_type] < TYPE_PRIORITY[best.orbit_type]:
+                    best = orbit
+        return best.path if best else None
+
+
+@contextmanager
+def store_lock(orbits_dir: Path, key: str):
+    """
+    Inter-process lock so concurrent jobs never fetch the same orbit twice.
+
+    Yields the lock file opened for appending, fetches record the EOF names
+    they wrote in it so the next holder finds them without a rescan.
+    """
+    lock_dir = orbits_dir / ".locks"
+    lock_dir.mkdir(exist_ok=True)
+    with open(lock_dir / f"{key}.lock", "a+") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield lock_file
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def orbit_host() -> str:
+    """Host of the orbit service, read on each call so it can be pointed elsewhere"""
+    return url_host(orbit_api.API_URL)
+
+
+def fetch_into_store(index: OrbitIndex, scene: Scene, engine=None) -> Path:
+    """
+    Fetch the orbit file of a scene into the shared store.
+
+    The file is written to a private temporary directory and renamed into
+    place, so other jobs never see a partial EOF. Files fetched by other
+    jobs for the same mission and day are read from the lock file and
+    added to index, the directory is only scanned when index is built.
+    With a TransferEngine the fetch waits for a slot of the orbit service.
+    """
+    mission, day = scene.group_key
+    with store_lock(index.orbits_dir, f"{mission}_{day:%Y%m%d}") as lock_file:
+        # another job may have fetched it while we waited for the lock
+        lock_file.seek(0)
+        for name in lock_file.read().split():
+            if (index.orbits_dir / name).exists():
+                index.add(index.orbits_dir / name)
+        path = index.lookup(scene)
+        if path is not None:
+            return path
+
+        with tempfile.TemporaryDirectory(dir=index.orbits_dir, prefix=".fetch_") as tmp_dir:
+            started = time.perf_counter()
+            with engine.slot(orbit_host()) if engine is not None else nullcontext():
+                with telemetry.span("orbit.fetch", scene=scene.name):
+                    tmp_path = fetch_for_scene(scene.name, tmp_dir)
+            telemetry.observe("orbit.fetch_latency", time.perf_counter() - started)
+            path = index.orbits_dir / tmp_path.name
+            os.replace(tmp_path, path)
+        lock_file.write(f"{path.name}\n")
+        index.add(path)
+        return path
+
+
+def convert_vectors(orbits_dir: Path, path: Path) -> bool:
+    """Make sure the binary state vectors of an EOF exist, False for a broken EOF, which is left to ISCE"""
+    try:
+        StateVectorStore(orbits_dir).ensure(path)
+    except (ElementTree.ParseError, ValueError):
+        telemetry.count("orbit.convert_errors")
+        return False
+    return True
+
+
+class VectorConverter:
+    """
+    Convert resolved EOF files to binary state vectors in worker processes.
+
+    The XML parse holds the GIL, in worker processes it never slows down the
+    transfers still running in this one. Files with current vectors or
+    already submitted are skipped, the workers start with the first file
+    that needs converting.
+
+    Args:
+        index: OrbitIndex of the orbits directory
+        workers: Worker processes, at most one per available CPU
+    """
+
+    def __init__(self, index: OrbitIndex, workers: int = CONVERT_WORKERS):
+        self.index = index
+        self.workers = max(1, min(workers, available_cpus()))
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._futures = []
+        self._submitted = set()
+        self._lock = threading.Lock()
+
+    def submit(self, paths: Iterable[Optional[Path]]):
+        """Queue the conversion of EOF files, None entries (unresolved scenes) are ignored"""
+        with self._lock:
+            for path in paths:
+                if path is None or path in self._submitted or self.index.vectors.is_current(path):
+                    continue
+                self._submitted.add(path)
+                if self._pool is None:
+                    # workers forked from a clean server process, not from this threaded one
+                    context = multiprocessing.get_context("forkserver")
+                    self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                self._futures.append(self._pool.submit(convert_vectors, self.index.orbits_dir, path))
+
+    def close(self) -> int:
+        """Wait for the queued conversions, returns the number of EOF files converted"""
+        with self._lock:
+            pool, futures = self._pool, self._futures
+            self._pool, self._futures = None, []
+        if pool is None:
+            return 0
+        with telemetry.span("orbit.vectors", files=len(futures)):
+            pool.shutdown(wait=True)
+        converted = sum(future.result() for future in futures)
+        # the counters of the workers stay in their processes
+        telemetry.count("orbit.converted", converted)
+        telemetry.count("orbit.convert_errors", len(futures) - converted)
+        return len(futures)
+
+    def __enter__(self) -> "VectorConverter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def group_missing(scenes: List[Scene]) -> Dict[tuple, List[Scene]]:
+    """Group scenes that should share an orbit file"""
+    groups: Dict[tuple, List[Scene]] = {}
+    for scene in scenes:
+        groups.setdefault(scene.group_key, []).append(scene)
+    return groups
+
+
+def resolve_group(index: OrbitIndex, scenes: List[Scene], engine=None) -> Dict[str, Path]:
+    """
+    Resolve every scene of a group while fetching as few EOF files as possible.
+
+    The first unresolved scene is fetched and the index is consulted again for
+    the rest, scenes near a day boundary may still need a file of their own.
+    """
+    return {scene.name: resolve_scene(index, scene, engine) for scene in scenes}
+
+
+def resolve_scene(index: OrbitIndex, scene: Scene, engine=None) -> Path:
+    """Return the local orbit file of a scene, fetching it (through engine when given) when missing"""
+    path = index.lookup(scene)
+    if path is None:
+        telemetry.count("orbit.fetches")
+        path = fetch_into_store(index, scene, engine)
+    else:
+        telemetry.count("orbit.local_hits")
+    return path
@@ -0,0 +1,323 @@
+import re
+import json
+import math
+import shlex
+import time
+import threading
+import subprocess
+from pathlib import Path
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional
+
+# (minutes, MB, cpus) per task of the ISCE topsStack stages, matched on the run file name
+STAGE_ESTIMATES = {
+    "unpack_topo_reference": (30, 8000, 4),
+    "unpack_secondary_slc": (10, 4000, 1),
+    "average_baseline": (2, 1000, 1),
+    "extract_burst_overlaps": (5, 2000, 1),
+    "overlap_geo2rdr": (5, 4000, 1),
+    "overlap_resample": (5, 4000, 1),
+    "pairs_misreg": (5, 2000, 1),
+    "timeseries_misreg": (2, 1000, 1),
+    "fullBurst_geo2rdr": (15, 4000, 2),
+    "fullBurst_resample": (15, 4000, 2),
+    "extract_stack_valid_region": (5, 2000, 1),
+    "merge_reference_secondary_slc": (10, 4000, 1),
+    "generate_burst_igram": (10, 4000, 1),
+    "merge_burst_igram": (5, 4000, 1),
+    "filter_coherence": (5, 4000, 1),
+    "unwrap": (30, 8000, 2),
+}
+DEFAULT_ESTIMATE = (10, 4000, 1)
+
+# requested walltime is the packed runtime with some slack
+WALLTIME_FACTOR = 1.5
+RUN_FILE_PATTERN = re.compile(r"^run_\d+_.+")
+MANIFEST_NAME = "jobs.json"
+
+
+@dataclass
+class Pack:
+    """Tasks executed one after another by a single array element"""
+    tasks: List[str] = field(default_factory=list)
+    minutes: float = 0
+    memory: int = 0
+
+
+@dataclass
+class Stage:
+    name: str
+    tasks: List[str]
+    minutes: float
+    memory: int
+    cpus: int = 1
+
+
+@dataclass
+class StageJob:
+    """Job array written for a stage, as stored in the manifest"""
+    name: str
+    script: str
+    tasks_file: str
+    tasks: int
+    packs: int
+    done_dir: str
+    memory: int
+    cpus: int
+
+
+def read_run_file(path: Path) -> List[str]:
+    """Every non-empty, non-comment line of a run file is an independent task"""
+    tasks = []
+    for line in path.read_text().splitlines():
+        line = line.strip()
+        if line and not line.startswith("#"):
+            tasks.append(line)
+    return tasks
+
+
+def stage_estimate(name: str, overrides: Optional[Dict[str, tuple]] = None) -> tuple:
+    """Return (minutes, memory MB, cpus) per task for a run file name"""
+    for table in (overrides or {}, STAGE_ESTIMATES):
+        for key, estimate in table.items():
+            if key in name:
+                # cpus may be left out of the overrides
+                return (*estimate, *DEFAULT_ESTIMATE[len(estimate):])
+    return DEFAULT_ESTIMATE
+
+
+def load_stages(run_files_dir: Path, overrides: Optional[Dict[str, tuple]] = None) -> List[Stage]:
+    """Read the run_NN_* files in execution order"""
+    stages = []
+    for path in sorted(run_files_dir.iterdir()):
+        if not path.is_file() or not RUN_FILE_PATTERN.match(path.name) or path.suffix:
+            continue
+        tasks = read_run_file(path)
+        if not tasks:
+            continue
+        minutes, memory, cpus = stage_estimate(path.name, overrides)
+        stages.append(Stage(path.name, tasks, minutes, memory, int(cpus)))
+    return stages
+
+
+def pack_tasks(tasks: List[str], minutes: float, memory: int, max_minutes: float, max_packs: int) -> List[Pack]:
+    """
+    Pack tasks into as few array elements as the walltime allows.
+
+    Tasks of a stage share one estimate, so packing reduces to filling each
+    element up to max_minutes. The tasks are then spread evenly over the
+    elements so no element ends up much longer than the others. If that
+    would exceed max_packs elements, tasks are packed tighter and the
+    walltime of each element grows instead.
+
+    Only the runtime is balanced: the tasks of an element run one after
+    the other, so every element requests the memory of a single task,
+    whatever the number of tasks packed into it.
+
+    Args:
+        tasks: Commands of the stage
+        minutes: Estimated runtime of one task
+        memory: Estimated memory (MB) of one task, requested by each element as is
+        max_minutes: Walltime budget of one array element
+        max_packs: Maximum number of array elements
+
+    Returns:
+        List of packs, in task order
+    """
+    if not tasks:
+        return []
+    per_pack = max(1, math.floor(max_minutes / minutes)) if minutes > 0 else len(tasks)
+    n_packs = min(max(1, max_packs), math.ceil(len(tasks) / per_pack))
+
+    packs = []
+    size, extra = divmod(len(tasks), n_packs)
+    start = 0
+    for i in range(n_packs):
+        stop = start + size + (1 if i < extra else 0)
+        chunk = tasks[start:stop]
+        packs.append(Pack(chunk, minutes * len(chunk), memory))
+        start = stop
+    return packs
+
+
+def format_walltime(minutes: float) -> str:
+    minutes = max(1, math.ceil(minutes * WALLTIME_FACTOR))
+    return f"{minutes // 60:02d}:{minutes % 60:02d}:00"
+
+
+def write_stage_job(stage: Stage, packs: List[Pack], jobfiles_dir: Path, partition: str, max_parallel_jobs: int) -> StageJob:
+    """
+    Write the task list and the sbatch array script of a stage.
+
+    The packed tasks are written contiguously to <stage>.tasks, and each
+    array element runs its line range with bash -e, so a failing task fails
+    its element. Successful elements leave a marker in <stage>.done so the
+    submitter can tell a completed stage from a cancelled one.
+    """
+    tasks_path = jobfiles_dir / f"{stage.name}.tasks"
+    script_path = jobfiles_dir / f"{stage.name}.job"
+    done_dir = jobfiles_dir / f"{stage.name}.done"
+
+    ranges = []
+    line = 1
+    with open(tasks_path, "w") as f:
+        for pack in packs:
+            f.writelines(f"{task}\n" for task in pack.tasks)
+            ranges.append(f"{line}:{line + len(pack.tasks) - 1}")
+            line += len(pack.tasks)
+
+    walltime = format_walltime(max(pack.minutes for pack in packs))
+    memory = max(pack.memory for pack in packs)
+    throttle = f"%{max_parallel_jobs}" if max_parallel_jobs > 0 else ""
+
+    script_path.write_text(f"""#!/bin/bash
+#SBATCH --job-name={stage.name}
+#SBATCH --partition={partition}
+#SBATCH --array=0-{len(packs) - 1}{throttle}
+#SBATCH --time={walltime}
+#SBATCH --mem={memory}M
+#SBATCH --cpus-per-task={stage.cpus}
+#SBATCH --output={jobfiles_dir}/{stage.name}_%A_%a.o
+#SBATCH --error={jobfiles_dir}/{stage.name}_%A_%a.e
+
+# {len(stage.tasks)} tasks packed into {len(packs)} array elements
+RANGES=({' '.join(ranges)})
+RANGE=${{RANGES[$SLURM_ARRAY_TASK_ID]}}
+
+bash -e <(sed -n "${{RANGE%:*}},${{RANGE#*:}}p" {shlex.quote(str(tasks_path))}) || exit 1
+mkdir -p {shlex.quote(str(done_dir))}
+touch {shlex.quote(str(done_dir))}/$SLURM_ARRAY_TASK_ID
+""")
+    script_path.chmod(0o755)
+    return StageJob(
+        name=stage.name,
+        script=str(script_path),
+        tasks_file=str(tasks_path),
+        tasks=len(stage.tasks),
+        packs=len(packs),
+        done_dir=str(done_dir),
+        memory=memory,
+        cpus=stage.cpus,
+    )
+
+
+def write_job_arrays(
+    run_files_dir: Path,
+    jobfiles_dir: Path,
+    partition: str,
+    max_parallel_jobs: int,
+    max_walltime: float,
+    max_array_size: int,
+    overrides: Optional[Dict[str, tuple]] = None,
+) -> List[StageJob]:
+    """
+    Write one Slurm job array per run file and a manifest listing them in order.
+
+    Returns:
+        The stage jobs, in execution order
+    """
+    jobfiles_dir.mkdir(parents=True, exist_ok=True)
+    jobs = []
+    for stage in load_stages(run_files_dir, overrides):
+        packs = pack_tasks(stage.tasks, stage.minutes, stage.memory, max_walltime, max_array_size)
+        jobs.append(write_stage_job(stage, packs, jobfiles_dir, partition, max_parallel_jobs))
+
+    (jobfiles_dir / MANIFEST_NAME).write_text(json.dumps([asdict(job) for job in jobs], indent=1))
+    return jobs
+
+
+def load_job_arrays(jobfiles_dir: Path) -> List[StageJob]:
+    manifest = jobfiles_dir / MANIFEST_NAME
+    if not manifest.exists():
+        raise FileNotFoundError(f"No {MANIFEST_NAME} in {jobfiles_dir}, run the jobfiles step first")
+    return [StageJob(**job) for job in json.loads(manifest.read_text())]
+
+
+def submit_job_arrays(jobs: List[StageJob], sbatch_command: str = "sbatch") -> List[str]:
+    """
+    Submit the stages as a dependency chain, each stage starting after the previous one succeeded.
+
+    Returns:
+        Slurm job ids, in stage order
+    """
+    job_ids = []
+    for job in jobs:
+        # markers of a previous submission must not count for this one
+        for marker in Path(job.done_dir).glob("*"):
+            marker.unlink()
+
+        cmd = [*shlex.split(sbatch_command), "--parsable", "--kill-on-invalid-dep=yes"]
+        if job_ids:
+            cmd.append(f"--dependency=afterok:{job_ids[-1]}")
+        cmd.append(job.script)
+        output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+        # --parsable prints "jobid" or "jobid;cluster"
+        job_ids.append(output.strip().split(";")[0])
+    return job_ids
+
+
+def pending_jobs(job_ids: List[str], squeue_command: str = "squeue") -> set:
+    """
+    Return the submitted job ids that still have queued or running elements.
+
+    Jobs that finished a while ago are purged by the controller and squeue
+    refuses them as invalid, they count as finished.
+    """
+    if not job_ids:
+        return set()
+    cmd = [*shlex.split(squeue_command), "--noheader", "--format=%i", f"--jobs={','.join(job_ids)}"]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        if "Invalid job id" not in result.stderr:
+            raise subprocess.CalledProcessError(result.returncode, cmd, result.stdout, result.stderr)
+        if len(job_ids) == 1:
+            return set()
+        # tell the purged jobs from the others
+        return set().union(*(pending_jobs([job_id], squeue_command) for job_id in job_ids))
+    # array elements are listed as <jobid>_<index> or <jobid>_[<range>]
+    return {line.strip().split("_")[0] for line in result.stdout.splitlines() if line.strip()}
+
+
+def cancel_jobs(job_ids: List[str], scancel_command: str = "scancel"):
+    """Cancel the submitted jobs, the elements still queued included"""
+    if job_ids:
+        subprocess.run([*shlex.split(scancel_command), *job_ids], check=True, capture_output=True, text=True)
+
+
+def wait_for_jobs(
+    job_ids: List[str],
+    squeue_command: str = "squeue",
+    poll_interval: float = 30,
+    on_update=None,
+    cancel: Optional[threading.Event] = None,
+    scancel_command: str = "scancel",
+) -> set:
+    """
+    Poll squeue until none of the jobs is queued or running.
+
+    Once cancel is set the jobs still pending are cancelled with scancel.
+
+    Returns:
+        Job ids that were cancelled, empty when every job finished
+    """
+    cancel = cancel or threading.Event()
+    while True:
+        pending = pending_jobs(job_ids, squeue_command)
+        if on_update is not None:
+            on_update(pending)
+        if not pending:
+            return set()
+        if cancel.wait(poll_interval):
+            cancel_jobs(sorted(pending), scancel_command)
+            return pending
+
+
+def failed_stages(jobs: List[StageJob]) -> List[StageJob]:
+    """Stages with array elements that left no completion marker"""
+    failed = []
+    for job in jobs:
+        done = Path(job.done_dir)
+        completed = len(list(done.iterdir())) if done.is_dir() else 0
+        if completed < job.packs:
+            failed.append(job)
+    return failed
@@ -0,0 +1,113 @@
+import os
+import json
+import fcntl
+import hashlib
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Iterable, Optional
+
+JOURNAL_VERSION = 1
+# files that are still being written never count as outputs
+IGNORED_SUFFIXES = (".part", ".tmp", ".lock")
+
+
+def fingerprint(value) -> str:
+    """Stable digest of a JSON-like value (config sections, manifests)"""
+    data = json.dumps(value, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def manifest(paths: Iterable[Path]) -> dict:
+    """
+    Cheap manifest of files and directories: size and mtime, never content.
+
+    Directories are listed one level deep, sub-directories contribute their
+    own mtime, which changes whenever an entry is added or removed.
+    """
+    entries = {}
+    for path in paths:
+        path = Path(path)
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            entries[str(path)] = None
+            continue
+        if not path.is_dir():
+            entries[str(path)] = [stat.st_size, stat.st_mtime_ns]
+            continue
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name.startswith(".") or entry.name.endswith(IGNORED_SUFFIXES):
+                    continue
+                entry_stat = entry.stat()
+                size = 0 if entry.is_dir() else entry_stat.st_size
+                entries[entry.path] = [size, entry_stat.st_mtime_ns]
+    return entries
+
+
+class RunJournal:
+    """
+    Per-project record of the steps that completed and what they were run with.
+
+    Each step stores the fingerprint of its inputs (config sections and
+    manifests of the upstream files it reads) and the manifest of its
+    outputs. A step is current when both still match, which only costs a
+    few stat calls. Updates are merged under an exclusive flock, so steps
+    finishing concurrently do not lose each other's records.
+
+    Args:
+        path: Journal file, usually <work_dir>/<project>/.insarchitect/journal.json
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def for_project(cls, config) -> "RunJournal":
+        return cls(config.system.work_dir / config.project_name / ".insarchitect" / "journal.json")
+
+    @contextmanager
+    def _lock(self):
+        with open(self.path.with_suffix(".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self) -> dict:
+        try:
+            data = json.loads(self.path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        if data.get("version") != JOURNAL_VERSION:
+            return {}
+        return data.get("steps", {})
+
+    def _write(self, steps: dict):
+        tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps({"version": JOURNAL_VERSION, "steps": steps}, indent=1))
+        os.replace(tmp_path, self.path)
+
+    def entry(self, step: str) -> Optional[dict]:
+        return self._read().get(step)
+
+    def is_current(self, step: str, inputs: str, outputs: Iterable[Path]) -> bool:
+        """True when the step last completed with these inputs and its outputs are untouched"""
+        entry = self.entry(step)
+        if entry is None or entry["inputs"] != inputs:
+            return False
+        return entry["outputs"] == fingerprint(manifest(outputs))
+
+    def record(self, step: str, inputs: str, outputs: Iterable[Path]):
+        with self._lock():
+            steps = self._read()
+            steps[step] = {"inputs": inputs, "outputs": fingerprint(manifest(outputs))}
+            self._write(steps)
+
+    def invalidate(self, step: str):
+        with self._lock():
+            steps = self._read()
+            if steps.pop(step, None) is not None:
+                self._write(steps)
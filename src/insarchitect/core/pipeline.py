@@ -0,0 +1,514 @@
+import hashlib
+import functools
+import threading
+from collections import deque
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from rich import print
+from rich.progress import Progress
+
+from ..models import ProjectConfig
+from . import telemetry
+from .journal import RunJournal, fingerprint, manifest
+
+# execution order of the user facing steps
+STEP_ORDER = ["download", "dem", "jobfiles", "isce"]
+
+STEP_DESCRIPTIONS = {
+    "download": "Download step",
+    "dem": "DEM processing step",
+    "jobfiles": "Job files generation (orbits and Slurm job arrays)",
+    "isce": "ISCE processing step (job arrays on Slurm or locally)",
+}
+
+# concurrent tasks allowed per pool, downloads use DownloadConfig.parallel_downloads
+DEFAULT_POOL_LIMITS = {
+    "default": 2,
+    "search": 4,
+    "orbit": 16,
+    "extract": 4,
+    "dem": 1,
+    # tasks waiting for the moves of staged downloads, as many as staging.MOVERS
+    "staging": 2,
+}
+
+
+@dataclass
+class Task:
+    name: str
+    func: Callable[[], Any]
+    deps: Tuple[str, ...] = ()
+    pool: str = "default"
+
+
+class TaskFailed(Exception):
+    """Raised by Scheduler.run when a task raised"""
+
+    def __init__(self, task: str, error: BaseException):
+        super().__init__(f"{task}: {error!r}")
+        self.task = task
+        self.error = error
+
+
+class Scheduler:
+    """
+    Run a DAG of tasks on a thread pool as soon as their dependencies finish.
+
+    Each task belongs to a pool with its own concurrency limit. Tasks may add
+    new tasks while running (e.g. the search adds one download per product),
+    and a task may depend on a task that has not been added yet. When a task
+    fails nothing new is started, the cancel event is set for cooperative
+    tasks, and run() raises TaskFailed.
+
+    Args:
+        pool_limits: Maximum running tasks per pool name
+    """
+
+    def __init__(self, pool_limits: Dict[str, int]):
+        self.pool_limits = {**DEFAULT_POOL_LIMITS, **pool_limits}
+        self.cancel = threading.Event()
+        self.results: Dict[str, Any] = {}
+
+        self._cond = threading.Condition()
+        self._tasks: Dict[str, Task] = {}
+        self._waiting: Dict[str, set] = {}
+        self._dependents: Dict[str, list] = {}
+        self._ready: Dict[str, deque] = {pool: deque() for pool in self.pool_limits}
+        self._running: Dict[str, int] = {pool: 0 for pool in self.pool_limits}
+        self._done = set()
+        self._failure: Optional[TaskFailed] = None
+
+    def add(self, task: Task):
+        with self._cond:
+            if task.name in self._tasks:
+                raise ValueError(f"Task {task.name} already scheduled")
+            if task.pool not in self.pool_limits:
+                raise ValueError(f"Unknown pool {task.pool} for task {task.name}")
+            self._tasks[task.name] = task
+
+            waiting = {dep for dep in task.deps if dep not in self._done}
+            if waiting:
+                self._waiting[task.name] = waiting
+                for dep in waiting:
+                    self._dependents.setdefault(dep, []).append(task.name)
+            else:
+                self._ready[task.pool].append(task.name)
+            self._cond.notify_all()
+
+    def _finish(self, name: str, future):
+        with self._cond:
+            task = self._tasks[name]
+            self._running[task.pool] -= 1
+            error = future.exception()
+            if error is not None:
+                if self._failure is None:
+                    self._failure = TaskFailed(name, error)
+                    self.cancel.set()
+            else:
+                self.results[name] = future.result()
+                self._done.add(name)
+                for dependent in self._dependents.pop(name, []):
+                    waiting = self._waiting[dependent]
+                    waiting.discard(name)
+                    if not waiting:
+                        del self._waiting[dependent]
+                        self._ready[self._tasks[dependent].pool].append(dependent)
+            self._cond.notify_all()
+
+    def _start_ready(self, executor: ThreadPoolExecutor):
+        for pool, queue in self._ready.items():
+            while queue and self._running[pool] < self.pool_limits[pool]:
+                name = queue.popleft()
+                self._running[pool] += 1
+                future = executor.submit(self._run_task, self._tasks[name])
+                future.add_done_callback(lambda f, name=name: self._finish(name, f))
+
+    @staticmethod
+    def _run_task(task: Task):
+        with telemetry.span(task.name, pool=task.pool), telemetry.profile(task_step(task.name)):
+            return task.func()
+
+    def run(self) -> Dict[str, Any]:
+        """Run until every task finished, returns the task results by name"""
+        executor = ThreadPoolExecutor(max_workers=sum(self.pool_limits.values()))
+        try:
+            with self._cond:
+                while self._failure is None:
+                    self._start_ready(executor)
+                    # tasks finishing right away run their callback in this thread
+                    if self._failure is not None:
+                        break
+                    if not any(self._running.values()):
+                        if self._waiting:
+                            missing = {dep for deps in self._waiting.values() for dep in deps}
+                            raise ValueError(f"Tasks wait on dependencies that never ran: {sorted(missing)}")
+                        break
+                    self._cond.wait()
+        except BaseException:
+            self.cancel.set()
+            raise
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        if self._failure is not None:
+            raise self._failure
+        return self.results
+
+
+def search_fingerprint(config: ProjectConfig) -> Optional[str]:
+    """
+    Fingerprint of the products found by the cached search of a project.
+
+    None when there is no cached search the next download would replay (none
+    yet, expired, or caching disabled), that download searches ASF again.
+    """
+    from .download.download import build_search_options, search_cache_dir
+    from .download.search_cache import cached_search_files
+
+    download_config = config.download
+    if download_config is None:
+        return None
+    ttl = None if download_config.offline else download_config.search_cache_ttl
+    if ttl is not None and ttl <= 0:
+        return None
+    files = cached_search_files(search_cache_dir(config), build_search_options(download_config), ttl)
+    if files is None:
+        return None
+    return fingerprint(files)
+
+
+def step_inputs(step: str, config: ProjectConfig) -> str:
+    """
+    Fingerprint of what a step reads: its config section and the upstream files it uses.
+
+    Options that only change how a step runs (parallelism, offline replay)
+    are left out, so changing them does not invalidate the outputs. The
+    download step also depends on the products of its cached search, it
+    is not current while that search has to run again, and is current
+    again once the search found nothing new.
+    """
+    work_dir = config.system.work_dir / config.project_name
+    slc_dir = work_dir / config.download.slc_dir if config.download else None
+
+    if step == "download":
+        runtime_options = {
+            "parallel_downloads", "adaptive_downloads", "offline", "search_cache_ttl",
+            "search_window_days", "search_workers", "max_results",
+        }
+        section = config.download.model_dump(exclude=runtime_options) if config.download else None
+        inputs = {"download": section, "search": search_fingerprint(config)}
+        if config.extract is not None:
+            # the extracted SAFE directories are outputs of the download step
+            inputs["extract"] = config.extract.model_dump(exclude={"workers"})
+        return fingerprint(inputs)
+
+    if step == "dem":
+        kml_files = sorted(slc_dir.glob("ssara_*.kml")) if slc_dir else []
+        # the KML is rewritten by every download run, only its content matters
+        kml_digest = hashlib.sha256(kml_files[-1].read_bytes()).hexdigest() if kml_files else None
+        section = config.dem.model_dump() if config.dem else None
+        return fingerprint({"dem": section, "kml": kml_digest})
+
+    if step == "jobfiles":
+        section = config.jobfiles.model_dump() if config.jobfiles else None
+        products = sorted([*slc_dir.glob("*.zip"), *slc_dir.glob("*.tiff")]) if slc_dir else []
+        run_files_dir = work_dir / config.jobfiles.run_files_dir if config.jobfiles else None
+        return fingerprint({
+            "jobfiles": section,
+            "system": config.system.model_dump(include={"slurm_partition", "max_parallel_jobs"}),
+            "products": manifest(products),
+            "run_files": manifest([run_files_dir]) if run_files_dir else None,
+        })
+
+    if step == "isce":
+        jobfiles_dir = work_dir / config.jobfiles.jobfiles_dir if config.jobfiles else None
+        jobs = [jobfiles_dir / "jobs.json", *sorted(jobfiles_dir.glob("*.tasks"))] if jobfiles_dir else []
+        return fingerprint({"jobs": manifest(jobs)})
+
+    raise ValueError(f"Unknown step {step}")
+
+
+def step_outputs(step: str, config: ProjectConfig) -> list:
+    """Files and directories whose manifest tells whether the outputs of a step are untouched"""
+    work_dir = config.system.work_dir / config.project_name
+    if step == "download":
+        if config.download is None:
+            return []
+        if config.extract is not None:
+            return [work_dir / config.download.slc_dir, work_dir / config.extract.safe_dir]
+        return [work_dir / config.download.slc_dir]
+    if step == "dem":
+        return [work_dir / config.dem.dem_dir] if config.dem else []
+    if step == "jobfiles":
+        if config.jobfiles is None:
+            return []
+        jobfiles_dir = work_dir / config.jobfiles.jobfiles_dir
+        return [
+            jobfiles_dir / "jobs.json", jobfiles_dir / "baselines.csv",
+            *sorted(jobfiles_dir.glob("*.job")), *sorted(jobfiles_dir.glob("*.tasks")),
+        ]
+    if step == "isce":
+        return [work_dir / "merged"]
+    raise ValueError(f"Unknown step {step}")
+
+
+def is_current(journal: RunJournal, step: str, config: ProjectConfig) -> bool:
+    return journal.is_current(step, step_inputs(step, config), step_outputs(step, config))
+
+
+def journaled(journal: RunJournal, step: str, config: ProjectConfig, func: Callable, force: bool = False) -> Callable[[], None]:
+    """
+    Wrap a step so it is skipped when current and recorded in the journal once it completed.
+
+    The inputs are fingerprinted when the step starts, after its upstream
+    steps finished, so a step only re-runs when what it reads changed. The
+    download step searches as part of the step, its inputs are
+    fingerprinted again once the search results are cached.
+    """
+    def run():
+        inputs = step_inputs(step, config)
+        if not force and journal.is_current(step, inputs, step_outputs(step, config)):
+            print(f"[bold cyan]{STEP_DESCRIPTIONS[step]} is up to date, skipping[/bold cyan]")
+            return
+        # a step interrupted halfway must not look current on the next run
+        journal.invalidate(step)
+        func(config)
+        recorded = step_inputs(step, config) if step == "download" else inputs
+        journal.record(step, recorded, step_outputs(step, config))
+    return run
+
+
+def task_step(name: str) -> str:
+    """Step a task belongs to, e.g. download for <project>/download:<product>"""
+    return name.rsplit("/", 1)[-1].split(":")[0]
+
+
+def schedule_run(scheduler: Scheduler, config: ProjectConfig, steps: set, progress: Progress, force: bool = False, batch=None, engine=None):
+    """
+    Add the tasks of the selected steps to the scheduler.
+
+    With the download step selected the graph is
+    search -> download:<product> -> orbit:<product> and search -> kml,
+    where the search adds the downloads of each search window as soon as
+    it completes. The orbit of a product whose download failed is not
+    fetched. Each resolved EOF is converted to binary state vectors in a
+    worker process and vectors waits for the conversions. With an extract section, extract:<product> unpacks the
+    needed subswaths of each SLC as soon as it is downloaded. dem only waits for kml, so the DEM is built while the
+    SLCs are still downloading. With scratch staging the transfer runs as
+    download:<product>:transfer and download:<product> waits for the move
+    of the file, so the download threads go on with the next products.
+    The job arrays are written once the orbits (and the DEM) are in place,
+    and the isce step runs them. Steps that are not selected are assumed
+    to be complete already, and selected steps that are current in the run
+    journal are skipped unless force is set.
+
+    With a Batch the task names are prefixed with the project name, the
+    search waits for the merged search of the batch and products already
+    claimed by another project are linked instead of downloaded.
+
+    SLC downloads, orbit fetches and DEM tiles all go through engine, the
+    TransferEngine of the run, which defaults to one cancelled with the
+    scheduler and showing its transfers on progress.
+    """
+    # keep heavy step imports local to the graph construction
+    from .download.download import (
+        print_download_summary, iter_search, print_search_summary, products_bytes,
+        create_kml, resume_incomplete_downloads, check_space,
+    )
+    from .download.progress import DownloadProgress, RichProgressDisplay
+    from .download.transfer import ASF_SESSION, DownloadFailures, make_session, placed, product_target, try_download_product
+    from .download.engine import DEFAULT_HOST_LIMIT, TransferEngine
+    from .download.concurrency import AdaptiveConcurrency
+    from .download.slc_store import SlcStore
+    from .download.staging import ScratchStaging, SpacePlan
+    from .download.extract import extract_product, project_aoi, safe_dir
+    from .dem.dem import dem_main
+    from .jobfiles.jobfiles import jobfiles_main, write_jobfiles
+    from .jobfiles.orbit_store import OrbitIndex, Scene, VectorConverter, resolve_scene
+    from .isce.isce import isce_main
+    from .batch import link_product
+
+    journal = RunJournal.for_project(config)
+    state = {}
+    failures = {}
+    prefix = batch.prefix(config) if batch is not None else ""
+    dem_dep = (f"{prefix}dem",) if "dem" in steps else ()
+    # the ISCE tasks run in their own sessions, Ctrl-C reaches them through the cancel event
+    run_isce = functools.partial(isce_main, budget=batch.job_budget if batch is not None else None, cancel=scheduler.cancel)
+    if engine is None:
+        host_limit = config.download.parallel_downloads if config.download else DEFAULT_HOST_LIMIT
+        engine = TransferEngine.for_system(config.system, host_limit, cancel=scheduler.cancel, progress=progress)
+
+    def search():
+        # products are queued for download as soon as their search window completes
+        slc_dir = print_download_summary(config)
+        if batch is not None:
+            session = engine.session(ASF_SESSION, lambda: make_session(batch.workers))
+            concurrency = batch.concurrency() if config.download.adaptive_downloads else None
+            staging = batch.staging()
+            description = f"Downloading {config.project_name}"
+        else:
+            session = engine.session(ASF_SESSION, lambda: make_session(config.download.parallel_downloads))
+            concurrency = AdaptiveConcurrency(config.download.parallel_downloads) if config.download.adaptive_downloads else None
+            staging = ScratchStaging.for_system(config.system)
+            description = "Downloading"
+        download_progress = DownloadProgress(callbacks=[RichProgressDisplay(progress, None, description)])
+        store = SlcStore.for_system(config.system)
+        destination = store.root if store is not None else slc_dir
+        plan = batch.space_plan(destination) if batch is not None else SpacePlan(destination, staging)
+
+        orbit_index = None
+        if "jobfiles" in steps:
+            if batch is not None:
+                orbit_index = batch.orbit_index(config.system.orbits_dir)
+            else:
+                config.system.orbits_dir.mkdir(exist_ok=True)
+                orbit_index = OrbitIndex(config.system.orbits_dir)
+            converter = VectorConverter(orbit_index)
+
+        results = []
+        download_tasks = []
+        orbit_tasks = []
+        search_fn = batch.search_results if batch is not None else None
+
+        extract_config = config.extract if not config.download.burst_download else None
+        if extract_config is not None:
+            aoi = project_aoi(config)
+            target_dir = safe_dir(config)
+            target_dir.mkdir(parents=True, exist_ok=True)
+
+        def extract(product):
+            path = product_target(product, slc_dir)
+            # a failed download is reported with the other failures
+            if path.exists():
+                extract_product(path, target_dir, aoi, extract_config.polarizations, extract_config.swaths)
+
+        def fetch(product):
+            return try_download_product(product, failures, slc_dir, session, download_progress, scheduler.cancel, store, concurrency, staging, engine)
+
+        def orbit(scene, download):
+            # a failed download is reported with the other failures, its orbit is not needed
+            if scheduler.results[download] is None:
+                return None
+            path = resolve_scene(orbit_index, scene, engine)
+            # converted in a worker process, this thread goes on with the next orbit
+            converter.submit([path])
+            return path
+
+        def link(product, owner_path):
+            try:
+                return link_product(owner_path, product_target(product, slc_dir), download_progress)
+            except FileNotFoundError as e:
+                # the owning project failed to download it and reports it too
+                failures[product.properties["fileName"]] = e
+
+        for window in iter_search(config, search_fn):
+            resume_incomplete_downloads(slc_dir, window)
+            owners = {}
+            for product in window:
+                name = f"{prefix}download:{product.properties['fileID']}"
+                owners[name] = batch.claim(product, product_target(product, slc_dir), name) if batch is not None else None
+            # products of other projects are linked, they take no space of their own
+            check_space(plan, [product for product, owner in zip(window, owners.values()) if owner is None], slc_dir, store)
+            download_progress.add_total(products_bytes(window))
+            results.extend(window)
+
+            for product, (name, owner) in zip(window, owners.items()):
+                file_id = product.properties["fileID"]
+                download_tasks.append(name)
+                if owner is None and staging is not None:
+                    # the transfer frees its download thread once on scratch, this task waits for the move
+                    transfer = f"{name}:transfer"
+                    scheduler.add(Task(transfer, lambda product=product: fetch(product), pool="download"))
+                    scheduler.add(Task(
+                        name,
+                        lambda transfer=transfer: placed(scheduler.results[transfer]),
+                        deps=(transfer,),
+                        pool="staging",
+                    ))
+                elif owner is None:
+                    scheduler.add(Task(name, lambda product=product: fetch(product), pool="download"))
+                elif store is not None:
+                    # another project of the batch downloads it into the store
+                    scheduler.add(Task(name, lambda product=product: placed(fetch(product)), deps=(owner[0],)))
+                else:
+                    # another project of the batch downloads it
+                    owner_task, owner_path = owner
+                    scheduler.add(Task(
+                        name,
+                        lambda product=product, owner_path=owner_path: link(product, owner_path),
+                        deps=(owner_task,),
+                    ))
+
+                scene = Scene.from_name(product.properties.get("sceneName") or "")
+                if orbit_index is not None and scene is not None:
+                    orbit_tasks.append(f"{prefix}orbit:{file_id}")
+                    scheduler.add(Task(
+                        f"{prefix}orbit:{file_id}",
+                        lambda scene=scene, name=name: orbit(scene, name),
+                        deps=(name,),
+                        pool="orbit",
+                    ))
+
+                if extract_config is not None:
+                    # the SAFE directories are download outputs too
+                    download_tasks.append(f"{prefix}extract:{file_id}")
+                    scheduler.add(Task(
+                        f"{prefix}extract:{file_id}",
+                        lambda product=product: extract(product),
+                        deps=(name,),
+                        pool="extract",
+                    ))
+
+        print_search_summary(results)
+        state["results"], state["slc_dir"] = results, slc_dir
+        if batch is None:
+            state["staging"] = staging
+        # the KML is part of the download outputs, record them once it is written
+        scheduler.add(Task(f"{prefix}download", record_download, deps=(f"{prefix}kml", *download_tasks)))
+        if "jobfiles" in steps:
+            # the baselines of the job files read the converted state vectors
+            scheduler.add(Task(f"{prefix}vectors", converter.close, deps=tuple(orbit_tasks)))
+            scheduler.add(Task(
+                f"{prefix}jobfiles",
+                journaled(journal, "jobfiles", config, write_jobfiles, force),
+                deps=(f"{prefix}download", f"{prefix}vectors", *dem_dep),
+            ))
+
+    def kml():
+        create_kml(state["slc_dir"], state["results"])
+
+    def record_download():
+        if state.get("staging") is not None:
+            # every download task waited for its move
+            state["staging"].close()
+        # failed products do not stop the other downloads, they fail the step once all are done
+        if failures:
+            raise DownloadFailures(dict(failures))
+        # the search ran as part of the step, its results are cached now
+        journal.record("download", step_inputs("download", config), step_outputs("download", config))
+
+    run_download = "download" in steps and (force or not is_current(journal, "download", config))
+    if "download" in steps and not run_download:
+        label = f"{config.project_name}: " if batch is not None else ""
+        print(f"[bold cyan]{label}{STEP_DESCRIPTIONS['download']} is up to date, skipping[/bold cyan]")
+
+    if run_download:
+        journal.invalidate("download")
+        search_deps = (batch.search_task(scheduler, config),) if batch is not None else ()
+        scheduler.add(Task(f"{prefix}search", search, deps=search_deps, pool="search"))
+        scheduler.add(Task(f"{prefix}kml", kml, deps=(f"{prefix}search",)))
+
+    if "dem" in steps:
+        deps = (f"{prefix}kml",) if run_download else ()
+        run_dem = functools.partial(dem_main, engine=engine)
+        scheduler.add(Task(f"{prefix}dem", journaled(journal, "dem", config, run_dem, force), deps=deps, pool="dem"))
+
+    if "jobfiles" in steps and not run_download:
+        scheduler.add(Task(f"{prefix}jobfiles", journaled(journal, "jobfiles", config, jobfiles_main, force), deps=dem_dep))
+
+    if "isce" in steps:
+        deps = (f"{prefix}jobfiles",) if "jobfiles" in steps else ()
+        scheduler.add(Task(f"{prefix}isce", journaled(journal, "isce", config, run_isce, force), deps=deps))
@@ -0,0 +1,264 @@
+import os
+import json
+import time
+import pstats
+import cProfile
+import threading
+from pathlib import Path
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+HISTOGRAM_PERCENTILES = (50, 90, 99)
+
+
+class _NullSpan:
+    """Returned while recording is off, so instrumented code costs one attribute check"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    __slots__ = ("recorder", "name", "attrs", "start")
+
+    def __init__(self, recorder: "Recorder", name: str, attrs: dict):
+        self.recorder = recorder
+        self.name = name
+        self.attrs = attrs
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.recorder._add_span(self.name, self.start, end, self.attrs)
+        return False
+
+    def set(self, **attrs):
+        """Attach attributes known only once the span is running (bytes, cache hits...)"""
+        self.attrs.update(attrs)
+
+
+class Recorder:
+    """
+    In-memory spans, counters and histograms of a pipeline run.
+
+    Recording is off by default: span() then returns a shared no-op context
+    manager and count()/observe() return right away. When enabled, events
+    are appended under a lock and written by export() as JSONL metrics and
+    as a Chrome trace (chrome://tracing, ui.perfetto.dev).
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.origin = time.perf_counter_ns()
+            self.wall_origin = time.time()
+            self.spans: List[tuple] = []
+            self.counters: Dict[str, float] = defaultdict(float)
+            self.counter_samples: List[tuple] = []
+            self.histograms: Dict[str, List[float]] = defaultdict(list)
+            self.thread_names: Dict[int, str] = {}
+
+    def enable(self):
+        self.reset()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def span(self, name: str, /, **attrs):
+        if not self.enabled:
+            return _NULL_SPAN
+        return Span(self, name, attrs)
+
+    def _add_span(self, name: str, start: int, end: int, attrs: dict):
+        thread = threading.current_thread()
+        with self._lock:
+            self.thread_names[thread.ident] = thread.name
+            self.spans.append((name, start, end, thread.ident, attrs))
+
+    def count(self, name: str, value: float = 1):
+        if not self.enabled:
+            return
+        now = time.perf_counter_ns()
+        with self._lock:
+            self.counters[name] += value
+            self.counter_samples.append((name, now, self.counters[name]))
+
+    def observe(self, name: str, value: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.histograms[name].append(value)
+
+    @staticmethod
+    def summarize(values: List[float]) -> dict:
+        # every command imports telemetry, numpy is only loaded when a trace is exported
+        import numpy as np
+
+        data = np.asarray(values, dtype=float)
+        summary = {
+            "count": int(data.size),
+            "sum": float(data.sum()),
+            "min": float(data.min()),
+            "max": float(data.max()),
+            "mean": float(data.mean()),
+        }
+        for percentile, value in zip(HISTOGRAM_PERCENTILES, np.percentile(data, HISTOGRAM_PERCENTILES)):
+            summary[f"p{percentile}"] = float(value)
+        return summary
+
+    def metrics(self) -> List[dict]:
+        """Every span, counter and histogram summary as JSON records"""
+        with self._lock:
+            spans = list(self.spans)
+            counters = dict(self.counters)
+            histograms = {name: list(values) for name, values in self.histograms.items()}
+
+        records = []
+        for name, start, end, thread_id, attrs in spans:
+            records.append({
+                "type": "span",
+                "name": name,
+                "start": self.wall_origin + (start - self.origin) / 1e9,
+                "duration": (end - start) / 1e9,
+                "thread": self.thread_names.get(thread_id, str(thread_id)),
+                "attrs": attrs,
+            })
+        for name, value in sorted(counters.items()):
+            records.append({"type": "counter", "name": name, "value": value})
+        for name, values in sorted(histograms.items()):
+            records.append({"type": "histogram", "name": name, **self.summarize(values)})
+        return records
+
+    def trace_events(self) -> List[dict]:
+        pid = os.getpid()
+        with self._lock:
+            spans = list(self.spans)
+            samples = list(self.counter_samples)
+            thread_names = dict(self.thread_names)
+
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for tid, name in thread_names.items()
+        ]
+        for name, start, end, thread_id, attrs in spans:
+            events.append({
+                "name": name,
+                "cat": name.split(":")[0].split(".")[0],
+                "ph": "X",
+                "ts": (start - self.origin) / 1e3,
+                "dur": (end - start) / 1e3,
+                "pid": pid,
+                "tid": thread_id,
+                "args": attrs,
+            })
+        for name, timestamp, value in samples:
+            events.append({"name": name, "ph": "C", "ts": (timestamp - self.origin) / 1e3, "pid": pid, "args": {name: value}})
+        return events
+
+    def export(self, directory: Path) -> tuple:
+        """
+        Write metrics.jsonl and trace.json into directory.
+
+        Returns:
+            Tuple of (metrics path, trace path)
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        metrics_path = directory / "metrics.jsonl"
+        with open(metrics_path, "w") as f:
+            for record in self.metrics():
+                f.write(json.dumps(record, default=str) + "\n")
+
+        trace_path = directory / "trace.json"
+        trace_path.write_text(json.dumps({"traceEvents": self.trace_events(), "displayTimeUnit": "ms"}, default=str))
+        return metrics_path, trace_path
+
+
+class Profiler:
+    """
+    cProfile statistics aggregated per step.
+
+    cProfile only sees the thread it is enabled in, so every task gets its
+    own profile, merged into the statistics of its step when it finishes.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.stats: Dict[str, pstats.Stats] = {}
+
+    @contextmanager
+    def profile(self, step: str):
+        if not self.enabled:
+            yield
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiler is active in this thread
+            yield
+            return
+        try:
+            yield
+        finally:
+            profiler.disable()
+            with self._lock:
+                if step in self.stats:
+                    self.stats[step].add(profiler)
+                else:
+                    self.stats[step] = pstats.Stats(profiler)
+
+    def export(self, directory: Path) -> List[Path]:
+        """Write one <step>.prof file per step, readable with pstats or snakeviz"""
+        directory.mkdir(parents=True, exist_ok=True)
+        paths = []
+        with self._lock:
+            for step, stats in self.stats.items():
+                path = directory / f"{step}.prof"
+                stats.dump_stats(path)
+                paths.append(path)
+        return paths
+
+
+recorder = Recorder()
+profiler = Profiler()
+
+span = recorder.span
+count = recorder.count
+observe = recorder.observe
+profile = profiler.profile
+
+
+def _stamp(started: Optional[float]) -> str:
+    return time.strftime("%Y%m%dT%H%M%S", time.localtime(started or time.time()))
+
+
+def run_dir(config, started: Optional[float] = None) -> Path:
+    """Directory for the metrics of one run, inside the project work dir"""
+    return config.system.work_dir / config.project_name / ".insarchitect" / "runs" / _stamp(started)
+
+
+def batch_run_dir(system, started: Optional[float] = None) -> Path:
+    """Directory for the metrics of a run over several projects, inside the work dir"""
+    return system.work_dir / ".insarchitect" / "runs" / _stamp(started)
@@ -1,15 +1,47 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 from enum import Enum
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 # ========= Global ========= #
+class Executors(str, Enum):
+    SLURM = "slurm"
+    LOCAL = "local"
+
 class SystemConfig(BaseModel):
     scratch_dir: Path = Field(..., description="Scratch space for temporary files")
     work_dir: Path = Field(..., description="Permanent working directory")
     orbits_dir: Path = Field(..., description="Directory to place EOF files")
     max_parallel_jobs: int = Field(4, description="Max number of jobs at the same time")
     slurm_partition: str = Field(..., description="Name of the slurm partition to use")
+    cache_dir: Optional[Path] = Field(None, description="Directory for shared caches (defaults to <work_dir>/.cache)")
+    dem_cache_dir: Optional[Path] = Field(None, description="Shared DEM tile cache (defaults to <cache_dir>/dem_tiles)")
+    dem_cache_size_gb: float = Field(50, description="Size cap of the shared DEM tile cache in GB")
+    slc_store: bool = Field(False, description="Download SLCs once into a shared store and link them into the projects")
+    slc_store_dir: Optional[Path] = Field(None, description="Shared SLC store (defaults to <cache_dir>/slc)")
+    scratch_downloads: bool = Field(False, description="Stage downloads on scratch_dir and move them to their destination in the background")
+    scratch_quota_gb: float = Field(100, description="Max GB of downloads in flight on scratch, downloading or waiting to be moved")
+    scratch_cache_gb: float = Field(50, description="GB of completed downloads kept on scratch, least recently used evicted first")
+    max_transfers: int = Field(16, description="Transfers of any kind (SLCs, orbit files, DEM tiles) running at the same time")
+    transfer_host_limits: Dict[str, int] = Field(default_factory=dict, description="Transfers running at the same time per host, keyed by host name (e.g. datapool.asf.alaska.edu, or dem:COP for the DEM tiles), overrides the limit of each step")
+    sbatch_command: str = Field("sbatch", description="Command used to submit Slurm jobs")
+    squeue_command: str = Field("squeue", description="Command used to poll Slurm jobs")
+    scancel_command: str = Field("scancel", description="Command used to cancel Slurm jobs when the run is interrupted")
+    job_poll_interval: float = Field(30, description="Seconds between two polls of the Slurm queue")
+    executor: Executors = Field(Executors.SLURM, description="Where processing tasks run [slurm, local]")
+    local_cpus: Optional[int] = Field(None, description="CPUs the local executor may use (defaults to all available)")
+    local_memory_gb: Optional[float] = Field(None, description="Memory in GB the local executor may use (defaults to the physical memory)")
+    task_retries: int = Field(2, description="Times the local executor retries a failed task")
+
+    @model_validator(mode="after")
+    def _default_cache_dirs(self):
+        if self.cache_dir is None:
+            self.cache_dir = self.work_dir / ".cache"
+        if self.dem_cache_dir is None:
+            self.dem_cache_dir = self.cache_dir / "dem_tiles"
+        if self.slc_store_dir is None:
+            self.slc_store_dir = self.cache_dir / "slc"
+        return self
 
 class Platforms(str, Enum):
     SENTINEL = "SENTINEL-1"
@@ -21,28 +53,58 @@ class DownloadConfig(BaseModel):
     relative_orbit: int = Field(..., description="Relative orbit number")
     start_date: int = Field(..., description="Start date with YYYYMMDD format")
     end_date: int = Field(..., description="End date with YYYYMMDD format")
-    max_results: int = Field(1000, description="Max results to get from source")
+    max_results: int = Field(1000, description="Max results of one search window, full windows are split and searched again")
     bounding_box: str = Field(..., description="Polygon describing AOI (e.g  POLYGON((-99.20 19.25, -99.10 19.25, -99.10 19.35, -99.20 19.35, -99.20 19.25)))")
-    parallel_downloads: int = Field(8, description="Number of parallel downloads")
+    parallel_downloads: int = Field(8, description="Maximum number of parallel downloads")
+    adaptive_downloads: bool = Field(True, description="Tune the number of parallel downloads from the measured throughput, up to parallel_downloads")
     burst_download: bool = Field(False, description="Flag to activate burst download instead of SLC")
     slc_dir: Path = Field(Path("./SLC"), description="Directory to save downloaded products")
+    search_cache_ttl: int = Field(86400, description="Seconds a cached ASF search stays valid (0 disables the cache)")
+    offline: bool = Field(False, description="Replay cached ASF searches only, never query ASF")
+    search_window_days: int = Field(30, description="Days of the date range covered by each ASF search window (0 searches it at once)")
+    search_workers: int = Field(4, description="Number of search windows queried at the same time")
+    aoi_selection: bool = Field(True, description="Drop products and bursts that add no AOI coverage before downloading")
+    min_contribution: float = Field(0.0, description="Fraction of the AOI a product or burst must add to the coverage of its date to be downloaded")
+    min_date_coverage: float = Field(0.0, description="Fraction of the AOI an acquisition date must cover, dates below are not downloaded")
+
+# ========= Extract ========= #
+class ExtractConfig(BaseModel):
+    safe_dir: Path = Field(Path("./SAFE"), description="Directory to extract the SAFE products to")
+    polarizations: List[str] = Field(["vv"], description="Polarizations to extract [vv, vh, hh, hv]")
+    swaths: Optional[List[int]] = Field(None, description="IW subswaths to extract (defaults to the ones covering the AOI)")
+    workers: int = Field(4, description="Number of products extracted at the same time")
 
 # ========= Dem ========= #
 class DataSource(str, Enum):
     COP = "COP"
     NASA = "NASA"
 
+class ResampleMethod(str, Enum):
+    NEAREST = "nearest"
+    BILINEAR = "bilinear"
+
 class DemConfig(BaseModel):
     data_source: DataSource = Field(DataSource.COP, description="Which DEM provider to use [COP, NASA]")
     dem_dir: Path = Field(Path("./DEM"), description="Directory to save downloaded DEM")
+    footprint_buffer: float = Field(0.1, description="Degrees added around the product footprints when selecting DEM tiles")
+    crop_to_aoi: bool = Field(False, description="Also write the DEM cropped to the AOI bounding box plus footprint_buffer, as <name>_aoi.dem")
+    resample_step: Optional[float] = Field(None, description="Pixel size in degrees of the <name>_aoi.dem DEM (defaults to the resolution of the stitched DEM)")
+    resample_method: ResampleMethod = Field(ResampleMethod.BILINEAR, description="Resampling of the <name>_aoi.dem DEM [nearest, bilinear]")
+    memory_budget_mb: float = Field(512, description="Memory in MB the cropping and resampling of the DEM may use")
+    workers: int = Field(4, description="Number of DEM windows cropped and resampled at the same time")
 
 # ========= Jobfiles ========= #
 class JobfilesConfig(BaseModel):
     jobfiles_dir: Path = Field(Path("./jobfiles"), description="Directory to save jobfiles")
+    run_files_dir: Path = Field(Path("./run_files"), description="Directory with the ISCE run_NN_* files to turn into job arrays")
+    max_walltime: float = Field(240, description="Walltime budget in minutes of one array element, tasks are packed up to it")
+    max_array_size: int = Field(1000, description="Maximum number of elements of one job array")
+    stage_estimates: Dict[str, Tuple[float, ...]] = Field(default_factory=dict, description="Per-task (minutes, memory MB[, cpus]) by run file name, overrides the built-in estimates")
 
 # ========= Project ========= #
 class ProjectConfig(BaseModel):
     download: Optional[DownloadConfig] = Field(None, description="Download configuration section")
+    extract: Optional[ExtractConfig] = Field(None, description="Selective SAFE extraction section, the SLC zips are kept as downloaded without it")
     dem: Optional[DemConfig] = Field(None, description="DEM configuration section")
     jobfiles: Optional[JobfilesConfig] = Field(None, description="Jobfiles configuration section")
     system: SystemConfig = Field(..., description="System configuration")
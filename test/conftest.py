@@ -0,0 +1,161 @@
+import datetime
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import asf_search as asf
+from asf_search.search.search_generator import as_ASFProduct
+
+# one acquisition of 3 frames every 6 days, from 2016-08-30 00:30
+FIRST_ACQUISITION = datetime.datetime(2016, 8, 30, 0, 30)
+REVISIT = datetime.timedelta(days=6)
+SCENE_DURATION = datetime.timedelta(seconds=27)
+FRAMES = 3
+
+
+def scene_name(index: int) -> str:
+    acquisition, frame = divmod(index, FRAMES)
+    mission = "S1A" if acquisition % 2 == 0 else "S1B"
+    start = FIRST_ACQUISITION + acquisition * REVISIT + frame * SCENE_DURATION
+    end = start + SCENE_DURATION
+    return f"{mission}_IW_SLC__1SDV_{start:%Y%m%dT%H%M%S}_{end:%Y%m%dT%H%M%S}_{index:06d}_{index:06X}_{index:04X}"
+
+
+def product_item(index: int) -> dict:
+    """CMR umm/meta of a Sentinel-1 SLC, frames of an acquisition follow each other northwards"""
+    name = scene_name(index)
+    start, end = (datetime.datetime.strptime(part, "%Y%m%dT%H%M%S") for part in name.split("_")[5:7])
+    south = index % FRAMES * 0.9
+    points = [
+        {"Longitude": lon, "Latitude": lat}
+        for lon, lat in ((0, south), (1.2, south), (1.2, south + 1), (0, south + 1), (0, south))
+    ]
+    attributes = {
+        "BYTES": "1024",
+        "MD5SUM": "0" * 32,
+        "PATH_NUMBER": "128",
+        "PROCESSING_TYPE": "SLC",
+        "ASF_PLATFORM": f"Sentinel-1{name[2]}",
+        "POLARIZATION": "VV+VH",
+        "BEAM_MODE_TYPE": "IW",
+    }
+    umm = {
+        "GranuleUR": f"{name}-SLC",
+        "CollectionReference": {"ShortName": f"SENTINEL-1{name[2]}_SLC"},
+        "DataGranule": {"Identifiers": [{"IdentifierType": "ProducerGranuleId", "Identifier": name}]},
+        "TemporalExtent": {"RangeDateTime": {
+            "BeginningDateTime": start.isoformat() + "Z",
+            "EndingDateTime": end.isoformat() + "Z",
+        }},
+        "RelatedUrls": [{"Type": "GET DATA", "URL": f"http://127.0.0.1:1/{name}.zip"}],
+        "AdditionalAttributes": [{"Name": key, "Values": [value]} for key, value in attributes.items()],
+        "SpatialExtent": {"HorizontalSpatialDomain": {"Geometry": {"GPolygons": [{"Boundary": {"Points": points}}]}}},
+        "Platforms": [{"ShortName": f"SENTINEL-1{name[2]}"}],
+    }
+    return {"umm": umm, "meta": {"concept-id": f"G{index}-ASF", "native-id": f"{name}-SLC"}}
+
+
+class SearchStandIn:
+    """Callable standing in for asf.geo_search, newest products first and at most maxResults of them like ASF"""
+
+    def __init__(self, products):
+        self.products = sorted(products, key=lambda product: product.properties["startTime"], reverse=True)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, start: datetime.datetime, end: datetime.datetime, maxResults=None, **opts):
+        with self._lock:
+            self.calls += 1
+        results = asf.ASFSearchResults([
+            product for product in self.products
+            if start <= datetime.datetime.fromisoformat(product.properties["startTime"].removesuffix("Z")) <= end
+        ][:maxResults])
+        results.searchComplete = True
+        return results
+
+
+@pytest.fixture
+def make_products():
+    """Build search results of count synthetic Sentinel-1 SLCs"""
+    def make(count: int) -> asf.ASFSearchResults:
+        session = asf.ASFSession()
+        results = asf.ASFSearchResults([as_ASFProduct(product_item(index), session) for index in range(count)])
+        results.searchComplete = True
+        return results
+    return make
+
+
+@pytest.fixture
+def search_stand_in():
+    return SearchStandIn
+
+
+def payload(name: str, size: int) -> bytes:
+    """Deterministic content of a served file"""
+    block = name.encode() * (size // len(name) + 1)
+    return block[:size]
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    """
+    Serves /files/<size>/<name> with Range support, and /status/<code> as an
+    empty answer with that status (429 comes with a Retry-After of 1 s).
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        parts = self.path.strip("/").split("/")
+        if len(parts) == 3 and parts[0] == "files":
+            return self.send_file(parts[2], int(parts[1]))
+        if len(parts) == 2 and parts[0] == "status":
+            status = int(parts[1])
+            return self.send_empty(status, {"Retry-After": "1"} if status == 429 else {})
+        self.send_empty(404)
+
+    def send_empty(self, status: int, headers: dict = None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_file(self, name: str, size: int):
+        offset = 0
+        range_header = self.headers.get("Range")
+        if range_header:
+            offset = int(range_header.split("=")[1].split("-")[0])
+            if offset >= size:
+                return self.send_empty(416)
+        self.send_response(206 if range_header else 200)
+        if range_header:
+            self.send_header("Content-Range", f"bytes {offset}-{size - 1}/{size}")
+        self.send_header("Content-Length", str(size - offset))
+        self.end_headers()
+        self.wfile.write(payload(name, size)[offset:])
+
+
+@pytest.fixture
+def http_server():
+    """Local HTTP server of FileHandler, base_url is its root and paths the requested paths"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FileHandler)
+    server.daemon_threads = True
+    server.paths = []
+    host, port = server.server_address
+    server.base_url = f"http://{host}:{port}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+@pytest.fixture
+def served_file():
+    return payload
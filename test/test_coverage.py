@@ -0,0 +1,70 @@
+import pytest
+import shapely
+from shapely.geometry import mapping
+
+from insarchitect.core.download.coverage import select_products
+
+AOI = shapely.box(0, 0, 2, 1).wkt
+
+
+@pytest.fixture
+def products_with(make_products):
+    """Synthetic products placed at (date, (west, south, east, north), burst ID) footprints"""
+    def place(*footprints):
+        products = make_products(len(footprints))
+        for product, (date, bounds, burst) in zip(products, footprints):
+            product.geometry = mapping(shapely.box(*bounds))
+            product.properties["startTime"] = f"{date}T00:30:00Z"
+            if burst is not None:
+                product.properties["burst"] = {"fullBurstID": burst}
+        return list(products)
+    return place
+
+
+def test_select_products_drops_frames_adding_no_coverage(products_with):
+    covering, covered, outside = products_with(
+        ("2020-01-01", (-1, -1, 3, 2), None),
+        ("2020-01-01", (1, 0, 3, 1), None),
+        ("2020-01-01", (5, 5, 6, 6), None),
+    )
+    selection = select_products([covering, covered, outside], AOI)
+    assert list(selection.results) == [covering]
+    assert selection.dropped == [covered, outside]
+    assert [(date.date, date.coverage, date.products) for date in selection.dates] == [("2020-01-01", 1.0, 1)]
+    assert selection.incomplete_dates == []
+
+
+def test_select_products_min_contribution_and_date_coverage(products_with):
+    products = products_with(
+        ("2020-01-01", (-1, -1, 1.9, 2), None),
+        ("2020-01-01", (1.9, 0, 3, 1), None),
+    )
+    selection = select_products(products, AOI, min_contribution=0.1)
+    assert list(selection.results) == products[:1]
+    assert selection.incomplete_dates[0].coverage == pytest.approx(0.95)
+
+    selection = select_products(products, AOI, min_contribution=0.1, min_date_coverage=0.99)
+    assert list(selection.results) == []
+    assert selection.dropped_dates == ["2020-01-01"]
+
+
+def test_select_products_keeps_bursts_on_every_date(products_with):
+    products = products_with(
+        ("2020-01-01", (0, 0, 1, 1), "128_000001_IW1"),
+        ("2020-01-01", (1, 0, 2, 1), "128_000002_IW1"),
+        # a wide burst covers the whole AOI on the second date only
+        ("2020-01-13", (-1, -1, 3, 2), "128_000003_IW2"),
+        ("2020-01-13", (0, 0, 1, 1), "128_000001_IW1"),
+        ("2020-01-13", (1, 0, 2, 1), "128_000002_IW1"),
+        ("2020-01-13", (5, 5, 6, 6), "128_000009_IW3"),
+    )
+    selection = select_products(products, AOI)
+    assert list(selection.results) == products[:5]
+    assert selection.dropped == products[5:]
+
+    # frames are selected per date
+    frames = products_with(
+        ("2020-01-13", (-1, -1, 3, 2), None),
+        ("2020-01-13", (0, 0, 1, 1), None),
+    )
+    assert list(select_products(frames, AOI).results) == frames[:1]
@@ -0,0 +1,57 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from insarchitect.core.dem.crop import DemGrid, plan_windows, target_grid
+
+# one degree at 1 arc second, north west corner at (0, 1)
+SOURCE = DemGrid(Path("dem.wgs84"), 3601, 3601, 0.0, 1.0, 1 / 3600, -1 / 3600, np.dtype("<i2"))
+
+
+def test_target_grid_crops_to_whole_source_samples():
+    target = target_grid(SOURCE, Path("crop.dem"), (0.25, 0.25, 0.5, 0.5))
+    assert (target.width, target.length) == (901, 901)
+    assert target.west == pytest.approx(0.25)
+    assert target.north == pytest.approx(0.5)
+    assert (target.step_x, target.step_y, target.dtype) == (SOURCE.step_x, SOURCE.step_y, SOURCE.dtype)
+    assert target.path == Path("crop.dem")
+
+
+def test_target_grid_clips_bounds_to_the_source():
+    target = target_grid(SOURCE, Path("crop.dem"), (-1, -1, 0.5, 2))
+    assert (target.west, target.north) == (0.0, 1.0)
+    assert target.east == pytest.approx(0.5)
+    assert target.south == pytest.approx(0.0)
+
+
+def test_target_grid_resamples_with_step():
+    target = target_grid(SOURCE, Path("crop.dem"), (0.25, 0.25, 0.5, 0.5), step=1 / 1200)
+    assert (target.width, target.length) == (301, 301)
+    assert (target.step_x, target.step_y) == (1 / 1200, -1 / 1200)
+
+
+def test_target_grid_outside_the_source():
+    with pytest.raises(ValueError):
+        target_grid(SOURCE, Path("crop.dem"), (2, 2, 3, 3))
+
+
+def test_plan_windows_fits_the_memory_budget():
+    target = target_grid(SOURCE, Path("crop.dem"), (0.25, 0.25, 0.5, 0.5))
+    # output and source rows of 901 int16 samples, 100 rows for each of 2 workers
+    windows = plan_windows(SOURCE, target, memory_budget=901 * 2 * 2 * 100 * 2, workers=2, resample=False)
+    assert windows[0] == (0, 100)
+    assert windows[-1] == (900, 901)
+    assert all(earlier[1] == later[0] for earlier, later in zip(windows, windows[1:]))
+
+    assert plan_windows(SOURCE, target, memory_budget=1, workers=2, resample=False)[:2] == [(0, 1), (1, 2)]
+    assert plan_windows(SOURCE, target, memory_budget=2**40, workers=2, resample=False) == [(0, 901)]
+
+
+def test_plan_windows_leaves_room_for_resampling():
+    target = target_grid(SOURCE, Path("crop.dem"), (0.25, 0.25, 0.5, 0.5), step=1 / 1200)
+    budget = 4 * 1024**2
+    resampled = plan_windows(SOURCE, target, budget, workers=4, resample=True)
+    cropped = plan_windows(SOURCE, target, budget, workers=4, resample=False)
+    assert len(resampled) > len(cropped)
+    assert resampled[-1][1] == target.length
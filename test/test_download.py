@@ -0,0 +1,29 @@
+import os
+
+from insarchitect.core.download.download import resume_incomplete_downloads
+from insarchitect.core.download.transfer import part_path
+
+
+def test_resume_incomplete_downloads(tmp_path, make_products):
+    short, long_part, complete, oversized, linked = products = list(make_products(5))
+    path = {product: tmp_path / product.properties["fileName"] for product in products}
+    size = int(short.properties["bytes"])
+
+    path[short].write_bytes(b"a" * 100)
+    # an earlier transfer got further than the file left in place
+    path[long_part].write_bytes(b"b" * 100)
+    part_path(path[long_part]).write_bytes(b"c" * 500)
+    path[complete].write_bytes(b"d" * size)
+    path[oversized].write_bytes(b"e" * (size + 1))
+    stored = tmp_path / "store.zip"
+    stored.write_bytes(b"f" * 100)
+    os.link(stored, path[linked])
+
+    resume_incomplete_downloads(tmp_path, products)
+
+    assert not path[short].exists() and part_path(path[short]).read_bytes() == b"a" * 100
+    assert not path[long_part].exists() and part_path(path[long_part]).read_bytes() == b"c" * 500
+    assert path[complete].stat().st_size == size
+    assert not path[oversized].exists()
+    assert not path[linked].exists() and not part_path(path[linked]).exists()
+    assert stored.read_bytes() == b"f" * 100
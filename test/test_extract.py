@@ -0,0 +1,67 @@
+import zipfile
+
+import shapely
+
+from insarchitect.core.download.extract import member_swath, plan_extraction
+
+SAFE = "S1A_IW_SLC__1SDV_20230105T000000_20230105T000027_046000_058000_ABCD.SAFE"
+
+
+def annotation(west: float) -> str:
+    """Annotation whose geolocation grid spans one degree of longitude from west"""
+    points = "".join(
+        f"<geolocationGridPoint><latitude>{lat}</latitude><longitude>{lon}</longitude></geolocationGridPoint>"
+        for lon in (west, west + 1) for lat in (0, 1)
+    )
+    return f"<product><geolocationGrid><geolocationGridPointList>{points}</geolocationGridPointList></geolocationGrid></product>"
+
+
+def write_safe(path):
+    """SAFE zip of three subswaths side by side, in VV and VH"""
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr(f"{SAFE}/manifest.safe", "<manifest/>")
+        archive.writestr(f"{SAFE}/preview/quick-look.png", b"png")
+        for swath in (1, 2, 3):
+            for polarization in ("vv", "vh"):
+                name = f"s1a-iw{swath}-slc-{polarization}-20230105t000000-20230105t000027-046000-058000-00{swath}"
+                archive.writestr(f"{SAFE}/measurement/{name}.tiff", b"\0" * 64)
+                archive.writestr(f"{SAFE}/annotation/{name}.xml", annotation(swath - 1))
+                for kind in ("calibration", "noise"):
+                    archive.writestr(f"{SAFE}/annotation/calibration/{kind}-{name}.xml", "<calibration/>")
+                archive.writestr(f"{SAFE}/annotation/rfi/rfi-{name}.xml", "<rfi/>")
+    return path
+
+
+def names(plan) -> set:
+    return {info.filename.removeprefix(f"{SAFE}/") for info in plan.members}
+
+
+def test_member_swath():
+    assert member_swath(f"{SAFE}/measurement/s1a-iw2-slc-vv-20230105t000000-001.tiff") == ("iw2", "vv")
+    assert member_swath(f"{SAFE}/annotation/calibration/noise-s1a-iw3-slc-vh-20230105t000000-001.xml") == ("iw3", "vh")
+    assert member_swath(f"{SAFE}/manifest.safe") is None
+
+
+def test_plan_extraction_keeps_the_subswaths_covering_the_aoi(tmp_path):
+    with zipfile.ZipFile(write_safe(tmp_path / "product.zip")) as archive:
+        plan = plan_extraction(archive, shapely.box(1.2, 0.2, 1.8, 0.8), ["VV"])
+    name = "s1a-iw2-slc-vv-20230105t000000-20230105t000027-046000-058000-002"
+    assert plan.swaths == ["iw2"]
+    assert names(plan) == {
+        "manifest.safe",
+        "preview/quick-look.png",
+        f"measurement/{name}.tiff",
+        f"annotation/{name}.xml",
+        f"annotation/calibration/calibration-{name}.xml",
+        f"annotation/calibration/noise-{name}.xml",
+        f"annotation/rfi/rfi-{name}.xml",
+    }
+    assert plan.selected_bytes < plan.total_bytes
+
+
+def test_plan_extraction_with_given_subswaths(tmp_path):
+    with zipfile.ZipFile(write_safe(tmp_path / "product.zip")) as archive:
+        plan = plan_extraction(archive, shapely.box(1.2, 0.2, 1.8, 0.8), ["vv", "vh"], swaths=[1, 3])
+    assert plan.swaths == ["iw1", "iw3"]
+    measurements = {name for name in names(plan) if name.startswith("measurement/")}
+    assert {member_swath(name) for name in measurements} == {("iw1", "vv"), ("iw1", "vh"), ("iw3", "vv"), ("iw3", "vh")}
@@ -0,0 +1,17 @@
+from insarchitect.core.dem.get_boundingbox_from_kml import bbox_from_kml
+
+KML = """<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2"><Document>
+<Placemark><name>S1A_IW_SLC</name><Polygon><outerBoundaryIs><LinearRing>
+<coordinates>-99.5,19.0,0 -98.3,19.0,0 -98.3,20.0,0 -99.5,20.0,0 -99.5,19.0,0</coordinates>
+</LinearRing></outerBoundaryIs></Polygon></Placemark>
+<Placemark><name>label</name><Point><coordinates>10.0,50.0,0</coordinates></Point></Placemark>
+</Document></kml>
+"""
+
+
+def test_bbox_from_kml_reads_the_footprints_only(tmp_path):
+    kml_file = tmp_path / "ssara_search.kml"
+    kml_file.write_text(KML)
+    assert bbox_from_kml(kml_file) == (19.0, 20.0, -99.5, -98.3)
+    assert bbox_from_kml(kml_file, delta_lat=0.5, delta_lon=1.2) == (18.5, 20.5, -100.7, -97.1)
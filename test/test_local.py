@@ -0,0 +1,37 @@
+import time
+import threading
+
+import pytest
+
+from insarchitect.core.jobfiles.local import LocalExecutor, StageCancelled
+from insarchitect.core.jobfiles.slurm import StageJob
+
+
+def stage(tmp_path, commands) -> StageJob:
+    tasks_file = tmp_path / "run_01_unpack"
+    tasks_file.write_text("\n".join(commands) + "\n")
+    return StageJob("run_01_unpack", "", str(tasks_file), len(commands), len(commands), "", memory=1, cpus=1)
+
+
+def executor(tmp_path, **kwargs) -> LocalExecutor:
+    return LocalExecutor(tmp_path / "scratch", tmp_path / "logs", max_parallel_jobs=2, cpus=2, memory=1024, cwd=tmp_path, **kwargs)
+
+
+def test_run_stage_runs_every_task(tmp_path):
+    executor(tmp_path).run_stage(stage(tmp_path, ["touch a", "touch b"]))
+    assert (tmp_path / "a").exists() and (tmp_path / "b").exists()
+    assert not (tmp_path / "scratch" / "run_01_unpack").exists()
+
+
+def test_cancel_stops_the_running_tasks(tmp_path):
+    cancel = threading.Event()
+    local = executor(tmp_path, cancel=cancel)
+    timer = threading.Timer(0.5, cancel.set)
+    timer.start()
+    started = time.monotonic()
+    with pytest.raises(StageCancelled):
+        local.run_stage(stage(tmp_path, ["sleep 30 && touch a", "sleep 30 && touch b", "touch c"]))
+    assert time.monotonic() - started < 10
+    # the budget is handed back and the queued task never started
+    assert local.budget.running == 0
+    assert not (tmp_path / "c").exists()
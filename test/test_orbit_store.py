@@ -0,0 +1,69 @@
+import datetime
+from pathlib import Path
+
+import pytest
+
+from insarchitect.core.jobfiles import orbit_store
+from insarchitect.core.jobfiles.orbit_store import OrbitIndex, Scene, fetch_into_store
+
+SCENE = Scene.from_name("S1A_IW_SLC__1SDV_20160830T003000_20160830T003027_012800_014000_ABCD")
+DAY = datetime.datetime(2016, 8, 30)
+
+
+def eof(orbits_dir, orbit_type="POEORB", start=DAY - datetime.timedelta(hours=1), end=DAY + datetime.timedelta(days=1), mission="S1A"):
+    path = orbits_dir / f"{mission}_OPER_AUX_{orbit_type}_OPOD_20160919T000000_V{start:%Y%m%dT%H%M%S}_{end:%Y%m%dT%H%M%S}.EOF"
+    path.touch()
+    return path
+
+
+def test_lookup_prefers_precise_orbits(tmp_path):
+    restituted = eof(tmp_path, "RESORB", SCENE.start - datetime.timedelta(hours=1), SCENE.end + datetime.timedelta(hours=1))
+    precise = eof(tmp_path)
+    eof(tmp_path, start=DAY + datetime.timedelta(days=1), end=DAY + datetime.timedelta(days=2))
+    assert OrbitIndex(tmp_path).lookup(SCENE) == precise
+    precise.unlink()
+    assert OrbitIndex(tmp_path).lookup(SCENE) == restituted
+
+
+def test_lookup_needs_the_coverage_margin(tmp_path):
+    # ends 30 s after the scene, less than COVERAGE_MARGIN
+    eof(tmp_path, "RESORB", SCENE.start - datetime.timedelta(hours=1), SCENE.end + datetime.timedelta(seconds=30))
+    eof(tmp_path, mission="S1B")
+    eof(tmp_path, start=DAY - datetime.timedelta(days=3), end=DAY - datetime.timedelta(days=2))
+    assert OrbitIndex(tmp_path).lookup(SCENE) is None
+
+
+def test_index_picks_up_new_files(tmp_path):
+    (tmp_path / "notes.txt").touch()
+    index = OrbitIndex(tmp_path)
+    assert len(index) == 0
+    assert index.lookup(SCENE) is None
+
+    added = eof(tmp_path)
+    index.add(added)
+    index.add(added)
+    assert len(index) == 1
+    assert index.lookup(SCENE) == added
+
+    other = eof(tmp_path, mission="S1B")
+    index.refresh()
+    assert len(index) == 2
+    assert index.lookup(Scene.from_name(SCENE.name.replace("S1A", "S1B", 1))) == other
+
+
+def test_fetch_into_store_finds_files_fetched_by_other_jobs(tmp_path, monkeypatch):
+    fetched = []
+
+    def fetch_for_scene(name, directory):
+        fetched.append(name)
+        return eof(Path(directory))
+
+    monkeypatch.setattr(orbit_store, "fetch_for_scene", fetch_for_scene)
+    # another job, its index built before the fetch
+    other = OrbitIndex(tmp_path)
+    path = fetch_into_store(OrbitIndex(tmp_path), SCENE)
+    assert path.parent == tmp_path and path.exists()
+
+    monkeypatch.setattr(other, "refresh", lambda: pytest.fail("rescanned the orbits directory"))
+    assert fetch_into_store(other, SCENE) == path
+    assert fetched == [SCENE.name]
@@ -0,0 +1,54 @@
+import json
+
+from insarchitect.core.download.download import build_search_options, search_cache_dir
+from insarchitect.core.download.search_cache import save_search
+from insarchitect.core.pipeline import search_fingerprint
+from insarchitect.models import ProjectConfig
+
+
+def project(tmp_path, **download) -> ProjectConfig:
+    return ProjectConfig(
+        project_name="galapagos",
+        system={
+            "scratch_dir": tmp_path / "scratch",
+            "work_dir": tmp_path / "work",
+            "orbits_dir": tmp_path / "orbits",
+            "cache_dir": tmp_path / "cache",
+            "slurm_partition": "all",
+        },
+        download={
+            "platform": "SENTINEL-1",
+            "relative_orbit": 128,
+            "start_date": 20160830,
+            "end_date": 20161031,
+            "bounding_box": "POLYGON((0 0, 2 0, 2 1, 0 1, 0 0))",
+            **download,
+        },
+    )
+
+
+def test_search_fingerprint_follows_the_cached_products(tmp_path, make_products):
+    config = project(tmp_path)
+    assert search_fingerprint(config) is None
+
+    def cache(products):
+        save_search(search_cache_dir(config), build_search_options(config.download), products)
+        return search_fingerprint(config)
+
+    found = cache(make_products(6))
+    assert found is not None
+    assert cache(make_products(6)) == found
+    assert cache(make_products(9)) != found
+
+
+def test_search_fingerprint_of_an_expired_search(tmp_path, make_products):
+    config = project(tmp_path, search_cache_ttl=3600)
+    entry_path = save_search(search_cache_dir(config), build_search_options(config.download), make_products(3))
+    entry = json.loads(entry_path.read_text())
+    entry["created"] -= 7200
+    entry_path.write_text(json.dumps(entry))
+    # the next download searches again
+    assert search_fingerprint(config) is None
+    # offline replays it whatever its age
+    config.download.offline = True
+    assert search_fingerprint(config) is not None
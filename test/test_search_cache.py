@@ -0,0 +1,154 @@
+import datetime
+
+import pytest
+import asf_search as asf
+
+from insarchitect.core.download.search_cache import (
+    MIN_WINDOW,
+    SearchCacheMiss,
+    cached_search,
+    exhaustive_search,
+    load_cached_search,
+    search_cache_key,
+    split_windows,
+    windowed_search,
+)
+
+AOI = "POLYGON((0 0, 2 0, 2 1, 0 1, 0 0))"
+# first acquisition of the synthetic products
+FIRST_ACQUISITION = datetime.datetime(2016, 8, 30, 0, 30)
+# 10 acquisitions of 3 frames, one every 6 days
+PRODUCTS = 30
+
+
+def file_ids(results) -> set:
+    return {product.properties["fileID"] for product in results}
+
+
+def search_options(**opts) -> dict:
+    return {
+        "start": datetime.datetime(2016, 8, 29),
+        "end": datetime.datetime(2016, 10, 29),
+        "intersectsWith": AOI,
+        "platform": "Sentinel-1",
+        **opts,
+    }
+
+
+def failing_search(**opts):
+    raise asf.exceptions.ASFSearch5xxError("ASF is down")
+
+
+def test_search_cache_key_normalizes_the_options():
+    # same polygon from another vertex, other case, unset options
+    same = search_options(intersectsWith="POLYGON((2 0, 2 1, 0 1, 0 0, 2 0))", platform="SENTINEL-1", maxResults=None)
+    assert search_cache_key(same) == search_cache_key(search_options())
+    assert search_cache_key(search_options(end=datetime.datetime(2016, 10, 30))) != search_cache_key(search_options())
+
+
+def test_cached_search_replays_within_ttl(tmp_path, make_products, search_stand_in):
+    products = make_products(9)
+    search = search_stand_in(products)
+    first = cached_search(search_options(), tmp_path, ttl=3600, search_fn=search)
+    again = cached_search(search_options(), tmp_path, ttl=3600, search_fn=search)
+    assert file_ids(first) == file_ids(again) == file_ids(products)
+    assert search.calls == 1
+
+    cached_search(search_options(), tmp_path / "off", ttl=0, search_fn=search)
+    assert load_cached_search(tmp_path / "off", search_options()) is None
+
+
+def test_cached_search_offline(tmp_path, make_products, search_stand_in):
+    with pytest.raises(SearchCacheMiss):
+        cached_search(search_options(), tmp_path, ttl=3600, offline=True)
+    cached_search(search_options(), tmp_path, ttl=3600, search_fn=search_stand_in(make_products(3)))
+    # offline replays whatever the age of the entry
+    assert len(cached_search(search_options(), tmp_path, ttl=1e-9, offline=True)) == 3
+
+
+def test_cached_search_falls_back_to_an_expired_entry(tmp_path, make_products, search_stand_in, capsys):
+    cached_search(search_options(), tmp_path, ttl=3600, search_fn=search_stand_in(make_products(3)))
+    assert len(cached_search(search_options(), tmp_path, ttl=1e-9, search_fn=failing_search)) == 3
+    assert "replaying expired cached search" in capsys.readouterr().out
+
+    with pytest.raises(asf.exceptions.ASFSearchError):
+        cached_search(search_options(), tmp_path / "empty", ttl=3600, search_fn=failing_search)
+
+
+def window_options(max_results=None) -> dict:
+    return {
+        "start": datetime.datetime(2016, 8, 29),
+        "end": datetime.datetime(2016, 8, 29) + datetime.timedelta(days=60),
+        "maxResults": max_results,
+    }
+
+
+def test_split_windows_covers_the_range():
+    opts = window_options()
+    windows = split_windows(opts, 25)
+    assert [window["start"] for window in windows] == [
+        opts["start"],
+        opts["start"] + datetime.timedelta(days=25),
+        opts["start"] + datetime.timedelta(days=50),
+    ]
+    assert windows[-1]["end"] == opts["end"]
+    assert all(earlier["end"] == later["start"] for earlier, later in zip(windows, windows[1:]))
+    assert all(window["maxResults"] is None for window in windows)
+
+
+def test_split_windows_keeps_short_ranges_whole():
+    opts = window_options()
+    assert split_windows(opts, 0) == [opts]
+    assert split_windows(opts, 61) == [opts]
+
+
+def test_exhaustive_search_splits_cut_windows(tmp_path, make_products, search_stand_in):
+    products = make_products(PRODUCTS)
+    search = search_stand_in(products)
+    results = exhaustive_search(window_options(max_results=5), tmp_path, ttl=0, search_fn=search)
+    assert file_ids(results) == file_ids(products)
+    assert len(results) == PRODUCTS and results.searchComplete
+    assert search.calls > 1
+
+
+def test_exhaustive_search_caches_only_complete_windows(tmp_path, make_products, search_stand_in):
+    products = make_products(PRODUCTS)
+    opts = window_options(max_results=5)
+    exhaustive_search(opts, tmp_path, ttl=3600, search_fn=search_stand_in(products))
+    # the whole range hit maxResults, caching it would replay 5 products
+    assert load_cached_search(tmp_path, opts) is None
+
+    day = {**opts, "start": FIRST_ACQUISITION - datetime.timedelta(hours=1)}
+    day["end"] = day["start"] + MIN_WINDOW
+    exhaustive_search(day, tmp_path, ttl=3600, search_fn=search_stand_in(products))
+    assert len(load_cached_search(tmp_path, day)) == 3
+
+
+def test_exhaustive_search_reports_a_day_cut_at_max_results(tmp_path, make_products, search_stand_in, capsys):
+    day = {**window_options(max_results=2), "start": FIRST_ACQUISITION - datetime.timedelta(hours=1)}
+    day["end"] = day["start"] + MIN_WINDOW
+    results = exhaustive_search(day, tmp_path, ttl=3600, search_fn=search_stand_in(make_products(PRODUCTS)))
+    assert len(results) == 2 and not results.searchComplete
+    assert "some may be missing" in capsys.readouterr().out
+    assert load_cached_search(tmp_path, day) is None
+
+
+def test_windowed_search_caches_the_merged_range(tmp_path, make_products, search_stand_in):
+    products = make_products(PRODUCTS)
+    opts = window_options(max_results=5)
+    windows = list(windowed_search(opts, tmp_path, ttl=3600, window_days=20, workers=2, search_fn=search_stand_in(products)))
+    assert sum(len(window) for window in windows) == PRODUCTS
+    assert file_ids(load_cached_search(tmp_path, opts)) == file_ids(products)
+
+    replayed = list(windowed_search(opts, tmp_path, ttl=3600, offline=True))
+    assert len(replayed) == 1
+    assert file_ids(replayed[0]) == file_ids(products)
+
+
+def test_windowed_search_does_not_cache_a_cut_range(tmp_path, make_products, search_stand_in, capsys):
+    # an acquisition has 3 frames, a day window cannot hold them
+    opts = window_options(max_results=2)
+    windows = list(windowed_search(opts, tmp_path, ttl=3600, window_days=20, search_fn=search_stand_in(make_products(PRODUCTS))))
+    assert not all(window.searchComplete for window in windows)
+    assert "not caching it" in capsys.readouterr().out
+    assert load_cached_search(tmp_path, opts) is None
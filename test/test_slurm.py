@@ -0,0 +1,69 @@
+import threading
+import subprocess
+
+import pytest
+
+from insarchitect.core.jobfiles.slurm import pack_tasks, pending_jobs, wait_for_jobs
+
+TASKS = [f"task {i}" for i in range(10)]
+
+
+def tasks_of(packs) -> list:
+    return [task for pack in packs for task in pack.tasks]
+
+
+def test_pack_tasks_fills_the_walltime_evenly():
+    packs = pack_tasks(TASKS, minutes=30, memory=2000, max_minutes=120, max_packs=100)
+    assert [len(pack.tasks) for pack in packs] == [4, 3, 3]
+    assert [pack.minutes for pack in packs] == [120, 90, 90]
+    assert {pack.memory for pack in packs} == {2000}
+    assert tasks_of(packs) == TASKS
+
+
+def test_pack_tasks_grows_the_walltime_past_max_packs():
+    packs = pack_tasks(TASKS, minutes=30, memory=2000, max_minutes=120, max_packs=2)
+    assert [len(pack.tasks) for pack in packs] == [5, 5]
+    assert [pack.minutes for pack in packs] == [150, 150]
+    assert tasks_of(packs) == TASKS
+
+
+def test_pack_tasks_edge_cases():
+    assert pack_tasks([], minutes=30, memory=2000, max_minutes=120, max_packs=10) == []
+    # a task longer than the walltime still gets an element of its own
+    assert [len(pack.tasks) for pack in pack_tasks(TASKS[:3], minutes=200, memory=1, max_minutes=120, max_packs=10)] == [1, 1, 1]
+    assert len(pack_tasks(TASKS, minutes=0, memory=1, max_minutes=120, max_packs=10)) == 1
+
+
+def fake_command(tmp_path, name: str, script: str) -> str:
+    """Stand-in for a Slurm command, it logs its arguments to <name>.log"""
+    path = tmp_path / name
+    path.write_text(f'#!/bin/bash\necho "$@" >> {tmp_path / name}.log\n{script}\n')
+    path.chmod(0o755)
+    return str(path)
+
+
+def test_pending_jobs_counts_purged_jobs_as_finished(tmp_path):
+    # 11 was purged, squeue refuses every list it is part of
+    squeue = fake_command(tmp_path, "squeue", """
+case "$3" in
+  *11*) echo "slurm_load_jobs error: Invalid job id specified" >&2; exit 1 ;;
+  *12*) echo "12_[2-4]" ;;
+esac""")
+    assert pending_jobs(["11", "12"], squeue) == {"12"}
+    assert pending_jobs(["11"], squeue) == set()
+
+    failing = fake_command(tmp_path, "broken", 'echo "Unable to contact slurm controller" >&2; exit 1')
+    with pytest.raises(subprocess.CalledProcessError):
+        pending_jobs(["12"], failing)
+
+
+def test_wait_for_jobs_cancels_the_pending_arrays(tmp_path):
+    squeue = fake_command(tmp_path, "squeue", 'echo "12_[2-4]"; echo "13_[0-4]"')
+    scancel = fake_command(tmp_path, "scancel", "")
+    cancel = threading.Event()
+    cancel.set()
+    assert wait_for_jobs(["11", "12", "13"], squeue, poll_interval=60, cancel=cancel, scancel_command=scancel) == {"12", "13"}
+    assert (tmp_path / "scancel.log").read_text() == "12 13\n"
+
+    done = fake_command(tmp_path, "done", "")
+    assert wait_for_jobs(["12"], done, poll_interval=60, cancel=cancel, scancel_command=scancel) == set()
@@ -0,0 +1,72 @@
+import math
+import datetime
+
+import numpy as np
+import pytest
+
+from insarchitect.core.jobfiles.orbit_store import OrbitIndex, Scene, VectorConverter
+from insarchitect.core.jobfiles.state_vectors import parse_eof
+
+RADIUS = 7.07e6
+PERIOD = 98.6 * 60
+SPACING = 10
+
+
+def state(seconds: float, radius: float = RADIUS):
+    """Equatorial circular orbit, position and velocity seconds after the start of its file"""
+    angle = 2 * math.pi * seconds / PERIOD
+    speed = 2 * math.pi * radius / PERIOD
+    return (radius * math.cos(angle), radius * math.sin(angle), 0.0), (-speed * math.sin(angle), speed * math.cos(angle), 0.0)
+
+
+def write_eof(orbits_dir, day: datetime.datetime, radius: float = RADIUS, vectors: int = 361):
+    """POEORB of an hour of 10 s state vectors from day"""
+    end = day + datetime.timedelta(seconds=(vectors - 1) * SPACING)
+    osvs = []
+    for i in range(vectors):
+        (x, y, z), (vx, vy, vz) = state(i * SPACING, radius)
+        utc = day + datetime.timedelta(seconds=i * SPACING)
+        osvs.append(
+            f"<OSV><UTC>UTC={utc:%Y-%m-%dT%H:%M:%S.%f}</UTC>"
+            f"<X unit=\"m\">{x:.6f}</X><Y unit=\"m\">{y:.6f}</Y><Z unit=\"m\">{z:.6f}</Z>"
+            f"<VX unit=\"m/s\">{vx:.6f}</VX><VY unit=\"m/s\">{vy:.6f}</VY><VZ unit=\"m/s\">{vz:.6f}</VZ></OSV>"
+        )
+    path = orbits_dir / f"S1A_OPER_AUX_POEORB_OPOD_20161001T000000_V{day:%Y%m%dT%H%M%S}_{end:%Y%m%dT%H%M%S}.EOF"
+    path.write_text(f"<Earth_Explorer_File><Data_Block><List_of_OSVs>{''.join(osvs)}</List_of_OSVs></Data_Block></Earth_Explorer_File>")
+    return path
+
+
+def test_parse_eof(tmp_path):
+    vectors = parse_eof(write_eof(tmp_path, datetime.datetime(2016, 8, 30)))
+    assert len(vectors.times) == 361
+    assert vectors.times[1] - vectors.times[0] == np.timedelta64(SPACING, "s")
+    position, velocity = state(SPACING)
+    assert vectors.positions[1] == pytest.approx(position, abs=1e-6)
+    assert vectors.velocities[1] == pytest.approx(velocity, abs=1e-6)
+
+    broken = tmp_path / "broken.EOF"
+    broken.write_text(write_eof(tmp_path, datetime.datetime(2016, 8, 31)).read_text().replace("<VZ unit=\"m/s\">", "<VZ>x", 1))
+    with pytest.raises(ValueError):
+        parse_eof(broken)
+
+
+def test_converted_vectors_give_the_baselines(tmp_path):
+    first = datetime.datetime(2016, 8, 30)
+    second = datetime.datetime(2016, 9, 5)
+    paths = [write_eof(tmp_path, first), write_eof(tmp_path, second, radius=RADIUS + 100)]
+    index = OrbitIndex(tmp_path)
+    with VectorConverter(index) as converter:
+        converter.submit([*paths, None, *paths])
+        assert converter.close() == 2
+    assert all(index.vectors.is_current(path) for path in paths)
+    converter.submit(paths)
+    assert converter.close() == 0
+
+    scenes = [
+        Scene.from_name(f"S1A_IW_SLC__1SDV_{day:%Y%m%d}T003000_{day:%Y%m%d}T003027_012800_014000_ABCD")
+        for day in (first, second)
+    ]
+    baselines = index.vectors.baselines(index, scenes[0], scenes)
+    assert baselines.radial == pytest.approx([0, 100], abs=1e-3)
+    assert baselines.along == pytest.approx([0, 0], abs=1e-3)
+    assert baselines.cross == pytest.approx([0, 0], abs=1e-3)
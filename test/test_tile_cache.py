@@ -0,0 +1,55 @@
+import os
+import time
+
+import pytest
+
+from insarchitect.core.dem import tile_cache
+from insarchitect.core.dem.tile_cache import TileCache, directory_fetcher
+from insarchitect.core.dem.tiles import tile_name
+
+TILES = [(-100, 19), (-99, 19), (-99, 20)]
+
+
+@pytest.fixture
+def cache(tmp_path):
+    source_dir = tmp_path / "source"
+    source_dir.mkdir()
+    for number, tile in enumerate(TILES):
+        (source_dir / f"{tile_name(tile)}_COP.dem").write_bytes(bytes([number]) * 1000)
+    return TileCache(tmp_path / "cache", max_bytes=2500, fetch_fn=directory_fetcher(source_dir))
+
+
+def test_get_fetches_once_and_hashes_once(cache, monkeypatch):
+    path = cache.get(TILES[0], "COP")
+    index_stat = cache.index_path.stat()
+    monkeypatch.setattr(tile_cache, "_sha256", lambda path: pytest.fail("hashed a cached tile"))
+    monkeypatch.setattr(cache, "fetch_fn", lambda *args: pytest.fail("fetched a cached tile"))
+    os.utime(path, ns=(0, path.stat().st_mtime_ns))
+
+    assert cache.get(TILES[0], "COP") == path
+    # the use is recorded in the object, not in the shared index
+    assert path.stat().st_atime > 0
+    assert cache.index_path.stat().st_mtime_ns == index_stat.st_mtime_ns
+
+
+def test_lookup_drops_changed_objects(cache):
+    path = cache.get(TILES[0], "COP")
+    with open(path, "ab") as f:
+        f.write(b"x")
+    assert cache.lookup(TILES[0], "COP") is None
+    assert not path.exists()
+
+    path = cache.get(TILES[1], "COP")
+    path.write_bytes(bytes([9]) * 1000)
+    os.utime(path, ns=(0, path.stat().st_mtime_ns + 10**9))
+    assert cache.lookup(TILES[1], "COP") is None
+
+
+def test_evict_removes_the_least_recently_used(cache):
+    paths = [cache.get(tile, "COP") for tile in TILES]
+    now = time.time_ns()
+    for age, path in zip((0, 200, 100), paths):
+        os.utime(path, ns=(now + (1000 - age) * 10**9, path.stat().st_mtime_ns))
+    removed = cache.evict(protect=[paths[2]])
+    assert removed == [paths[1].stem]
+    assert cache.size() == 2000
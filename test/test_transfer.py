@@ -0,0 +1,102 @@
+import hashlib
+import threading
+
+import pytest
+import requests
+from asf_search.exceptions import ASFAuthenticationError
+
+from insarchitect.core.download import transfer
+from insarchitect.core.download.concurrency import AdaptiveConcurrency
+from insarchitect.core.download.transfer import (
+    ChecksumMismatch,
+    DownloadCancelled,
+    ProductNotReady,
+    Throttled,
+    _open_stream,
+    download_file,
+    part_path,
+)
+
+SIZE = 256 * 1024
+
+
+def open_stream(server, path: str, offset: int = 0, cancel=None) -> requests.Response:
+    return _open_stream(requests.Session(), f"{server.base_url}/{path}", offset, cancel)
+
+
+def test_open_stream_resumes_with_a_range(http_server):
+    with open_stream(http_server, f"files/{SIZE}/product.zip") as response:
+        assert response.status_code == 200
+    with open_stream(http_server, f"files/{SIZE}/product.zip", offset=1000) as response:
+        assert response.status_code == 206
+        assert response.headers["Content-Range"] == f"bytes 1000-{SIZE - 1}/{SIZE}"
+    # a complete .part file, left for the caller to check
+    with open_stream(http_server, f"files/{SIZE}/product.zip", offset=SIZE) as response:
+        assert response.status_code == 416
+
+
+def test_download_file_resumes_a_part_file(tmp_path, http_server, served_file):
+    content = served_file("product.zip", SIZE)
+    path = tmp_path / "product.zip"
+    part_path(path).write_bytes(content[:1000])
+    progress = []
+    download_file(
+        f"{http_server.base_url}/files/{SIZE}/product.zip", path, requests.Session(),
+        expected_size=SIZE, md5sum=hashlib.md5(content).hexdigest(), on_progress=progress.append,
+    )
+    assert path.read_bytes() == content
+    assert not part_path(path).exists()
+    assert progress[0] == 1000 and sum(progress) == SIZE
+
+
+def test_download_file_checksum_mismatch(tmp_path, http_server):
+    path = tmp_path / "product.zip"
+    with pytest.raises(ChecksumMismatch):
+        download_file(f"{http_server.base_url}/files/{SIZE}/product.zip", path, requests.Session(), expected_size=SIZE, md5sum="0" * 32)
+    assert not path.exists() and not part_path(path).exists()
+
+
+@pytest.mark.parametrize("status, retry_after", [(429, 1.0), (503, None)])
+def test_open_stream_throttled(http_server, status, retry_after):
+    with pytest.raises(Throttled) as raised:
+        open_stream(http_server, f"status/{status}")
+    assert (raised.value.status, raised.value.retry_after) == (status, retry_after)
+
+
+@pytest.mark.parametrize("status", [401, 403])
+def test_open_stream_refused_credentials(http_server, status):
+    with pytest.raises(ASFAuthenticationError):
+        open_stream(http_server, f"status/{status}")
+
+
+def test_open_stream_missing_product(http_server):
+    with pytest.raises(requests.HTTPError) as raised:
+        open_stream(http_server, "status/404")
+    assert not isinstance(raised.value, ASFAuthenticationError)
+    assert raised.value.response.status_code == 404
+
+
+def test_open_stream_processing_timeout(http_server, monkeypatch):
+    monkeypatch.setattr(transfer, "PROCESSING_TIMEOUT", 0)
+    with pytest.raises(ProductNotReady):
+        open_stream(http_server, "status/202")
+
+
+def test_open_stream_processing_cancelled(http_server):
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(DownloadCancelled):
+        open_stream(http_server, "status/202", cancel=cancel)
+    assert http_server.paths == ["/status/202"]
+
+
+def test_slot_is_not_taken_once_cancelled():
+    concurrency = AdaptiveConcurrency(1, initial=1)
+    cancel = threading.Event()
+    with concurrency.slot(cancel):
+        cancel.set()
+        with pytest.raises(DownloadCancelled):
+            with concurrency.slot(cancel):
+                pytest.fail("started a transfer after the cancel")
+        assert concurrency.running == 1
+    assert concurrency.running == 0